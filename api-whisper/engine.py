@@ -0,0 +1,432 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import torch
+import whisper
+from whisper.audio import FRAMES_PER_SECOND, HOP_LENGTH, N_FRAMES, N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram, pad_or_trim
+from whisper.timing import add_word_timestamps
+from whisper.tokenizer import get_tokenizer
+from whisper.utils import get_end
+
+from metrics import ACTIVE_JOBS, BATCH_SIZE, MODEL_LOAD_SECONDS, STEP_SECONDS, timed
+
+AVAILABLE_MODELS = ('tiny', 'base', 'small', 'medium', 'large')
+# Parameter counts of the Whisper models; weights are kept in fp32 (4 bytes each)
+MODEL_PARAMS = {'tiny': 39e6, 'base': 74e6, 'small': 244e6, 'medium': 769e6, 'large': 1550e6}
+# How much memory loaded models may occupy together; least recently used ones are unloaded first
+MODEL_MEMORY_BUDGET = int(os.getenv('WHISPER_MODEL_MEMORY_BUDGET', str(4 * 1024 ** 3)))
+# How many 30-second windows from concurrent requests are decoded in one forward pass
+MAX_BATCH = int(os.getenv('WHISPER_MAX_BATCH', '8'))
+# How long the worker waits for more requests before starting a new batch
+BATCH_WAIT = float(os.getenv('WHISPER_BATCH_WAIT', '0.05'))
+
+# Same thresholds as whisper.transcribe defaults
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+# Windows that look like a repetition loop or garbage are decoded again at the next temperature
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+def needs_fallback(result):
+    '''Same check as whisper.transcribe: silence is never retried.'''
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+        return False
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+def estimated_model_bytes(name):
+    return int(MODEL_PARAMS[name] * 4)
+
+
+def model_size_bytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    '''
+    Loads Whisper models on demand and keeps the most recently used ones resident
+    while their total size fits into the memory budget.
+    '''
+
+    def __init__(self, device, budget=MODEL_MEMORY_BUDGET):
+        self.device = device
+        self.budget = budget
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.in_use = {}
+        # Memory held outside this process on behalf of a model (e.g. long-audio worker pools)
+        self.reserved = {}
+        self.lock = threading.Lock()
+        self.load_locks = {name: threading.Lock() for name in AVAILABLE_MODELS}
+        oversized = [name for name in AVAILABLE_MODELS if estimated_model_bytes(name) > budget]
+        if oversized:
+            logging.warning(f"Whisper models {', '.join(oversized)} do not fit into the memory budget of {budget / 1024 ** 3:.1f} GB: "
+                            f"each request loads them anew and unloads them afterwards, raise WHISPER_MODEL_MEMORY_BUDGET to keep them resident")
+
+    def acquire(self, name):
+        if name not in AVAILABLE_MODELS:
+            raise ValueError(f"Unknown model '{name}'. Available: {', '.join(AVAILABLE_MODELS)}")
+        with self.load_locks[name]:
+            with self.lock:
+                model = self.models.get(name)
+                if model is not None:
+                    self.models.move_to_end(name)
+                    self.in_use[name] = self.in_use.get(name, 0) + 1
+                    return model
+            logging.info(f"Loading Whisper model '{name}'")
+            with timed(MODEL_LOAD_SECONDS, name):
+                model = whisper.load_model(name, device=self.device)
+            with self.lock:
+                self.models[name] = model
+                self.sizes[name] = model_size_bytes(model)
+                self.in_use[name] = self.in_use.get(name, 0) + 1
+                self._evict()
+            logging.info(f"Whisper model '{name}' loaded ({self.sizes[name] / 1024 ** 2:.0f} MB)")
+            return model
+
+    def release(self, name):
+        with self.lock:
+            self.in_use[name] -= 1
+            self._evict()
+
+    def reserve(self, key, size):
+        '''Counts size bytes against the budget until unreserve(key); idle resident models are unloaded to make room.'''
+        with self.lock:
+            self.reserved[key] = size
+            self._evict()
+            total = sum(self.sizes[name] for name in self.models) + sum(self.reserved.values())
+        if total > self.budget:
+            logging.warning(f"Whisper memory over budget: {total / 1024 ** 2:.0f} MB of {self.budget / 1024 ** 2:.0f} MB")
+
+    def unreserve(self, key):
+        with self.lock:
+            self.reserved.pop(key, None)
+
+    def _evict(self):
+        total = sum(self.sizes[name] for name in self.models) + sum(self.reserved.values())
+        for name in list(self.models):
+            if total <= self.budget:
+                break
+            if self.in_use.get(name, 0) > 0:
+                continue
+            del self.models[name]
+            total -= self.sizes.pop(name)
+            logging.info(f"Whisper model '{name}' unloaded")
+        if self.device == 'cuda':
+            torch.cuda.empty_cache()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'budget': self.budget,
+                'loaded': {name: self.sizes[name] for name in self.models},
+                'in_use': {name: count for name, count in self.in_use.items() if count},
+                'reserved': dict(self.reserved),
+            }
+
+
+class TranscriptionJob:
+    def __init__(self, audio, model_name, language=None, on_segments=None):
+        self.audio = audio
+        self.model_name = model_name
+        self.language = language
+        self.on_segments = on_segments
+        self.future = Future()
+        # Acquired from the ModelRegistry on the first step and released when the job finishes
+        self.model = None
+        self.mel = None
+        self.content_frames = 0
+        self.seek = 0
+        self.segments = []
+        self.tokens = []
+        self.last_speech_timestamp = 0.0
+
+    @property
+    def done(self):
+        return self.mel is not None and self.seek >= self.content_frames
+
+    def prepare(self, model):
+        # Pad 30 seconds of silence so the last window can always be sliced
+        self.mel = log_mel_spectrogram(self.audio, model.dims.n_mels, padding=N_SAMPLES)
+        self.content_frames = self.mel.shape[-1] - N_FRAMES
+        self.audio = None
+        if self.language is None and not model.is_multilingual:
+            self.language = 'en'
+
+    def window(self):
+        segment_size = min(N_FRAMES, self.content_frames - self.seek)
+        return pad_or_trim(self.mel[:, self.seek:self.seek + segment_size], N_FRAMES), segment_size
+
+    def advance(self, model, tokenizer, result, mel_segment, segment_size):
+        '''
+        Turns the decoded window into segments and moves the seek pointer,
+        following the same rules as whisper.transcribe with word_timestamps=True.
+        '''
+        input_stride = N_FRAMES // model.dims.n_audio_ctx
+        time_precision = input_stride * HOP_LENGTH / SAMPLE_RATE
+        time_offset = float(self.seek * HOP_LENGTH / SAMPLE_RATE)
+        previous_seek = self.seek
+
+        if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+            self.seek += segment_size
+            return
+
+        def new_segment(start, end, tokens):
+            tokens = tokens.tolist()
+            return {
+                'seek': previous_seek,
+                'start': start,
+                'end': end,
+                'text': tokenizer.decode([token for token in tokens if token < tokenizer.eot]),
+                'tokens': tokens,
+                'temperature': result.temperature,
+                'avg_logprob': result.avg_logprob,
+                'compression_ratio': result.compression_ratio,
+                'no_speech_prob': result.no_speech_prob,
+            }
+
+        tokens = torch.tensor(result.tokens)
+        timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+        single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+        consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0]
+        consecutive.add_(1)
+        current_segments = []
+        if len(consecutive) > 0:
+            slices = consecutive.tolist()
+            if single_timestamp_ending:
+                slices.append(len(tokens))
+            last_slice = 0
+            for current_slice in slices:
+                sliced_tokens = tokens[last_slice:current_slice]
+                start = time_offset + (sliced_tokens[0].item() - tokenizer.timestamp_begin) * time_precision
+                end = time_offset + (sliced_tokens[-1].item() - tokenizer.timestamp_begin) * time_precision
+                current_segments.append(new_segment(start, end, sliced_tokens))
+                last_slice = current_slice
+            if single_timestamp_ending:
+                self.seek += segment_size
+            else:
+                self.seek += (tokens[last_slice - 1].item() - tokenizer.timestamp_begin) * input_stride
+        else:
+            duration = segment_size * HOP_LENGTH / SAMPLE_RATE
+            timestamps = tokens[timestamp_tokens.nonzero().flatten()]
+            if len(timestamps) > 0 and timestamps[-1].item() != tokenizer.timestamp_begin:
+                duration = (timestamps[-1].item() - tokenizer.timestamp_begin) * time_precision
+            current_segments.append(new_segment(time_offset, time_offset + duration, tokens))
+            self.seek += segment_size
+
+        add_word_timestamps(
+            segments=current_segments,
+            model=model,
+            tokenizer=tokenizer,
+            mel=mel_segment,
+            num_frames=segment_size,
+            last_speech_timestamp=self.last_speech_timestamp,
+        )
+        last_word_end = get_end(current_segments)
+        if not single_timestamp_ending and last_word_end is not None and last_word_end > time_offset:
+            self.seek = round(last_word_end * FRAMES_PER_SECOND)
+        if last_word_end is not None:
+            self.last_speech_timestamp = last_word_end
+        # Never stall on a window that produced no progress
+        if self.seek <= previous_seek:
+            self.seek = previous_seek + segment_size
+
+        for segment in current_segments:
+            if segment['start'] == segment['end'] or segment['text'].strip() == '':
+                segment['text'] = ''
+                segment['tokens'] = []
+                segment['words'] = []
+            segment['id'] = len(self.segments)
+            self.segments.append(segment)
+            self.tokens.extend(segment['tokens'])
+        if self.on_segments is not None:
+            self.on_segments(current_segments)
+
+    def result(self, tokenizer):
+        return {
+            'text': tokenizer.decode([token for token in self.tokens if token < tokenizer.eot]),
+            'segments': self.segments,
+            'language': self.language,
+        }
+
+
+class BatchingEngine:
+    '''
+    Runs Whisper inference on a background thread. Requests for the same model are
+    advanced together: each step decodes the next 30-second window of every active
+    request in a single batched forward pass, and new requests join between steps.
+    '''
+
+    def __init__(self, registry, max_batch=MAX_BATCH, batch_wait=BATCH_WAIT):
+        self.registry = registry
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name='whisper-engine', daemon=True)
+        self.thread.start()
+
+    def submit(self, audio, model_name='base', language=None, on_segments=None):
+        '''
+        Queues audio for transcription. on_segments, if given, is called on the
+        engine thread with the segments of every decoded window, in order.
+        '''
+        if model_name not in AVAILABLE_MODELS:
+            raise ValueError(f"Unknown model '{model_name}'. Available: {', '.join(AVAILABLE_MODELS)}")
+        job = TranscriptionJob(audio, model_name, language, on_segments)
+        self.queue.put(job)
+        return job.future
+
+    def _collect(self, active):
+        if not active:
+            active.append(self.queue.get())
+            deadline = time.monotonic() + self.batch_wait
+        else:
+            deadline = time.monotonic()
+        while True:
+            timeout = deadline - time.monotonic()
+            try:
+                job = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                return
+            active.append(job)
+
+    def _loop(self):
+        active = []
+        while True:
+            self._collect(active)
+            ACTIVE_JOBS.set(len(active))
+            model_name = active[0].model_name
+            group = [job for job in active if job.model_name == model_name][:self.max_batch]
+            try:
+                with timed(STEP_SECONDS):
+                    finished = self._step(model_name, group)
+            except Exception as e:
+                # Only failures outside the per-job handling (e.g. a broken batch of language detection results) end up here
+                logging.exception("Error in Whisper batch")
+                finished = {job: e for job in group}
+            for job in group:
+                # Rotate so that requests for other models get their turn
+                active.remove(job)
+                outcome = finished.get(job)
+                if outcome is None:
+                    active.append(job)
+                    continue
+                self._unpin(job)
+                if isinstance(outcome, Exception):
+                    job.future.set_exception(outcome)
+                else:
+                    job.future.set_result(outcome)
+            ACTIVE_JOBS.set(len(active))
+
+    def _unpin(self, job):
+        if job.model is not None:
+            job.model = None
+            self.registry.release(job.model_name)
+
+    def _fail(self, finished, job, error):
+        logging.error(f"Whisper job failed: {error!r}", exc_info=error)
+        finished[job] = error
+
+    def _step(self, model_name, group):
+        '''
+        Advances every job of the group by one window. A job that raises (bad audio,
+        a failing on_segments callback) is failed on its own; the rest keep going.
+        '''
+        finished = {}
+        for job in group:
+            if job.model is None:
+                # The model stays pinned until the job finishes, so it is not unloaded between windows
+                try:
+                    job.model = self.registry.acquire(model_name)
+                    job.prepare(job.model)
+                except Exception as e:
+                    self._fail(finished, job, e)
+        pinned = [job.model for job in group if job.model is not None and job not in finished]
+        if not pinned:
+            return finished
+        model = pinned[0]
+        fp16 = model.device.type == 'cuda'
+        dtype = torch.float16 if fp16 else torch.float32
+
+        undetected = [job for job in group if job not in finished and job.language is None]
+        if undetected:
+            self._detect_language(model, undetected, dtype, finished)
+
+        by_language = {}
+        for job in group:
+            if job in finished:
+                continue
+            if job.done:
+                finished[job] = job.result(self._tokenizer(model, job.language))
+            else:
+                by_language.setdefault(job.language, []).append(job)
+
+        for language, jobs in by_language.items():
+            tokenizer = self._tokenizer(model, language)
+            windows = [job.window() for job in jobs]
+            mels = torch.stack([mel for mel, _ in windows]).to(model.device).to(dtype)
+            BATCH_SIZE.observe(len(jobs))
+            results = self._decode(model, mels, language, fp16)
+            for job, result, mel_segment, (_, segment_size) in zip(jobs, results, mels, windows):
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    if needs_fallback(result):
+                        result = self._decode_with_fallback(model, mel_segment, language, fp16, result)
+                    job.advance(model, tokenizer, result, mel_segment, segment_size)
+                    if job.done:
+                        finished[job] = job.result(tokenizer)
+                except Exception as e:
+                    self._fail(finished, job, e)
+        return finished
+
+    def _detect_language(self, model, jobs, dtype, finished):
+        mels = [pad_or_trim(job.mel, N_FRAMES) for job in jobs]
+        try:
+            _, probs = model.detect_language(torch.stack(mels).to(model.device).to(dtype))
+        except Exception:
+            # Find out which job breaks the batch: detect one by one
+            probs = []
+            for job, mel in zip(jobs, mels):
+                try:
+                    probs.append(model.detect_language(mel[None].to(model.device).to(dtype))[1][0])
+                except Exception as e:
+                    probs.append(None)
+                    self._fail(finished, job, e)
+        for job, job_probs in zip(jobs, probs):
+            if job_probs is not None:
+                job.language = max(job_probs, key=job_probs.get)
+
+    def _decode(self, model, mels, language, fp16, temperature=0.0):
+        '''Decodes a batch of windows; if the batch fails, each window is decoded alone and gets its own result or exception.'''
+        options = whisper.DecodingOptions(language=language, fp16=fp16, temperature=temperature)
+        try:
+            return whisper.decode(model, mels, options)
+        except Exception:
+            if len(mels) == 1:
+                raise
+            results = []
+            for mel in mels:
+                try:
+                    results.append(whisper.decode(model, mel[None], options)[0])
+                except Exception as e:
+                    results.append(e)
+            return results
+
+    def _decode_with_fallback(self, model, mel, language, fp16, result):
+        '''Re-decodes one window at increasing temperatures, like whisper.transcribe does.'''
+        for temperature in TEMPERATURES[1:]:
+            result = self._decode(model, mel[None], language, fp16, temperature)[0]
+            if not needs_fallback(result):
+                break
+        return result
+
+    def _tokenizer(self, model, language):
+        return get_tokenizer(model.is_multilingual, num_languages=model.num_languages, language=language, task='transcribe')
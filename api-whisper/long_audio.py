@@ -0,0 +1,235 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from whisper.audio import N_SAMPLES, SAMPLE_RATE
+
+from engine import AVAILABLE_MODELS, estimated_model_bytes
+
+# Audio longer than this is split and transcribed in parallel when long_audio is not set explicitly
+LONG_AUDIO_THRESHOLD = float(os.getenv('LONG_AUDIO_THRESHOLD', '600'))
+# Desired chunk length; actual cuts are moved to the quietest point nearby
+LONG_AUDIO_CHUNK_SECONDS = float(os.getenv('LONG_AUDIO_CHUNK_SECONDS', '300'))
+# How far from the desired cut we look for silence
+LONG_AUDIO_SEARCH_SECONDS = float(os.getenv('LONG_AUDIO_SEARCH_SECONDS', '15'))
+LONG_AUDIO_WORKERS = int(os.getenv('LONG_AUDIO_WORKERS', str(max(1, min(4, (os.cpu_count() or 1) // 2)))))
+# How many worker pools (one per model) may exist at once; requests for another model wait for an idle pool
+LONG_AUDIO_MAX_POOLS = int(os.getenv('LONG_AUDIO_MAX_POOLS', '1'))
+# Idle pools are shut down after this many seconds
+LONG_AUDIO_POOL_IDLE = float(os.getenv('LONG_AUDIO_POOL_IDLE', '300'))
+
+VAD_FRAME_SECONDS = 0.03
+# Silence must last at least this long to be used as a cut point
+VAD_MIN_SILENCE_SECONDS = 0.3
+
+
+def frame_energy(audio, frame_size):
+    n_frames = len(audio) // frame_size
+    frames = audio[:n_frames * frame_size].reshape(n_frames, frame_size)
+    return np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1) + 1e-12)
+
+
+def find_split_points(audio, chunk_seconds=LONG_AUDIO_CHUNK_SECONDS, search_seconds=LONG_AUDIO_SEARCH_SECONDS):
+    '''
+    Energy-based VAD: returns sample offsets where the audio should be cut, each one
+    placed in the quietest stretch within search_seconds of the desired chunk boundary.
+    '''
+    frame_size = int(VAD_FRAME_SECONDS * SAMPLE_RATE)
+    energy = frame_energy(audio, frame_size)
+    if len(energy) == 0:
+        return []
+    # Smooth over the minimum silence length so single quiet frames inside words are ignored
+    window = max(1, int(VAD_MIN_SILENCE_SECONDS / VAD_FRAME_SECONDS))
+    smoothed = np.convolve(energy, np.ones(window) / window, mode='same')
+
+    frames_per_chunk = int(chunk_seconds / VAD_FRAME_SECONDS)
+    search = int(search_seconds / VAD_FRAME_SECONDS)
+    points = []
+    target = frames_per_chunk
+    while target < len(smoothed) - frames_per_chunk // 4:
+        lo = max(target - search, (points[-1] // frame_size if points else 0) + 1)
+        hi = min(target + search, len(smoothed))
+        cut = lo + int(np.argmin(smoothed[lo:hi]))
+        points.append(cut * frame_size)
+        target = cut + frames_per_chunk
+    return points
+
+
+def split_audio(audio):
+    points = [0] + find_split_points(audio) + [len(audio)]
+    return [(start / SAMPLE_RATE, audio[start:end]) for start, end in zip(points[:-1], points[1:]) if end > start]
+
+
+def shift_result(result, offset):
+    for segment in result['segments']:
+        segment['start'] += offset
+        segment['end'] += offset
+        for word in segment.get('words', []):
+            word['start'] = round(word['start'] + offset, 2)
+            word['end'] = round(word['end'] + offset, 2)
+    return result
+
+
+def stitch_results(results):
+    '''
+    Joins per-chunk Whisper results (already shifted to absolute time) into one
+    result with the same structure as model.transcribe.
+    '''
+    segments = []
+    for result in results:
+        for segment in result['segments']:
+            segment['id'] = len(segments)
+            segments.append(segment)
+    return {
+        'text': ''.join(result['text'] for result in results),
+        'segments': segments,
+        'language': results[0]['language'] if results else None,
+    }
+
+
+# Worker process state: each process loads its own copy of the model once
+_worker_model = None
+
+
+def _init_worker(model_name, threads):
+    global _worker_model
+    import torch
+    import whisper
+    torch.set_num_threads(threads)
+    _worker_model = whisper.load_model(model_name, device='cpu')
+
+
+def _detect_language(audio):
+    import whisper
+    if not _worker_model.is_multilingual:
+        return 'en'
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), _worker_model.dims.n_mels)
+    _, probs = _worker_model.detect_language(mel)
+    return max(probs, key=probs.get)
+
+
+def _transcribe_chunk(offset, chunk, language):
+    result = _worker_model.transcribe(chunk, word_timestamps=True, language=language, fp16=False)
+    return shift_result(result, offset)
+
+
+class LongAudioTranscriber:
+    '''
+    Transcribes long audio by cutting it at silences and running the chunks in
+    parallel on a process pool. There is one pool per model, at most max_pools of
+    them; the least recently used idle pool is shut down to make room, and the
+    workers' model copies are counted against the ModelRegistry budget.
+    '''
+
+    def __init__(self, registry, workers=LONG_AUDIO_WORKERS, max_pools=LONG_AUDIO_MAX_POOLS, idle_seconds=LONG_AUDIO_POOL_IDLE):
+        self.registry = registry
+        self.workers = workers
+        self.max_pools = max_pools
+        self.idle_seconds = idle_seconds
+        self.pools = OrderedDict()
+        self.in_use = {}
+        self.last_used = {}
+        self.cond = threading.Condition()
+
+    def _acquire_pool(self, model_name):
+        stale = []
+        try:
+            with self.cond:
+                while True:
+                    pool = self.pools.get(model_name)
+                    if pool is not None:
+                        self.pools.move_to_end(model_name)
+                        self.in_use[model_name] += 1
+                        return pool
+                    if len(self.pools) < self.max_pools:
+                        break
+                    idle = next((name for name in self.pools if not self.in_use[name]), None)
+                    if idle is not None:
+                        stale.append(self._remove_pool(idle))
+                    else:
+                        self.cond.wait()
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(model_name, threads),
+                )
+                self.pools[model_name] = pool
+                self.in_use[model_name] = 1
+            self.registry.reserve(self._reservation(model_name), self.workers * estimated_model_bytes(model_name))
+            return pool
+        finally:
+            for pool in stale:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release_pool(self, model_name):
+        with self.cond:
+            self.in_use[model_name] -= 1
+            self.last_used[model_name] = time.monotonic()
+            self.cond.notify_all()
+        timer = threading.Timer(self.idle_seconds, self._shutdown_idle)
+        timer.daemon = True
+        timer.start()
+
+    def _remove_pool(self, model_name):
+        pool = self.pools.pop(model_name)
+        del self.in_use[model_name]
+        self.last_used.pop(model_name, None)
+        self.registry.unreserve(self._reservation(model_name))
+        logging.info(f"Long audio: worker pool for '{model_name}' shut down")
+        return pool
+
+    def _reservation(self, model_name):
+        return f'long_audio:{model_name}'
+
+    def _shutdown_idle(self):
+        now = time.monotonic()
+        with self.cond:
+            stale = [self._remove_pool(name) for name in list(self.pools)
+                     if not self.in_use[name] and now - self.last_used.get(name, now) >= self.idle_seconds]
+            if stale:
+                self.cond.notify_all()
+        for pool in stale:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self.cond:
+            pools = [self._remove_pool(name) for name in list(self.pools)]
+            self.cond.notify_all()
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def transcribe(self, audio, model_name='base', language=None, on_segments=None):
+        '''
+        on_segments, if given, receives each chunk's segments as soon as that chunk
+        and all chunks before it are done.
+        '''
+        if model_name not in AVAILABLE_MODELS:
+            raise ValueError(f"Unknown model '{model_name}'. Available: {', '.join(AVAILABLE_MODELS)}")
+        chunks = split_audio(audio)
+        logging.info(f"Long audio: {len(audio) / SAMPLE_RATE:.0f}s split into {len(chunks)} chunks")
+        pool = self._acquire_pool(model_name)
+        try:
+            if language is None:
+                # Detect once on the first 30 s, otherwise every chunk guesses its own language
+                language = pool.submit(_detect_language, audio[:N_SAMPLES]).result()
+                logging.info(f"Long audio: detected language '{language}'")
+            futures = [pool.submit(_transcribe_chunk, offset, chunk, language) for offset, chunk in chunks]
+            results = []
+            for future in futures:
+                results.append(future.result())
+                if on_segments is not None:
+                    on_segments(results[-1]['segments'])
+            return stitch_results(results)
+        finally:
+            self._release_pool(model_name)
+
+
+def is_long_audio(audio):
+    return len(audio) / SAMPLE_RATE >= LONG_AUDIO_THRESHOLD
@@ -0,0 +1,35 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+AUDIO_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+SIZE_BUCKETS = tuple(2 ** power for power in range(10, 32, 2))  # 1 KB ... 2 GB
+
+REQUEST_SECONDS = Histogram('whisper_request_duration_seconds', 'Time from upload to the last record sent',
+                            ['endpoint', 'mode'], buckets=DURATION_BUCKETS)
+STAGE_SECONDS = Histogram('whisper_stage_duration_seconds', 'Duration of a request stage',
+                          ['stage'], buckets=DURATION_BUCKETS)
+UPLOAD_BYTES = Histogram('whisper_upload_bytes', 'Size of uploaded audio files', buckets=SIZE_BUCKETS)
+AUDIO_SECONDS = Histogram('whisper_audio_duration_seconds', 'Duration of transcribed audio', buckets=AUDIO_BUCKETS)
+REQUEST_ERRORS = Counter('whisper_request_errors_total', 'Failed transcription requests', ['endpoint'])
+BATCH_SIZE = Histogram('whisper_decode_batch_size', 'Windows decoded in one batched forward pass',
+                       buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+STEP_SECONDS = Histogram('whisper_decode_step_seconds', 'Duration of one batched engine step', buckets=DURATION_BUCKETS)
+MODEL_LOAD_SECONDS = Histogram('whisper_model_load_seconds', 'Time to load a Whisper model', ['model'], buckets=DURATION_BUCKETS)
+QUEUE_DEPTH = Gauge('whisper_engine_queue_depth', 'Requests waiting for the batching engine')
+ACTIVE_JOBS = Gauge('whisper_engine_active_jobs', 'Requests currently being decoded by the batching engine')
+
+
+@contextmanager
+def timed(histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(*labels) if labels else histogram).observe(time.perf_counter() - start)
+
+
+def metrics_response():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,8 +1,21 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, File, Form, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, ValidationError
+from typing import Optional
+from engine import ModelRegistry, BatchingEngine
+from long_audio import LongAudioTranscriber, is_long_audio
+from metrics import (REQUEST_SECONDS, STAGE_SECONDS, UPLOAD_BYTES, AUDIO_SECONDS, REQUEST_ERRORS, QUEUE_DEPTH,
+                     timed, metrics_response)
+import time
+import asyncio
+import json
 import whisper
 import tempfile
 import os
+import shutil
+import wave
+import numpy as np
 import torch
 import logging
 
@@ -16,13 +29,32 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 device = "cuda" if torch.cuda.is_available() else "cpu"
 logging.info(f"Device selected: {device}")
 
-# Load the Whisper model
-model = whisper.load_model("base", device=device)
-logging.info("Whisper model loaded")
+# Models are loaded on first use and batched inference runs on a background worker
+registry = ModelRegistry(device)
+engine = BatchingEngine(registry)
+QUEUE_DEPTH.set_function(engine.queue.qsize)
+long_audio = LongAudioTranscriber(registry)
 
 # Define a Pydantic model for request validation
 class Request(BaseModel):
     model: str = "base"  # Available options: tiny, base, small, medium, large
+    language: Optional[str] = None
+    # Split at silences and transcribe chunks in parallel; None means auto for long audio on CPU
+    long_audio: Optional[bool] = None
+
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Decode audio for Whisper. 16 kHz mono PCM WAV is read directly; other formats
+# (FLAC, Opus, ...) go through whisper.load_audio, which decodes them with ffmpeg
+def load_audio(path):
+    try:
+        with wave.open(path, 'rb') as wav:
+            if wav.getframerate() == whisper.audio.SAMPLE_RATE and wav.getnchannels() == 1 and wav.getsampwidth() == 2:
+                pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+                return pcm.astype(np.float32) / 32768.0
+    except (wave.Error, EOFError):
+        pass
+    return whisper.load_audio(path)
 
 # Function to split subtitles by individual words
 def split_subs_by_words(result):
@@ -42,6 +74,46 @@ def split_subs_by_words(result):
     
     return subtitles
 
+# Accumulates words into sentences; used both for whole results and for streaming
+class SentenceSplitter:
+    punctuation_marks = {'.', '!', '?', '...', '…'}  # Sentence-ending punctuation
+
+    def __init__(self):
+        self.current_sentence = []
+        self.current_start = None
+        self.current_end = None
+
+    def feed(self, word_info):
+        '''
+        Adds a Whisper word and returns the sentence it completes, if any.
+        '''
+        word = word_info['word'].strip()
+        if self.current_start is None:
+            self.current_start = word_info['start']  # Mark the start of the sentence
+
+        self.current_sentence.append(word)
+        self.current_end = word_info['end']  # Update end time for the sentence
+
+        if word[-1] in self.punctuation_marks:  # Sentence complete
+            return self.flush()
+        return None
+
+    def flush(self):
+        '''
+        Returns the unfinished sentence, if any, and resets the state.
+        '''
+        if not self.current_sentence:
+            return None
+        sentence = {
+            'text': ' '.join(self.current_sentence),
+            'start': self.current_start,
+            'end': self.current_end
+        }
+        self.current_sentence = []
+        self.current_start = None
+        self.current_end = None
+        return sentence
+
 # Function to split subtitles by sentences
 def split_subs_by_sentences(result):
     '''
@@ -50,98 +122,196 @@ def split_subs_by_sentences(result):
     logging.info("Splitting subtitles by sentences")
     
     subtitles = []
-    current_sentence = []
-    current_start = None
-    current_end = None
-    punctuation_marks = {'.', '!', '?', '...', '…'}  # Sentence-ending punctuation
-
+    splitter = SentenceSplitter()
     for segment in result['segments']:
         for word_info in segment['words']:
-            word = word_info['word'].strip()
-            start = word_info['start']
-            end = word_info['end']
-
-            if current_start is None:
-                current_start = start  # Mark the start of the sentence
-
-            current_sentence.append(word)
-            current_end = end  # Update end time for the sentence
-
-            if word[-1] in punctuation_marks:  # Sentence complete
-                sentence = ' '.join(current_sentence)
-                subtitles.append({
-                    'text': sentence,
-                    'start': current_start,
-                    'end': current_end
-                })
-                current_sentence = []
-                current_start = None
-                current_end = None
+            sentence = splitter.feed(word_info)
+            if sentence is not None:
+                subtitles.append(sentence)
 
     # Handle any remaining words that didn't end with punctuation
-    if current_sentence:
-        sentence = ' '.join(current_sentence)
-        subtitles.append({
-            'text': sentence,
-            'start': current_start,
-            'end': current_end
-        })
+    sentence = splitter.flush()
+    if sentence is not None:
+        subtitles.append(sentence)
     
     logging.info("Sentence-level subtitles generated")
     print("Sentence-level subtitles generated")
     
     return subtitles
 
-# Endpoint for generating subtitles
-@app.post("/subtitles/")
-async def get_subtitles(audio: UploadFile = File(...)):
+def parse_options(request):
+    try:
+        return Request.parse_raw(request) if request else Request()
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid request options: {str(e)}")
+
+async def receive_audio(audio: UploadFile):
     '''
-    Receives an audio file and generates both word-level and sentence-level subtitles.
+    Saves the uploaded audio to a temporary file and decodes it.
     '''
-    logging.info(f"Received audio file: {audio.filename}")
-    print(f"Received audio file: {audio.filename}")
-
     # Create a temporary file to store the uploaded audio
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+    suffix = os.path.splitext(audio.filename or '')[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_file_path = temp_file.name  # Get the temporary file path
         try:
             logging.info("Saving audio file to temporary location")
             
-            # Write the audio data to the temporary file
-            audio_data = await audio.read()
-            temp_file.write(audio_data)
-            temp_file_path = temp_file.name  # Get the temporary file path
+            # Stream the audio data to the temporary file without loading it into memory
+            with timed(STAGE_SECONDS, 'upload'):
+                await run_in_threadpool(shutil.copyfileobj, audio.file, temp_file, UPLOAD_BUFFER_SIZE)
         except Exception as e:
             logging.error(f"Error saving audio to temp file: {str(e)}")
+            os.remove(temp_file_path)
             raise HTTPException(status_code=500, detail=f"Error saving audio to temp file: {str(e)}")
+    try:
+        UPLOAD_BYTES.observe(os.path.getsize(temp_file_path))
+        with timed(STAGE_SECONDS, 'decode_audio'):
+            audio_array = await run_in_threadpool(load_audio, temp_file_path)
+        AUDIO_SECONDS.observe(len(audio_array) / whisper.audio.SAMPLE_RATE)
+        return audio_array
+    except Exception as e:
+        logging.error(f"Error decoding audio: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Error decoding audio: {str(e)}")
+    finally:
+        # Clean up the temporary file
+        os.remove(temp_file_path)  # Delete the temporary file
+        logging.info("Temporary audio file deleted")
+
+def transcription_mode(audio_array, options):
+    use_long_audio = options.long_audio
+    if use_long_audio is None:
+        use_long_audio = device == "cpu" and is_long_audio(audio_array)
+    return "long_audio" if use_long_audio else "batched"
+
+def start_transcription(audio_array, options, on_segments=None):
+    '''
+    Starts transcription and returns an awaitable with the Whisper result.
+    on_segments is called from a worker thread with each newly finished batch of segments, in order.
+    '''
+    if transcription_mode(audio_array, options) == "long_audio":
+        # Chunks are transcribed in parallel on a process pool
+        return asyncio.get_running_loop().run_in_executor(
+            None, long_audio.transcribe, audio_array, options.model, options.language, on_segments)
+    # Inference runs on the engine thread, batched with concurrent requests
+    return asyncio.wrap_future(engine.submit(audio_array, options.model, options.language, on_segments))
+
+# Endpoint for generating subtitles
+@app.post("/subtitles/")
+async def get_subtitles(audio: UploadFile = File(...), request: Optional[str] = Form(None)):
+    '''
+    Receives an audio file and generates both word-level and sentence-level subtitles.
+    '''
+    logging.info(f"Received audio file: {audio.filename}")
+    print(f"Received audio file: {audio.filename}")
+    started = time.perf_counter()
+    options = parse_options(request)
+    audio_array = await receive_audio(audio)
+    mode = transcription_mode(audio_array, options)
 
     # Transcribe the audio using Whisper
     try:
         logging.info("Starting transcription using Whisper")
         
-        subtitles = model.transcribe(temp_file_path, word_timestamps=True)  # Pass the temp file path to the model
+        with timed(STAGE_SECONDS, 'transcribe'):
+            subtitles = await start_transcription(audio_array, options)
         
         logging.info("Transcription completed")
+    except ValueError as e:
+        REQUEST_ERRORS.labels('subtitles').inc()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        REQUEST_ERRORS.labels('subtitles').inc()
         logging.error(f"Error transcribing audio with Whisper: {str(e)}")
         print(f"Error transcribing audio with Whisper: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error transcribing audio with Whisper: {str(e)}")
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)  # Delete the temporary file
-            logging.info("Temporary audio file deleted")
 
     # Generate sentence-level and word-level subtitles
     sentences = split_subs_by_sentences(subtitles.copy())
     words = split_subs_by_words(subtitles.copy())
 
     logging.info("Returning subtitles response")
+    REQUEST_SECONDS.labels('subtitles', mode).observe(time.perf_counter() - started)
     
     return {
         'sentences': sentences,
         'words': words,
     }
 
+# Streaming endpoint: emits records as soon as each segment is transcribed
+@app.post("/subtitles/stream/")
+async def stream_subtitles(audio: UploadFile = File(...), request: Optional[str] = Form(None), format: str = "ndjson"):
+    '''
+    Same as /subtitles/, but returns one JSON record per line (NDJSON) or SSE events:
+    {"type": "word", ...} as words are recognized, {"type": "sentence", ...} once a sentence
+    is complete, and a final {"type": "done"} or {"type": "error"} record.
+    '''
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    logging.info(f"Received audio file for streaming: {audio.filename}")
+    started = time.perf_counter()
+    options = parse_options(request)
+    audio_array = await receive_audio(audio)
+    mode = transcription_mode(audio_array, options)
+
+    loop = asyncio.get_running_loop()
+    segments_queue = asyncio.Queue()
+    def on_segments(segments):
+        loop.call_soon_threadsafe(segments_queue.put_nowait, segments)
+    try:
+        transcription = start_transcription(audio_array, options, on_segments)
+    except ValueError as e:
+        REQUEST_ERRORS.labels('stream').inc()
+        raise HTTPException(status_code=400, detail=str(e))
+    transcription.add_done_callback(lambda _: segments_queue.put_nowait(None))
+
+    def encode(record):
+        line = json.dumps(record, ensure_ascii=False)
+        return f"data: {line}\n\n" if format == "sse" else line + "\n"
+
+    async def records():
+        splitter = SentenceSplitter()
+        while True:
+            segments = await segments_queue.get()
+            if segments is None:
+                break
+            for segment in segments:
+                for word_info in segment['words']:
+                    sentence = splitter.feed(word_info)
+                    yield encode({'type': 'word', 'text': word_info['word'], 'start': word_info['start'],
+                                  'end': word_info['end'], 'probability': word_info.get('probability')})
+                    if sentence is not None:
+                        yield encode({'type': 'sentence', **sentence})
+        sentence = splitter.flush()
+        if sentence is not None:
+            yield encode({'type': 'sentence', **sentence})
+        if transcription.exception() is not None:
+            REQUEST_ERRORS.labels('stream').inc()
+            logging.error(f"Error transcribing audio with Whisper: {str(transcription.exception())}")
+            yield encode({'type': 'error', 'detail': str(transcription.exception())})
+        else:
+            yield encode({'type': 'done'})
+        REQUEST_SECONDS.labels('stream', mode).observe(time.perf_counter() - started)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(records(), media_type=media_type)
+
+@app.get("/models/")
+async def get_models():
+    '''
+    Lists loaded Whisper models and the memory budget.
+    '''
+    return registry.stats()
+
+@app.on_event("shutdown")
+def shutdown():
+    # Stop long-audio worker processes together with the server
+    long_audio.shutdown()
+
+@app.get("/metrics")
+def metrics():
+    content, content_type = metrics_response()
+    return Response(content=content, media_type=content_type)
+
 # Main entry point for running the app
 if __name__ == "__main__":
     import uvicorn
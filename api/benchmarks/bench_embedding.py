@@ -0,0 +1,54 @@
+# benchmarks/bench_embedding.py
+#
+# Сравнивает поштучный эмбеддинг предложений (как было) с батчевым embed_texts.
+# Запуск из папки api: python benchmarks/bench_embedding.py --sentences 500
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from transformers import AutoTokenizer, AutoModel
+from utils.key_moment_extraction import embed_text, embed_texts
+
+WORDS = ('человек', 'спорт', 'машина', 'гол', 'матч', 'команда', 'город', 'дождь', 'видео', 'сегодня',
+         'очень', 'быстро', 'смотрите', 'интересный', 'момент', 'тренер', 'игрок', 'победа', 'зрители', 'новости')
+
+
+def make_sentences(n, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 40))).capitalize() + '.' for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sentences', type=int, default=300)
+    parser.add_argument('--token-budget', type=int, default=8192)
+    parser.add_argument('--model', default='DeepPavlov/rubert-base-cased')
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model).eval()
+    sentences = make_sentences(args.sentences)
+    embed_texts(sentences[:8], model, tokenizer)  # прогрев
+
+    start = time.perf_counter()
+    baseline = torch.cat([embed_text(text, model, tokenizer) for text in sentences], dim=0)
+    baseline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = embed_texts(sentences, model, tokenizer, token_budget=args.token_budget)
+    batched_time = time.perf_counter() - start
+
+    print(f"поштучно: {len(sentences) / baseline_time:.1f} предложений/с")
+    print(f"батчами:  {len(sentences) / batched_time:.1f} предложений/с (token_budget={args.token_budget})")
+    print(f"ускорение: {baseline_time / batched_time:.2f}x")
+    print(f"макс. расхождение эмбеддингов: {(baseline - batched).abs().max().item():.2e}")
+
+
+if __name__ == '__main__':
+    main()
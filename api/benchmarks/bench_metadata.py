@@ -0,0 +1,78 @@
+# benchmarks/bench_metadata.py
+#
+# Нагрузочный прогон генерации метаданных против локального stub_llm_server.py:
+# последовательные вызовы (как было) против параллельных из потоков (как этапы клипов в StageGraph)
+# и повтор из кэша.
+# Запуск из папки api: python benchmarks/bench_metadata.py --clips 10 --latency 0.5
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} не отвечает")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8012)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, os.path.join(API_DIR, 'benchmarks', 'stub_llm_server.py'),
+                               '--port', str(args.port), '--latency', str(args.latency),
+                               '--error-rate', str(args.error_rate)])
+    try:
+        wait_for(f'http://127.0.0.1:{args.port}/v1/models')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Настройки читаются при импорте модуля
+            os.environ['LLM_BASE_URL'] = f'http://127.0.0.1:{args.port}/v1'
+            os.environ['METADATA_CACHE_DIR'] = cache_dir
+            from utils import metadata_generation
+
+            texts = [f'Клип номер {i}: команда забила гол на последней минуте матча.' for i in range(args.clips)]
+            start = time.perf_counter()
+            for text in texts:
+                metadata_generation.generate_metadata_json(text + ' (последовательно)')
+            sequential = time.perf_counter() - start
+
+            with ThreadPoolExecutor(len(texts)) as pool:
+                start = time.perf_counter()
+                results = list(pool.map(metadata_generation.generate_metadata_json, texts))
+                concurrent = time.perf_counter() - start
+
+                start = time.perf_counter()
+                list(pool.map(metadata_generation.generate_metadata_json, texts))
+                cached = time.perf_counter() - start
+
+        fallbacks = sum(result is metadata_generation.meta for result in results)
+        print(f"{args.clips} клипов, задержка LLM {args.latency} с")
+        print(f"последовательно  {sequential:6.2f} с")
+        print(f"параллельно      {concurrent:6.2f} с  (x{sequential / concurrent:.1f}, fallback: {fallbacks})")
+        print(f"из кэша          {cached:6.3f} с")
+        print(urllib.request.urlopen(f'http://127.0.0.1:{args.port}/stats').read().decode())
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# benchmarks/bench_pipeline.py
+#
+# Сквозной офлайн-бенчмарк генерации клипов: синтетические видео заданной длины, разрешения и SAR,
+# локальные заглушки Whisper и LLM (stub_whisper_server.py, stub_llm_server.py) и полный
+# run_generation из main.py. Для каждого сценария меряет время и пропускную способность
+# по этапам (из span-ов utils/metrics), пиковый RSS всего дерева процессов и записанные байты.
+# Результаты сохраняются в JSON; с --baseline печатается сравнение с прошлым прогоном.
+#
+# Запуск из папки api:
+#   python benchmarks/bench_pipeline.py --output results.json
+#   python benchmarks/bench_pipeline.py --scenario 120:1920x1080 --scenario 60:720x720:16/9 --baseline results.json
+# Сценарий: <секунды>:<ШxВ>[:<SAR>]; квадратный кадр с SAR != 1 идёт по пути use_convert.
+# Модель ранжирования (EMBEDDING_MODEL) должна быть доступна локально.
+
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+DEFAULT_SCENARIOS = ['60:1920x1080', '60:1080x1920', '60:720x720:16/9', '300:1280x720']
+
+
+def parse_scenario(spec):
+    parts = spec.split(':')
+    width, height = map(int, parts[1].split('x'))
+    sar = parts[2] if len(parts) > 2 else '1'
+    name = f"{int(float(parts[0]))}s_{width}x{height}" + (f"_sar{sar.replace('/', '-')}" if sar != '1' else '')
+    return {'name': name, 'duration': float(parts[0]), 'width': width, 'height': height, 'sar': sar}
+
+
+def make_video(path, scenario):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={scenario['width']}x{scenario['height']}:rate=25",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(scenario['duration']), '-vf', f"setsar={scenario['sar']}",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path,
+    ], check=True)
+
+
+def start_stub(script, port, *args):
+    process = subprocess.Popen([sys.executable, os.path.join(API_DIR, 'benchmarks', script), '--port', str(port), *args])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/docs', timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{script} не запустился")
+
+
+def tree_rss(pid):
+    """RSS процесса и всех его потомков (пул рендера, ffmpeg) по /proc, в байтах."""
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for children in glob.glob(f'/proc/{current}/task/*/children'):
+                with open(children) as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class RssSampler:
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.peak = max(self.peak, tree_rss(os.getpid()))
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+class SpanCollector(logging.Handler):
+    """Собирает JSON-строки span-ов, которые пишет utils.metrics.observe."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        try:
+            self.records.append(json.loads(record.getMessage()))
+        except ValueError:
+            pass
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def summarize(spans, media_seconds):
+    from utils.metrics import stage_label
+    stages = {}
+    for record in spans:
+        stage = stages.setdefault(stage_label(record['span']), {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                                 'input_bytes': 0, 'bytes_written': 0, 'errors': 0})
+        stage['count'] += 1
+        stage['seconds'] += record['seconds']
+        stage['max_seconds'] = max(stage['max_seconds'], record['seconds'])
+        stage['input_bytes'] += record.get('input_bytes') or 0
+        stage['bytes_written'] += record.get('bytes_written') or 0
+        stage['errors'] += bool(record.get('error'))
+    for stage in stages.values():
+        # Секунд исходного видео на секунду работы этапа (суммарно по всем его запускам)
+        stage['media_seconds_per_second'] = media_seconds / stage['seconds'] if stage['seconds'] else None
+    return stages
+
+
+def run_scenario(main, scenario, spans, seed):
+    from utils.job_queue import Job
+    video_id = f"bench_{scenario['name']}"
+    video_path = os.path.join(main.VIDEO_STORAGE_PATH, f'{video_id}.mp4')
+    make_video(video_path, scenario)
+    cache_dir = os.path.join(main.CACHE_DIR, video_id)
+
+    spans.records.clear()
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        clips = main.run_generation(Job(key=video_id), video_id, video_path, seed=seed)
+        wall = time.perf_counter() - started
+
+    job_spans = [record for record in spans.records if record.get('videoId', video_id) == video_id]
+    stages = summarize(job_spans, scenario['duration'])
+    return {
+        **scenario,
+        'clips': clips,
+        'wall_seconds': wall,
+        'media_seconds_per_second': scenario['duration'] / wall,
+        'peak_rss_bytes': sampler.peak,
+        'bytes_written': sum(stage['bytes_written'] for stage in stages.values()),
+        'cache_dir_bytes': dir_size(cache_dir),
+        'source_bytes': os.path.getsize(video_path),
+        'stages': stages,
+    }
+
+
+def compare(results, baseline):
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    for scenario in results['scenarios']:
+        old = previous.get(scenario['name'])
+        if old is None:
+            continue
+        print(f"\n{scenario['name']}: wall {old['wall_seconds']:.1f} -> {scenario['wall_seconds']:.1f} с "
+              f"(x{old['wall_seconds'] / scenario['wall_seconds']:.2f}), "
+              f"RSS {old['peak_rss_bytes'] / 2 ** 20:.0f} -> {scenario['peak_rss_bytes'] / 2 ** 20:.0f} МБ")
+        for name, stage in scenario['stages'].items():
+            old_stage = old['stages'].get(name)
+            if old_stage and stage['seconds']:
+                print(f"  {name:16s} {old_stage['seconds']:8.2f} -> {stage['seconds']:8.2f} с (x{old_stage['seconds'] / stage['seconds']:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', action='append', help='<секунды>:<ШxВ>[:<SAR>], можно несколько раз')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--workdir', help='куда складывать видео и кэш (по умолчанию временная папка)')
+    parser.add_argument('--whisper-port', type=int, default=8018)
+    parser.add_argument('--llm-port', type=int, default=8012)
+    parser.add_argument('--asr-realtime-factor', type=float, default=0.02)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    scenarios = [parse_scenario(spec) for spec in (args.scenario or DEFAULT_SCENARIOS)]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_pipeline_')
+    # Настройки сервисов читаются при импорте модулей, поэтому задаём их до импорта main
+    os.environ.update({
+        'WHISPER_URL': f'http://127.0.0.1:{args.whisper_port}/subtitles/',
+        'LLM_BASE_URL': f'http://127.0.0.1:{args.llm_port}/v1',
+        'VIDEO_STORAGE_PATH': os.path.join(workdir, 'video_path'),
+        'CACHE_DIR': os.path.join(workdir, 'cache_dir'),
+        'TRANSCRIPT_CACHE_DIR': os.path.join(workdir, 'transcripts'),
+        'METADATA_CACHE_DIR': os.path.join(workdir, 'metadata'),
+        'WARMUP_MODELS': '0',
+        # Меряем полный пайплайн, без переиспользования этапов прошлых прогонов
+        'CHECKPOINTS': '0',
+    })
+    for key in ('VIDEO_STORAGE_PATH', 'CACHE_DIR'):
+        os.makedirs(os.environ[key], exist_ok=True)
+
+    stubs = [
+        start_stub('stub_whisper_server.py', args.whisper_port, '--realtime-factor', str(args.asr_realtime_factor)),
+        start_stub('stub_llm_server.py', args.llm_port, '--latency', str(args.llm_latency)),
+    ]
+    try:
+        import main as app_main
+        spans = SpanCollector()
+        logging.getLogger('spans').addHandler(spans)
+
+        load_started = time.perf_counter()
+        app_main.ranking_model.get()
+        model_load = time.perf_counter() - load_started
+
+        results = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=API_DIR,
+                                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip(),
+            'host': {'cpu_count': os.cpu_count(), 'platform': platform.platform(), 'python': platform.python_version()},
+            'settings': {'render_backend': app_main.RENDER_BACKEND, **app_main.render_scheduler.stats(),
+                         'asr_realtime_factor': args.asr_realtime_factor, 'llm_latency': args.llm_latency},
+            'model_load_seconds': model_load,
+            'scenarios': [],
+        }
+        for scenario in scenarios:
+            print(f"Сценарий {scenario['name']}...")
+            result = run_scenario(app_main, scenario, spans, args.seed)
+            results['scenarios'].append(result)
+            print(f"  {result['clips']} клипов за {result['wall_seconds']:.1f} с "
+                  f"(x{result['media_seconds_per_second']:.2f} реального времени), "
+                  f"пик RSS {result['peak_rss_bytes'] / 2 ** 20:.0f} МБ, записано {result['bytes_written'] / 2 ** 20:.1f} МБ")
+            for name, stage in result['stages'].items():
+                print(f"    {name:16s} x{stage['count']:<3d} {stage['seconds']:8.2f} с  max {stage['max_seconds']:7.2f} с")
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+        if args.baseline:
+            with open(args.baseline) as f:
+                compare(results, json.load(f))
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/bench_render.py
+#
+# Сравнивает рендер клипов через moviepy (save_video + crop_video_to_9_16 с TextClip на каждое
+# слово) с однопроходным ffmpeg-рендером render_clip_ffmpeg (кроп + ASS-субтитры).
+# Запуск из папки api: python benchmarks/bench_render.py [video.mp4] --clips 3 --clip-len 20
+# Без пути к видео генерируется синтетическое (ffmpeg testsrc2 + синус, 120 с, 1920x1080).
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.post_processing import save_video, crop_video_to_9_16, render_clip_ffmpeg, get_crop_geometry
+from utils.word_store import WordStore
+
+WORDS = ('человек', 'спорт', 'машина', 'гол', 'матч', 'команда', 'город', 'дождь', 'смотрите', 'момент')
+
+
+def make_video(path, duration=120, size='1920x1080'):
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=25',
+                    '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100', '-t', str(duration),
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path], check=True)
+
+
+def make_words(duration, word_len=0.4):
+    n = int(duration / word_len)
+    return WordStore([i * word_len for i in range(n)], [(i + 1) * word_len for i in range(n)],
+                     [WORDS[i % len(WORDS)] for i in range(n)])
+
+
+def cpu_seconds():
+    """Процессорное время этого процесса и всех завершившихся дочерних (ffmpeg)."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(name, fn):
+    wall, cpu = time.perf_counter(), cpu_seconds()
+    outputs = fn()
+    wall, cpu = time.perf_counter() - wall, cpu_seconds() - cpu
+    size = sum(os.path.getsize(path) for path in outputs)
+    print(f"{name:8s} wall {wall:7.1f} с   cpu {cpu:7.1f} с   выход {size / 2 ** 20:6.1f} МБ")
+    return wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('video', nargs='?')
+    parser.add_argument('--clips', type=int, default=3)
+    parser.add_argument('--clip-len', type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = args.video
+        if video_path is None:
+            video_path = os.path.join(tmp, 'source.mp4')
+            make_video(video_path)
+        duration = float(subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0',
+                                         video_path], stdout=subprocess.PIPE, check=True).stdout)
+        gap = max((duration - args.clip_len) / max(args.clips, 1), 0)
+        clips = [{'start': i * gap, 'end': min(i * gap + args.clip_len, duration)} for i in range(args.clips)]
+        store = make_words(duration)
+        words = [store.slice(clip['start'], clip['end']) for clip in clips]
+        geometry = get_crop_geometry(video_path)
+
+        def moviepy_path():
+            cut_dir = os.path.join(tmp, 'moviepy')
+            os.makedirs(cut_dir, exist_ok=True)
+            paths = save_video(clips, video_path, cut_dir)
+            outputs = [os.path.join(cut_dir, f'video_last_{i + 1}.mp4') for i in range(len(clips))]
+            for path, output, clip_words in zip(paths, outputs, words):
+                crop_video_to_9_16(path, output, words=clip_words)
+            return outputs
+
+        def ffmpeg_path():
+            render_dir = os.path.join(tmp, 'ffmpeg')
+            os.makedirs(render_dir, exist_ok=True)
+            outputs = [os.path.join(render_dir, f'video_last_{i + 1}.mp4') for i in range(len(clips))]
+            for clip, output, clip_words in zip(clips, outputs, words):
+                render_clip_ffmpeg(video_path, clip, output, words=clip_words, geometry=geometry)
+            return outputs
+
+        print(f"{len(clips)} клипов по {args.clip_len:.0f} с, {sum(len(w) for w in words)} слов")
+        moviepy_wall, moviepy_cpu = measure('moviepy', moviepy_path)
+        ffmpeg_wall, ffmpeg_cpu = measure('ffmpeg', ffmpeg_path)
+        print(f"ускорение: wall x{moviepy_wall / ffmpeg_wall:.1f}, cpu x{moviepy_cpu / ffmpeg_cpu:.1f}")
+
+
+if __name__ == '__main__':
+    main()
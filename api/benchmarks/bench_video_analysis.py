@@ -0,0 +1,73 @@
+# benchmarks/bench_video_analysis.py
+#
+# Сравнивает старую схему анализа видео (seek на каждый кадр, 800x800, детектор по одному
+# кадру) с конвейером из analyze_video_sync: последовательное декодирование + батчи.
+# Запуск из папки api: python benchmarks/bench_video_analysis.py [video.mp4] --step 30
+# Без пути к видео генерируется синтетическое (ffmpeg testsrc2, 60 с, 1280x720).
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import torch
+from utils.video_analysis import analyze_video_sync, object_detection_model, device
+
+
+def make_video(path, duration=60, size='1280x720'):
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=25',
+                    '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', path], check=True)
+
+
+def analyze_seek_baseline(video_path, step):
+    """Прежняя реализация: cap.set перед каждым кадром и отдельный вызов детектора на кадр."""
+    model = object_detection_model.get()
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    processed = 0
+    for frame_count in range(0, total_frames, step):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
+        ret, frame = cap.read()
+        if not ret:
+            break
+        image = cv2.resize(frame, (800, 800))
+        with torch.no_grad():
+            model([torch.from_numpy(image).permute(2, 0, 1).float().to(device)])
+        processed += 1
+    cap.release()
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('video', nargs='?')
+    parser.add_argument('--step', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(tempfile.mkdtemp(), 'bench.mp4')
+        make_video(video_path)
+    object_detection_model.get()  # загрузка модели не входит в замер
+
+    start = time.perf_counter()
+    baseline_frames = analyze_seek_baseline(video_path, args.step)
+    baseline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    events = analyze_video_sync(video_path, args.step, args.batch_size)
+    pipeline_time = time.perf_counter() - start
+
+    print(f"seek + по одному кадру: {baseline_frames / baseline_time:.2f} кадров/с")
+    print(f"конвейер (batch={args.batch_size}): {len(events) / pipeline_time:.2f} кадров/с")
+    print(f"ускорение: {baseline_time / pipeline_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
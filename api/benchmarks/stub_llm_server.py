@@ -0,0 +1,89 @@
+# benchmarks/stub_llm_server.py
+#
+# Минимальный OpenAI-совместимый сервер вместо vLLM для офлайн-тестов и нагрузочных прогонов:
+# /v1/chat/completions отвечает детерминированными метаданными по описанию видео из промпта.
+# Запуск из папки api: python benchmarks/stub_llm_server.py --port 8002 --latency 0.5
+# и затем LLM_BASE_URL=http://127.0.0.1:8002/v1 для API.
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+settings = {'latency': 0.0, 'jitter': 0.0, 'error_rate': 0.0, 'invalid_rate': 0.0}
+stats = {'requests': 0, 'errors': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+
+def fake_metadata(prompt):
+    """Метаданные из последнего описания видео в промпте (после примеров few-shot)."""
+    description = prompt.rsplit('Описание видео:', 1)[-1].replace('Метаданные:', '').strip()
+    words = [w.strip('.,!?«»"()').lower() for w in description.split()]
+    words = [w for w in words if len(w) >= 4]
+    return {
+        'title': ' '.join(description.split()[:6]) or 'Клип',
+        'description': description[:200],
+        'hashtags': ['#' + w for w in dict.fromkeys(words)][:5],
+        'sentiment': 'neutral',
+        'target_audience': 'взрослые',
+    }
+
+
+@app.post('/v1/chat/completions')
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats['requests'] += 1
+    stats['in_flight'] += 1
+    stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+    try:
+        await asyncio.sleep(max(0.0, settings['latency'] + random.uniform(-1, 1) * settings['jitter']))
+        if random.random() < settings['error_rate']:
+            stats['errors'] += 1
+            return JSONResponse(status_code=503, content={'error': {'message': 'stub overloaded'}})
+        prompt = body['messages'][-1]['content']
+        content = json.dumps(fake_metadata(prompt), ensure_ascii=False)
+        if random.random() < settings['invalid_rate']:
+            content = content[:len(content) // 2]
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': f'```json\n{content}\n```'}}],
+            'usage': {'prompt_tokens': len(prompt.split()), 'completion_tokens': len(content.split()), 'total_tokens': 0},
+        }
+    finally:
+        stats['in_flight'] -= 1
+
+
+@app.get('/v1/models')
+def models():
+    return {'object': 'list', 'data': [{'id': 'stub', 'object': 'model'}]}
+
+
+@app.get('/stats')
+def get_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--invalid-rate', type=float, default=0.0, help='доля ответов с битым JSON')
+    args = parser.parse_args()
+    settings.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, invalid_rate=args.invalid_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
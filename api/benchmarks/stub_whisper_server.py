@@ -0,0 +1,111 @@
+# benchmarks/stub_whisper_server.py
+#
+# Заглушка ASR-сервиса (api-whisper) для офлайн-прогонов: те же /subtitles/ и /subtitles/stream/,
+# но вместо распознавания — детерминированные слова по длительности присланного аудио.
+# Запуск из папки api: python benchmarks/stub_whisper_server.py --port 8008 --realtime-factor 0.05
+# и затем WHISPER_URL=http://127.0.0.1:8008/subtitles/ для API.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+
+import uvicorn
+from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+settings = {'realtime_factor': 0.0, 'word_len': 0.4, 'sentence_words': 9}
+
+WORDS = ('сегодня', 'команда', 'забила', 'гол', 'на', 'последней', 'минуте', 'матча', 'смотрите', 'машина',
+         'проехала', 'по', 'затопленной', 'улице', 'человек', 'пробежал', 'марафон', 'тренер', 'объяснил', 'тактику')
+STREAM_CHUNK_SECONDS = 30  # как окно Whisper: слова уходят пачками по 30 секунд аудио
+
+
+def audio_duration(path):
+    result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+                            stdout=subprocess.PIPE, check=True)
+    return float(result.stdout.strip() or 0)
+
+
+def fake_words(duration, seed=0):
+    """Слова подряд по word_len секунд; каждое sentence_words-е слово заканчивает предложение."""
+    rng = random.Random(seed)
+    words = []
+    t = 0.0
+    while t + settings['word_len'] <= duration:
+        text = rng.choice(WORDS)
+        if (len(words) + 1) % settings['sentence_words'] == 0:
+            text += '.'
+        words.append({'text': text, 'start': round(t, 2), 'end': round(t + settings['word_len'], 2), 'probability': 0.9})
+        t += settings['word_len']
+    return words
+
+
+def sentences_from(words):
+    sentences, current = [], []
+    for word in words:
+        current.append(word)
+        if word['text'].endswith('.'):
+            sentences.append({'text': ' '.join(w['text'] for w in current), 'start': current[0]['start'], 'end': current[-1]['end']})
+            current = []
+    if current:
+        sentences.append({'text': ' '.join(w['text'] for w in current), 'start': current[0]['start'], 'end': current[-1]['end']})
+    return sentences
+
+
+async def receive(audio):
+    suffix = os.path.splitext(audio.filename or '')[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as temp_file:
+        shutil.copyfileobj(audio.file, temp_file)
+        temp_file.flush()
+        return audio_duration(temp_file.name)
+
+
+@app.post('/subtitles/')
+async def subtitles(audio: UploadFile = File(...), request: str = Form(None)):
+    duration = await receive(audio)
+    await asyncio.sleep(duration * settings['realtime_factor'])
+    words = fake_words(duration)
+    return {'sentences': sentences_from(words), 'words': words}
+
+
+@app.post('/subtitles/stream/')
+async def stream_subtitles(audio: UploadFile = File(...), request: str = Form(None), format: str = 'ndjson'):
+    duration = await receive(audio)
+    words = fake_words(duration)
+
+    async def records():
+        pending = []
+        for chunk_start in range(0, int(duration) + 1, STREAM_CHUNK_SECONDS):
+            await asyncio.sleep(min(STREAM_CHUNK_SECONDS, duration - chunk_start) * settings['realtime_factor'])
+            for word in [w for w in words if chunk_start <= w['start'] < chunk_start + STREAM_CHUNK_SECONDS]:
+                pending.append(word)
+                yield json.dumps({'type': 'word', **word}, ensure_ascii=False) + '\n'
+                if word['text'].endswith('.'):
+                    yield json.dumps({'type': 'sentence', **sentences_from(pending)[0]}, ensure_ascii=False) + '\n'
+                    pending = []
+        if pending:
+            yield json.dumps({'type': 'sentence', **sentences_from(pending)[0]}, ensure_ascii=False) + '\n'
+        yield json.dumps({'type': 'done'}) + '\n'
+
+    return StreamingResponse(records(), media_type='application/x-ndjson')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--realtime-factor', type=float, default=0.0, help='секунд ответа на секунду аудио')
+    parser.add_argument('--word-len', type=float, default=0.4)
+    args = parser.parse_args()
+    settings.update(realtime_factor=args.realtime_factor, word_len=args.word_len)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
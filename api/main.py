@@ -1,17 +1,34 @@
+import time
+_import_started = time.perf_counter()
 import sys
 import os
 import shutil
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request, WebSocket
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, WebSocket, Query
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from utils.speech_processing import transcribe_audio
+from utils.speech_processing import transcribe_audio_streaming
 from utils.video_analysis import analyze_video_advanced
-from utils.key_moment_extraction import extract_key_moments_advanced
+from utils.key_moment_extraction import extract_key_moments_advanced, SentenceEmbedder, get_label_features, DEFAULT_LABELS
 from utils.clip_generation import generate_clips_advanced
-from utils.post_processing import crop_video_to_9_16, save_video
+from utils.post_processing import crop_video_to_9_16, cut_clip, render_clip_ffmpeg, render_clip_assets, asset_paths, get_crop_geometry, render_style, RENDER_BACKEND, PREVIEW_ASSETS
+from utils.render_scheduler import render_scheduler
 from utils.metadata_generation import generate_metadata_json
 from utils.logging_config import setup_logging
+from utils.metrics import metrics_response, JOB_SECONDS
+from utils.profiling import JobProfiler, PROFILE_JOBS
+from utils.embedding_backend import load_embedding_model, EMBEDDING_MODEL, ONNX_CACHE_DIR
+from utils.model_loader import LazyModel, WARMUP_MODELS, warm_up, readiness
+from utils.visual_activity import visual_activity, VISUAL_SCORING, VISUAL_WEIGHT
+from utils.stage_graph import StageGraph
+from functools import partial
+from utils.job_queue import JobManager, QueueFull, DONE, FAILED
+from utils.delivery import file_response, json_file_response
+from utils.uploads import UploadStore, UploadError, BUFFER_SIZE as UPLOAD_BUFFER_SIZE
+from utils.cache_manager import CacheManager
+from utils.transcript_cache import TRANSCRIPT_CACHE_DIR, file_sha256
+from utils.checkpoints import StageCheckpoints, checkpoint_key, CHECKPOINT_NAME
+from utils.metadata_generation import METADATA_CACHE_DIR
 import logging
 import json
 from tqdm import tqdm
@@ -22,56 +39,257 @@ from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import FileResponse
 import os
 from fastapi.middleware.cors import CORSMiddleware
-import random
 
-tokenizer = AutoTokenizer.from_pretrained("DeepPavlov/rubert-base-cased")
-model = AutoModel.from_pretrained("DeepPavlov/rubert-base-cased")
+setup_logging()
+
+def load_ranking_model():
+    model, tokenizer = load_embedding_model(labels=DEFAULT_LABELS)
+    get_label_features(DEFAULT_LABELS, model, tokenizer)
+    return model, tokenizer
+
+ranking_model = LazyModel('ranking', load_ranking_model)
 app = FastAPI()
+jobs = JobManager()
 
 ALLOWED_EXTENSIONS = {"mp4", "mov", "3gp", "avi"}
-VIDEO_STORAGE_PATH = '/app/video_path'
-CACHE_DIR = '/app/cache_dir'
+VIDEO_STORAGE_PATH = os.getenv('VIDEO_STORAGE_PATH', '/app/video_path')
+CACHE_DIR = os.getenv('CACHE_DIR', '/app/cache_dir')
+# Параметры генерации по умолчанию; одинаковый запрос всегда даёт одинаковые клипы
+DEFAULT_NUM_CLIPS = int(os.getenv('DEFAULT_NUM_CLIPS', '7'))
+DEFAULT_CLIP_LEN = int(os.getenv('DEFAULT_CLIP_LEN', '24'))
+uploads = UploadStore(VIDEO_STORAGE_PATH)
+
+def clip_outputs(cache_dir, clips_num):
+    """Итоговые файлы задачи: клипы, их метаданные и, если включены PREVIEW_ASSETS, превью, постеры и спрайты."""
+    outputs = []
+    for ind in range(1, clips_num + 1):
+        clip_path = os.path.join(cache_dir, f'video_last_{ind}.mp4')
+        outputs += [clip_path, os.path.join(cache_dir, f'video_last_{ind}.json')]
+        # Без превью старые файлы прошлых запусков удаляются: они могли остаться от клипа с другим номером
+        if PREVIEW_ASSETS:
+            outputs += asset_paths(clip_path).values()
+    return outputs
+
+cache = CacheManager(CACHE_DIR, VIDEO_STORAGE_PATH, ALLOWED_EXTENSIONS, clip_outputs, blobs_dir=uploads.blobs_dir,
+                     reserved_dirs=(TRANSCRIPT_CACHE_DIR, ONNX_CACHE_DIR, uploads.uploads_dir, uploads.blobs_dir),
+                     budget_dirs=(METADATA_CACHE_DIR,))
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def check_video_id(videoId: str):
+    # videoId — имя папки задачи в CACHE_DIR, её содержимое при фиксации чистится
+    if not cache.valid_video_id(videoId):
+        raise HTTPException(status_code=400, detail="Invalid videoId. Use letters, digits, '-' and '_'.")
+
 @app.post("/api/upload")
 def upload_video(videoId: str = Form(...), file: UploadFile = File(...)):
+    check_video_id(videoId)
     if not allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="Invalid file format. Only mp4, mov, 3gp, and avi are allowed.")
     
-    file_location = os.path.join(VIDEO_STORAGE_PATH, f"{videoId}.{file.filename.rsplit('.', 1)[1].lower()}")
-    with open(file_location, "wb") as f:
-        f.write(file.file.read())
-    return {"info": f"file '{file.filename}' saved at '{file_location}'"}
+    stored = uploads.save_stream(videoId, file.filename.rsplit('.', 1)[1].lower(), file.file)
+    return {"info": f"file '{file.filename}' saved at '{stored['file_location']}'", "sha256": stored['sha256'], "deduplicated": stored['deduplicated']}
 
-@app.get("/api/generate")
-def generate_video(videoId: str):
-    cache_dir = os.path.join(CACHE_DIR, videoId)
-    if not os.path.exists(cache_dir):
-        os.mkdir(cache_dir)
-    num_clips = random.randint(4, 10)
+def upload_error(e: UploadError):
+    detail = {"message": str(e)}
+    if e.offset is not None:
+        detail["offset"] = e.offset
+    return HTTPException(status_code=e.status_code, detail=detail)
+
+@app.post("/api/upload/init")
+def init_upload(videoId: str = Form(...), filename: str = Form(...), size: int = Form(None)):
+    check_video_id(videoId)
+    if not allowed_file(filename):
+        raise HTTPException(status_code=400, detail="Invalid file format. Only mp4, mov, 3gp, and avi are allowed.")
+    return uploads.init(videoId, filename.rsplit('.', 1)[1].lower(), size)
+
+@app.get("/api/upload/{upload_id}")
+def get_upload(upload_id: str):
+    try:
+        return uploads.status(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+
+@app.put("/api/upload/{upload_id}")
+def append_upload_chunk(upload_id: str, offset: int = Form(...), chunk: UploadFile = File(...)):
+    try:
+        blocks = iter(lambda: chunk.file.read(UPLOAD_BUFFER_SIZE), b'')
+        return {"offset": uploads.append(upload_id, offset, blocks)}
+    except UploadError as e:
+        raise upload_error(e)
+
+@app.post("/api/upload/{upload_id}/finalize")
+def finalize_upload(upload_id: str, sha256: str = Form(None)):
+    try:
+        stored = uploads.finalize(upload_id, sha256)
+    except UploadError as e:
+        raise upload_error(e)
+    return {"info": f"file saved at '{stored['file_location']}'", "sha256": stored['sha256'], "deduplicated": stored['deduplicated']}
+
+def find_video(videoId: str):
     for ext in ALLOWED_EXTENSIONS:
         video_path = os.path.join(VIDEO_STORAGE_PATH, f"{videoId}.{ext}")
-        print(video_path)
         if os.path.exists(video_path):
-            transcription = transcribe_audio(video_path, cache_dir)
-            print('transcription')
-
-            clips, words = extract_key_moments_advanced(transcription['sentences'], num_clips=num_clips, clip_len=random.randint(15, 32), model=model, tokenizer=tokenizer, words=transcription['words'])
-            paths = save_video(clips, video_path, cache_dir)
-            
-            for i, path in enumerate(paths):
-                ind = i + 1
-                out_meta = generate_metadata_json(clips[i]['text'])
-                with open(os.path.join(cache_dir, f'video_last_{ind}.json'), 'w') as f:
-                    json.dump(out_meta, f)
-                proccessed_path = os.path.join(cache_dir, f'video_last_{ind}.mp4')
-                if os.path.exists(proccessed_path):
-                    os.remove(proccessed_path)
-                crop_video_to_9_16(path, proccessed_path, words=words[i])
-            return num_clips
-
-    raise HTTPException(status_code=404, detail="Video not found")
+            return video_path
+    return None
+
+def write_metadata(text, path):
+    with open(path, 'w') as f:
+        json.dump(generate_metadata_json(text), f)
+    return path
+
+def detect_visual_activity(video_path):
+    if not VISUAL_SCORING:
+        return None
+    try:
+        return visual_activity(video_path)[0]
+    except Exception:
+        logging.exception("Ошибка визуального скорирования, ранжируем только по тексту")
+        return None
+
+def run_generation(job, videoId: str, video_path: str, num_clips: int = DEFAULT_NUM_CLIPS, clip_len: int = DEFAULT_CLIP_LEN, seed: int = 0, profile: bool = False):
+    cache_dir = cache.job_dir(videoId)
+    with cache.generation(videoId):
+        profiler = JobProfiler(os.path.join(cache_dir, f'profile_{job.id}.pstats')) if profile or PROFILE_JOBS else None
+        started = time.perf_counter()
+        status = FAILED
+        try:
+            clips_num = (profiler.wrap(generate_clips) if profiler else generate_clips)(job, videoId, video_path, cache_dir, num_clips, clip_len, seed, profiler)
+            status = DONE
+        finally:
+            JOB_SECONDS.labels(status).observe(time.perf_counter() - started)
+            if profiler is not None:
+                profiler.dump()
+        # В папке остаются только итоговые файлы и манифест этапов: аудио, промежуточные нарезки
+        # и клипы прошлых запусков удаляются
+        outputs = clip_outputs(cache_dir, clips_num) + [os.path.join(cache_dir, CHECKPOINT_NAME)]
+        cache.commit(videoId, video_path, outputs + ([profiler.path] if profiler else []))
+        return clips_num
+
+def caption_seed(seed, clip):
+    # Цвета субтитров зависят от seed запроса и самого клипа, но не от его номера
+    return [seed, int(round(clip['start'] * 1000))]
+
+def generate_clips(job, videoId: str, video_path: str, cache_dir: str, num_clips: int, clip_len: int, seed: int, profiler=None):
+    logging.info(f"Генерация клипов для {videoId}: {video_path}")
+    graph = StageGraph(job, profiler=profiler, fields={'videoId': videoId})
+    checkpoints = StageCheckpoints(cache_dir)
+    source_hash = file_sha256(video_path)
+    rank_key = checkpoint_key('rank', source_hash, num_clips, clip_len, EMBEDDING_MODEL, VISUAL_SCORING, VISUAL_WEIGHT)
+
+    def transcribe(embedder):
+        return transcribe_audio_streaming(video_path, cache_dir, on_sentence=lambda sentence: embedder.add(sentence['text']))
+
+    def rank(embedder, model, tokenizer, transcription, visual_scores):
+        clips, words = extract_key_moments_advanced(transcription['sentences'], num_clips=num_clips, clip_len=clip_len, model=model, tokenizer=tokenizer, words=transcription['words'], text_features=embedder.result(), visual_scores=visual_scores)
+        words = [list(clip_words) for clip_words in words]
+        checkpoints.put('rank', rank_key, result={'clips': clips, 'words': words})
+        add_clip_stages(clips, words)
+        return clips
+
+    def restore_rank(result):
+        add_clip_stages(result['clips'], result['words'])
+        return result['clips']
+
+    def record_render(ind, key, files, _):
+        checkpoints.put(f'render[{ind}]', key, files=files)
+
+    def add_clip_stages(clips, words):
+        # Метаданные зависят только от текста клипа, рендер — только от своей нарезки,
+        # поэтому LLM-запросы идут параллельно с кодированием в пуле рендера
+        geometry = get_crop_geometry(video_path)
+        style = render_style()
+        targets = {}
+        for i, clip in enumerate(clips):
+            ind = i + 1
+            clip_path = os.path.join(cache_dir, f'video_last_{ind}.mp4')
+            key = checkpoint_key('render', source_hash, round(clip['start'], 3), round(clip['end'], 3), geometry['video_filter'], caption_seed(seed, clip), words[i], style)
+            files = {'clip': clip_path, **asset_paths(clip_path)} if style['assets'] else {'clip': clip_path}
+            targets[f'render[{ind}]'] = (key, files)
+        # Клипы, уже отрендеренные с теми же входами (в том числе под другим номером), берём как есть
+        reused = checkpoints.reuse(targets)
+        for i, clip in enumerate(clips):
+            ind = i + 1
+            proccessed_path = os.path.join(cache_dir, f'video_last_{ind}.mp4')
+            graph.add(f'metadata[{ind}]', partial(write_metadata, clip['text'], os.path.join(cache_dir, f'video_last_{ind}.json')))
+            if f'render[{ind}]' in reused:
+                continue
+            # Старые клип и превью под этим номером могут принадлежать другому клипу
+            for path in [proccessed_path, *asset_paths(proccessed_path).values()]:
+                if os.path.exists(path):
+                    os.remove(path)
+            seed_args = {'caption_seed': caption_seed(seed, clip)}
+            if RENDER_BACKEND == 'ffmpeg':
+                # ffmpeg-рендер режет, кропает и вшивает субтитры за один проход, отдельная нарезка не нужна
+                graph.add(f'render[{ind}]', partial(render_clip_ffmpeg, video_path, clip, proccessed_path, words=words[i], geometry=geometry, assets=style['assets'], **seed_args), submit=render_scheduler.submit, input_seconds=clip['end'] - clip['start'])
+                last_stage = f'render[{ind}]'
+            else:
+                graph.add(f'cut[{ind}]', partial(cut_clip, video_path, clip, os.path.join(cache_dir, f'video{i}.mp4'), geometry), submit=render_scheduler.submit, input_seconds=clip['end'] - clip['start'])
+                graph.add(f'render[{ind}]', partial(crop_video_to_9_16, output_video_path=proccessed_path, words=words[i], **seed_args), deps=[f'cut[{ind}]'], submit=render_scheduler.submit, input_seconds=clip['end'] - clip['start'])
+                last_stage = f'render[{ind}]'
+                if style['assets']:
+                    # moviepy пишет только сам клип, превью, постер и спрайт делаются отдельным проходом по нему
+                    graph.add(f'assets[{ind}]', render_clip_assets, deps=[f'render[{ind}]'], submit=render_scheduler.submit)
+                    last_stage = f'assets[{ind}]'
+            # Готовый клип сразу попадает в манифест этапов: после падения задачи его не придётся рендерить заново
+            graph.add(f'checkpoint[{ind}]', partial(record_render, ind, *targets[f'render[{ind}]']), deps=[last_stage])
+
+    cached_rank = checkpoints.get('rank', rank_key)
+    if cached_rank is not None:
+        # Клипы уже выбраны прошлым запуском с теми же параметрами: ASR и ранжирование не нужны
+        graph.add('rank', partial(restore_rank, cached_rank['result']))
+    else:
+        model, tokenizer = ranking_model.get()
+        # Предложения эмбеддятся по мере того, как их распознаёт ASR
+        embedder = SentenceEmbedder(model, tokenizer)
+        # Визуальный скор считается параллельно с распознаванием речи
+        graph.add('transcribe', partial(transcribe, embedder))
+        graph.add('visual', partial(detect_visual_activity, video_path))
+        graph.add('rank', partial(rank, embedder, model, tokenizer), deps=['transcribe', 'visual'])
+    results = graph.run()
+    logging.info(f"Этапы генерации {videoId}: " + ', '.join(f'{name} {seconds:.1f} с' for name, seconds in graph.timings().items()))
+    return len(results['rank'])
+
+@app.get("/api/generate")
+def generate_video(videoId: str, numClips: int = Query(DEFAULT_NUM_CLIPS, ge=1, le=20), clipLen: int = Query(DEFAULT_CLIP_LEN, ge=5, le=120),
+                   seed: int = Query(0, ge=0), profile: bool = False):
+    check_video_id(videoId)
+    video_path = find_video(videoId)
+    if video_path is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    params = {"num_clips": numClips, "clip_len": clipLen, "seed": seed}
+    try:
+        job = jobs.submit(run_generation, videoId, video_path, profile=profile, key=videoId, params=params)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    # Если по этому videoId уже идёт задача, возвращается она вместе со своими параметрами
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 meta = {
   "title": "Потоп в курортном городе: Стас Михайлов и Детройт Метал Сити",
   "description": "Смотрите эксклюзивное видео, в котором курортный город затопило из-за тропического ливня. Но есть те, кто объясняет это Стасом Михайловым и его желанием экранизировать аниме «Детройт Метал Сити». Не упустите этот интересный момент!",
@@ -88,21 +306,89 @@ meta = {
   "target_audience": "взрослые, интересующиеся новостями и популярной культурой"
 }
 
-@app.get("/api/part")
-def get_video_part(videoId: str, clipsNum: str):
+@app.api_route("/api/part", methods=["GET", "HEAD"])
+def get_video_part(request: Request, videoId: str, clipsNum: str):
+    check_video_id(videoId)
     part_path = os.path.join(CACHE_DIR, videoId, f'video_last_{clipsNum}.mp4')
     if os.path.exists(part_path):
-        return FileResponse(part_path, media_type="video/mp4")
+        cache.touch(videoId)
+        return file_response(request, part_path, media_type="video/mp4")
     raise HTTPException(status_code=404, detail="Part not found")
 
 @app.get("/api/meta")
-def get_meta(videoId: str, clipsNum: str):
+def get_meta(request: Request, videoId: str, clipsNum: str):
+    check_video_id(videoId)
     part_path = os.path.join(CACHE_DIR, videoId, f'video_last_{clipsNum}.json')
     
     if os.path.exists(part_path):
-        return json.load(open(part_path))
+        cache.touch(videoId)
+        return json_file_response(request, part_path)
     raise HTTPException(status_code=404, detail="Part not found")
 
+def clip_asset(videoId, clipsNum, kind):
+    check_video_id(videoId)
+    path = asset_paths(os.path.join(CACHE_DIR, videoId, f'video_last_{clipsNum}.mp4'))[kind]
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Part not found")
+    cache.touch(videoId)
+    return path
+
+@app.api_route("/api/preview", methods=["GET", "HEAD"])
+def get_preview(request: Request, videoId: str, clipsNum: str):
+    return file_response(request, clip_asset(videoId, clipsNum, 'preview'), media_type="video/mp4")
+
+@app.api_route("/api/poster", methods=["GET", "HEAD"])
+def get_poster(request: Request, videoId: str, clipsNum: str):
+    return file_response(request, clip_asset(videoId, clipsNum, 'poster'), media_type="image/jpeg")
+
+@app.api_route("/api/sprite", methods=["GET", "HEAD"])
+def get_sprite(request: Request, videoId: str, clipsNum: str):
+    return file_response(request, clip_asset(videoId, clipsNum, 'sprite'), media_type="image/jpeg")
+
+@app.get("/api/sprite/meta")
+def get_sprite_meta(request: Request, videoId: str, clipsNum: str):
+    return json_file_response(request, clip_asset(videoId, clipsNum, 'sprite_layout'))
+
+@app.get("/api/admin/cache")
+def get_cache_stats():
+    return cache.stats()
+
+@app.post("/api/admin/cache/sweep")
+def sweep_cache():
+    return cache.sweep()
+
+startup_report = {"import_seconds": time.perf_counter() - _import_started}
+
+@app.get("/metrics")
+def metrics():
+    content, content_type = metrics_response()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    ready, models = readiness()
+    body = {"ready": ready, "models": models, "startup": startup_report}
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.on_event("startup")
+def on_startup():
+    startup_report["startup_seconds"] = time.perf_counter() - _import_started
+    logging.info(f"API запущен за {startup_report['startup_seconds']:.1f} с (импорт {startup_report['import_seconds']:.1f} с)")
+    if WARMUP_MODELS:
+        warm_up()
+    cache.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    render_scheduler.shutdown()
+    cache.stop()
+
 # Настройка CORS
 origins = [
     "http://localhost:3000",
@@ -0,0 +1,98 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache_manager import CacheManager, MANIFEST_NAME
+from utils.checkpoints import StageCheckpoints, CHECKPOINT_NAME
+
+
+def clip_outputs(job_dir, clips_num):
+    return [os.path.join(job_dir, f'video_last_{ind}.mp4') for ind in range(1, clips_num + 1)]
+
+
+def make_cache(tmp_path):
+    video_dir = tmp_path / 'video'
+    video_dir.mkdir(exist_ok=True)
+    return CacheManager(str(tmp_path / 'cache'), str(video_dir), {'mp4'}, clip_outputs, orphan_ttl=3600)
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_sweep_keeps_checkpoints_of_killed_job(tmp_path):
+    cache = make_cache(tmp_path)
+    job_dir = cache.job_dir('video')
+    clip_1, clip_2 = clip_outputs(job_dir, 2)
+
+    # Процесс умер посреди генерации: первый клип готов и записан в манифест этапов, второй — нет
+    cache.generation('video').__enter__()
+    write(clip_1, b'rendered')
+    StageCheckpoints(job_dir).put('render[1]', 'key-1', files={'clip': clip_1})
+    write(clip_2, b'partial')
+    write(os.path.join(job_dir, 'audio.wav'), b'audio')
+
+    restarted = make_cache(tmp_path)
+    result = restarted.sweep()
+    assert result['adopted'] == [] and result['orphans'] == []
+    names = os.listdir(job_dir)
+    assert MANIFEST_NAME not in names
+    assert CHECKPOINT_NAME in names and 'video_last_1.mp4' in names
+
+    # Перезапуск берёт готовый клип из манифеста этапов и рендерит только второй
+    with restarted.generation('video'):
+        reused = StageCheckpoints(job_dir).reuse({'render[1]': ('key-1', {'clip': clip_1}),
+                                                  'render[2]': ('key-2', {'clip': clip_2})})
+        assert reused == {'render[1]'}
+        write(clip_2, b'rendered')
+        restarted.commit('video', None, [clip_1, clip_2])
+
+    names = set(os.listdir(job_dir))
+    assert {MANIFEST_NAME, CHECKPOINT_NAME, 'video_last_1.mp4', 'video_last_2.mp4'} <= names
+    assert 'audio.wav' not in names
+
+
+def test_sweep_ignores_unmarked_dirs(tmp_path):
+    cache = make_cache(tmp_path)
+    onnx_dir = os.path.join(cache.cache_dir, 'onnx')
+    os.makedirs(onnx_dir)
+    write(os.path.join(onnx_dir, 'model.int8.onnx'), b'model')
+    old = 1
+    os.utime(onnx_dir, (old, old))
+
+    cache.sweep()
+    assert os.path.exists(os.path.join(onnx_dir, 'model.int8.onnx'))
+
+
+def test_sweep_evicts_metadata_files_within_budget(tmp_path):
+    metadata_dir = tmp_path / 'cache' / 'metadata'
+    metadata_dir.mkdir(parents=True)
+    cache = CacheManager(str(tmp_path / 'cache'), str(tmp_path), {'mp4'}, clip_outputs,
+                         budget_dirs=(str(metadata_dir),), max_bytes=250)
+    for ind in range(3):
+        path = metadata_dir / f'{ind}.json'
+        write(path, b'x' * 100)
+        os.utime(path, (ind + 1, ind + 1))
+
+    result = cache.sweep()
+    assert sorted(os.listdir(metadata_dir)) == ['1.json', '2.json']
+    assert result['freed_bytes'] == 100 and result['total_bytes'] == 200
+    # Сама папка кэша задачей не считается
+    assert os.path.isdir(metadata_dir)
+
+
+def test_job_dir_rejects_foreign_dirs(tmp_path):
+    transcripts_dir = tmp_path / 'cache' / 'transcripts'
+    transcripts_dir.mkdir(parents=True)
+    cache = CacheManager(str(tmp_path / 'cache'), str(tmp_path), {'mp4'}, clip_outputs, reserved_dirs=(str(transcripts_dir),))
+    assert cache.valid_video_id('1b9d6bcd-bbfd-4b2d-9b5d-ab8dfbbd4bed')
+    for video_id in ('transcripts', '..', '.', 'a/b', '', '../cache'):
+        assert not cache.valid_video_id(video_id)
+        with pytest.raises(ValueError):
+            with cache.generation(video_id):
+                pass
+    assert os.path.isdir(transcripts_dir) and cache.pinned == {}
@@ -0,0 +1,25 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.job_queue import JobManager
+
+
+def test_in_flight_job_keeps_its_params():
+    release = threading.Event()
+    seen = []
+
+    def run(job, video_id, num_clips):
+        seen.append(num_clips)
+        release.wait(5)
+        return num_clips
+
+    jobs = JobManager(max_workers=1)
+    first = jobs.submit(run, 'video', key='video', params={'num_clips': 3})
+    second = jobs.submit(run, 'video', key='video', params={'num_clips': 7})
+    assert second is first
+    assert second.to_dict()['params'] == {'num_clips': 3}
+    release.set()
+    assert first.future.result(timeout=5) is None and first.result == 3 and seen == [3]
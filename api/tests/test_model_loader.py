@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.model_loader import LazyModel, readiness
+
+
+def test_lazy_models_are_ready_without_warm_up():
+    model = LazyModel('test-readiness', lambda: 'model')
+    assert not readiness(warmup=True)[0]
+    ready, status = readiness(warmup=False)
+    assert ready and not status['test-readiness']['loaded']
+    model.get()
+    assert readiness(warmup=True)[0]
@@ -0,0 +1,34 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.uploads import UploadError, UploadStore
+
+
+def test_chunked_upload_resumes_in_another_process(tmp_path):
+    data = os.urandom(3000)
+    first = UploadStore(str(tmp_path))
+    upload_id = first.init('video', 'mp4', size=len(data))['uploadId']
+    assert first.append(upload_id, 0, [data[:1000]]) == 1000
+
+    # Прерванная запись оставила хвост после подтверждённого offset
+    with open(first._part_path(upload_id), 'ab') as f:
+        f.write(b'garbage')
+
+    # Другой воркер: кэша хэшера нет, offset и данные берутся с диска
+    second = UploadStore(str(tmp_path))
+    assert second.status(upload_id)['offset'] == 1000
+    with pytest.raises(UploadError) as error:
+        second.append(upload_id, 500, [data[500:]])
+    assert error.value.status_code == 409 and error.value.offset == 1000
+    assert second.append(upload_id, 1000, [data[1000:2000], data[2000:]]) == 3000
+
+    stored = first.finalize(upload_id, hashlib.sha256(data).hexdigest())
+    with open(stored['file_location'], 'rb') as f:
+        assert f.read() == data
+    with pytest.raises(UploadError):
+        second.status(upload_id)
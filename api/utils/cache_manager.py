@@ -0,0 +1,395 @@
+# utils/cache_manager.py
+
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.checkpoints import CHECKPOINT_NAME
+from utils.metrics import CACHE_BYTES, CACHE_FREED_BYTES, file_size
+from utils.transcript_cache import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Общий бюджет на папки задач, исходные видео и кэш метаданных LLM, 0 — без ограничения
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(50 * 1024 ** 3)))
+# Как часто фоновый поток проверяет бюджет и подчищает брошенные папки, 0 — не запускать
+CACHE_SWEEP_INTERVAL = int(os.getenv('CACHE_SWEEP_INTERVAL', '300'))
+# Через сколько секунд папка без манифеста (генерация упала или прервана) считается мусором
+CACHE_ORPHAN_TTL = int(os.getenv('CACHE_ORPHAN_TTL', '3600'))
+# Удалять ли вместе с задачей её исходное видео
+CACHE_EVICT_SOURCES = os.getenv('CACHE_EVICT_SOURCES', '1') == '1'
+# Время доступа к задаче обновляем на диске не чаще раза в столько секунд
+TOUCH_INTERVAL = 60
+
+MANIFEST_NAME = 'manifest.json'
+# Метка папки задачи: создаётся в начале генерации и не удаляется. Папки без неё, без манифеста
+# и без клипов (другие кэши, модели) задачами не считаются и никогда не удаляются
+JOB_MARKER = '.job'
+# Эти файлы остаются в папке задачи всегда: манифест этапов нужен, чтобы перезапуск не начинал с нуля
+KEEP_NAMES = (MANIFEST_NAME, JOB_MARKER, CHECKPOINT_NAME)
+CLIP_RE = re.compile(r'^video_last_(\d+)\.mp4$')
+# videoId становится именем папки в CACHE_DIR и файла в VIDEO_STORAGE_PATH: никаких точек и слэшей
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def dir_size(path):
+    return sum(file_size(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class CacheManager:
+    """
+    Жизненный цикл кэша задач: папки CACHE_DIR/<videoId> и исходники <videoId>.<ext>,
+    плюс файлы кэшей из budget_dirs (метаданные LLM), которые входят в тот же бюджет.
+    После успешной генерации в папке задачи пишется manifest.json со списком итоговых
+    файлов, а всё остальное (аудио, промежуточные нарезки, клипы прошлых запусков с большим
+    числом клипов) сразу удаляется. Время последнего доступа — mtime манифеста; при
+    превышении бюджета задачи удаляются целиком, начиная с самых давно открытых.
+    Задачи, которые сейчас генерируются, не трогаются.
+    """
+
+    def __init__(self, cache_dir, video_dir, source_extensions, clip_outputs, blobs_dir=None, reserved_dirs=(), budget_dirs=(),
+                 max_bytes=CACHE_MAX_BYTES, orphan_ttl=CACHE_ORPHAN_TTL, evict_sources=CACHE_EVICT_SOURCES):
+        self.cache_dir = cache_dir
+        self.video_dir = video_dir
+        self.source_extensions = set(source_extensions)
+        # clip_outputs(job_dir, clips_num) — итоговые файлы задачи, нужен для папок без манифеста
+        self.clip_outputs = clip_outputs
+        self.blobs_dir = blobs_dir
+        # Другие кэши внутри CACHE_DIR (транскрипции, метаданные, модели) — не задачи, даже если похожи
+        self.reserved = {os.path.realpath(path) for path in (*reserved_dirs, *budget_dirs)}
+        # Плоские кэши (файл — запись, mtime — время доступа), которые делят бюджет с задачами
+        self.budget_dirs = list(budget_dirs)
+        self.max_bytes = max_bytes
+        self.orphan_ttl = orphan_ttl
+        self.evict_sources = evict_sources
+        self.pinned = {}
+        self.evicting = set()
+        self.touched = {}
+        self.counters = {'sweeps': 0, 'evicted_jobs': 0, 'evicted_files': 0, 'evicted_bytes': 0, 'intermediate_bytes': 0, 'orphan_bytes': 0}
+        self.last_sweep = None
+        self.lock = threading.Lock()
+        # Генерация ждёт, пока с диска удаляется её же вытесненная папка
+        self.evicted = threading.Condition(self.lock)
+        self.sweep_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def valid_video_id(self, video_id):
+        """Папка задачи — прямой потомок cache_dir и не один из других кэшей."""
+        if not VIDEO_ID_RE.match(video_id):
+            return False
+        path = os.path.realpath(os.path.join(self.cache_dir, video_id))
+        return os.path.dirname(path) == os.path.realpath(self.cache_dir) and path not in self.reserved
+
+    def job_dir(self, video_id):
+        # Всё внутри папки задачи, кроме итоговых файлов, удаляется — чужую папку сюда пускать нельзя
+        if not self.valid_video_id(video_id):
+            raise ValueError(f"Недопустимый videoId: {video_id!r}")
+        return os.path.join(self.cache_dir, video_id)
+
+    def manifest_path(self, video_id):
+        return os.path.join(self.job_dir(video_id), MANIFEST_NAME)
+
+    @contextmanager
+    def generation(self, video_id):
+        """
+        Задача на время генерации: её не вытесняют, а старый манифест убирается,
+        чтобы упавший перезапуск не оставил папку с частью клипов под видом готовой.
+        Папка задачи создаётся здесь же вместе с меткой JOB_MARKER.
+        """
+        job_dir = self.job_dir(video_id)
+        with self.evicted:
+            while video_id in self.evicting:
+                self.evicted.wait()
+            self.pinned[video_id] = self.pinned.get(video_id, 0) + 1
+        try:
+            os.makedirs(job_dir, exist_ok=True)
+            remove_path(self.manifest_path(video_id))
+            atomic_write_json(os.path.join(job_dir, JOB_MARKER), {'videoId': video_id, 'startedAt': time.time()})
+            yield
+        finally:
+            with self.lock:
+                self.pinned[video_id] -= 1
+                if not self.pinned[video_id]:
+                    del self.pinned[video_id]
+
+    def touch(self, video_id):
+        now = time.time()
+        with self.lock:
+            if now - self.touched.get(video_id, 0) < TOUCH_INTERVAL:
+                return
+            self.touched[video_id] = now
+        try:
+            os.utime(self.manifest_path(video_id))
+        except OSError:
+            pass
+
+    def commit(self, video_id, source_path, outputs):
+        """Фиксирует успешную генерацию и проверяет бюджет кэша."""
+        self.write_manifest(video_id, source_path, outputs)
+        self.sweep()
+
+    def write_manifest(self, video_id, source_path, outputs):
+        """Записывает манифест итоговых файлов задачи и удаляет из её папки всё остальное."""
+        job_dir = self.job_dir(video_id)
+        keep = {os.path.basename(path) for path in outputs if os.path.exists(path)}
+        removed = 0
+        for name in os.listdir(job_dir):
+            if name in keep or name in KEEP_NAMES:
+                continue
+            path = os.path.join(job_dir, name)
+            removed += dir_size(path) if os.path.isdir(path) else file_size(path)
+            remove_path(path)
+        files = {name: file_size(os.path.join(job_dir, name)) for name in sorted(keep)}
+        atomic_write_json(self.manifest_path(video_id), {
+            'videoId': video_id,
+            'source': source_path,
+            'files': files,
+            'bytes': sum(files.values()),
+            'createdAt': time.time(),
+        })
+        with self.lock:
+            self.counters['intermediate_bytes'] += removed
+        CACHE_FREED_BYTES.labels('intermediate').inc(removed)
+        logger.info(f"Задача {video_id}: {len(files)} итоговых файлов, удалено {removed / 2 ** 20:.1f} МБ промежуточных")
+
+    def is_job_dir(self, path):
+        if os.path.realpath(path) in self.reserved:
+            return False
+        names = os.listdir(path)
+        return any(name in names for name in KEEP_NAMES) or any(CLIP_RE.match(name) for name in names)
+
+    def jobs(self):
+        """Задачи на диске по videoId: папка в CACHE_DIR и/или исходники в VIDEO_STORAGE_PATH."""
+        jobs = {}
+
+        def job_for(video_id):
+            return jobs.setdefault(video_id, {'videoId': video_id, 'dir': None, 'sources': [], 'dir_bytes': 0,
+                                              'source_bytes': 0, 'last_access': 0.0, 'committed': False})
+
+        for entry in os.scandir(self.cache_dir):
+            if (not entry.is_dir(follow_symlinks=False) or not self.valid_video_id(entry.name)
+                    or not self.is_job_dir(entry.path)):
+                continue
+            job = job_for(entry.name)
+            job['dir'] = entry.path
+            job['dir_bytes'] = dir_size(entry.path)
+            try:
+                job['last_access'] = os.stat(os.path.join(entry.path, MANIFEST_NAME)).st_mtime
+                job['committed'] = True
+            except OSError:
+                job['last_access'] = entry.stat().st_mtime
+
+        for entry in os.scandir(self.video_dir):
+            video_id, ext = os.path.splitext(entry.name)
+            if not entry.is_file(follow_symlinks=False) or ext[1:].lower() not in self.source_extensions:
+                continue
+            stat = entry.stat()
+            job = job_for(video_id)
+            job['sources'].append(entry.path)
+            # Исходник, на который ссылаются и другие videoId (дедуп загрузок), место при удалении не освободит
+            job['source_bytes'] += stat.st_size if stat.st_nlink <= 2 else 0
+            if not job['committed']:
+                job['last_access'] = max(job['last_access'], stat.st_mtime)
+        return jobs
+
+    def cache_files(self):
+        """Записи кэшей из budget_dirs: (время доступа, размер, путь)."""
+        files = []
+        for cache_dir in self.budget_dirs:
+            if not os.path.isdir(cache_dir):
+                continue
+            for entry in os.scandir(cache_dir):
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def job_bytes(self, job):
+        return job['dir_bytes'] + (job['source_bytes'] if self.evict_sources else 0)
+
+    def adopt(self, job):
+        """Папка, созданная до появления манифестов: клипы 1..N оставляем, остальное удаляем."""
+        names = os.listdir(job['dir'])
+        # Метка или манифест этапов — значит, это прерванная генерация, а не старая папка:
+        # её клипы могут быть неполными, а готовые этапы понадобятся при перезапуске
+        if JOB_MARKER in names or CHECKPOINT_NAME in names:
+            return False
+        clips = {int(match.group(1)) for match in map(CLIP_RE.match, names) if match}
+        clips_num = 0
+        while clips_num + 1 in clips:
+            clips_num += 1
+        if not clips_num:
+            return False
+        source_path = job['sources'][0] if job['sources'] else None
+        self.write_manifest(job['videoId'], source_path, self.clip_outputs(job['dir'], clips_num))
+        return True
+
+    def evict(self, job, reason='lru'):
+        # Под блокировкой только решаем и помечаем задачу; сами файлы (бывает, гигабайты)
+        # удаляются уже без неё, чтобы не задерживать touch() в обработчиках запросов
+        video_id = job['videoId']
+        with self.lock:
+            if video_id in self.pinned or video_id in self.evicting:
+                return False
+            self.evicting.add(video_id)
+            self.touched.pop(video_id, None)
+        try:
+            if job['dir'] is not None:
+                shutil.rmtree(job['dir'], ignore_errors=True)
+            if self.evict_sources and reason == 'lru':
+                for path in job['sources']:
+                    self.remove_source(path)
+        finally:
+            with self.evicted:
+                self.evicting.discard(video_id)
+                self.evicted.notify_all()
+        return True
+
+    def remove_source(self, path):
+        try:
+            stat = os.stat(path)
+            os.remove(path)
+        except OSError:
+            return
+        # Осталась только копия в blobs: на неё больше никто не ссылается
+        if stat.st_nlink == 2 and self.blobs_dir is not None:
+            for entry in os.scandir(self.blobs_dir):
+                if entry.inode() == stat.st_ino:
+                    remove_path(entry.path)
+                    break
+
+    def remove_orphan_blobs(self, now):
+        if self.blobs_dir is None or not os.path.isdir(self.blobs_dir):
+            return 0
+        freed = 0
+        for entry in os.scandir(self.blobs_dir):
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_nlink == 1 and now - stat.st_mtime > self.orphan_ttl:
+                remove_path(entry.path)
+                freed += stat.st_size
+        return freed
+
+    def sweep(self):
+        """Удаляет брошенные папки и блобы, затем вытесняет задачи сверх бюджета (LRU)."""
+        with self.sweep_lock:
+            now = time.time()
+            with self.lock:
+                pinned = set(self.pinned)
+            adopted, orphans, evicted = [], [], []
+            orphan_bytes = evicted_bytes = 0
+            for job in self.jobs().values():
+                if job['dir'] is None or job['committed'] or job['videoId'] in pinned:
+                    continue
+                if self.adopt(job):
+                    adopted.append(job['videoId'])
+                elif now - job['last_access'] > self.orphan_ttl and self.evict(job, reason='orphan'):
+                    orphans.append(job['videoId'])
+                    orphan_bytes += job['dir_bytes']
+            orphan_bytes += self.remove_orphan_blobs(now)
+
+            jobs = self.jobs()
+            files = self.cache_files()
+            total = sum(self.job_bytes(job) for job in jobs.values()) + sum(size for _, size, _ in files)
+            evicted_files = 0
+            if self.max_bytes:
+                # Задачи и записи кэшей вытесняются вперемешку, начиная с самых давно использованных
+                candidates = [(job['last_access'], self.job_bytes(job), job) for job in jobs.values()] + files
+                for _, size, candidate in sorted(candidates, key=lambda candidate: candidate[0]):
+                    if total <= self.max_bytes:
+                        break
+                    if not size:
+                        continue
+                    if isinstance(candidate, str):
+                        remove_path(candidate)
+                        evicted_files += 1
+                    elif self.evict(candidate):
+                        evicted.append(candidate['videoId'])
+                        logger.info(f"Задача {candidate['videoId']} вытеснена из кэша ({size / 2 ** 20:.1f} МБ)")
+                    else:
+                        continue
+                    total -= size
+                    evicted_bytes += size
+                if total > self.max_bytes:
+                    logger.warning(f"Кэш занимает {total / 2 ** 30:.1f} ГБ при бюджете {self.max_bytes / 2 ** 30:.1f} ГБ: "
+                                   f"остальное занято выполняющимися задачами")
+
+            with self.lock:
+                self.counters['sweeps'] += 1
+                self.counters['orphan_bytes'] += orphan_bytes
+                self.counters['evicted_jobs'] += len(evicted)
+                self.counters['evicted_files'] += evicted_files
+                self.counters['evicted_bytes'] += evicted_bytes
+                self.last_sweep = now
+            CACHE_FREED_BYTES.labels('orphan').inc(orphan_bytes)
+            CACHE_FREED_BYTES.labels('lru').inc(evicted_bytes)
+            CACHE_BYTES.set(total)
+            return {'adopted': adopted, 'orphans': orphans, 'evicted': evicted,
+                    'freed_bytes': orphan_bytes + evicted_bytes, 'total_bytes': total}
+
+    def stats(self, candidates=10):
+        jobs = self.jobs()
+        with self.lock:
+            pinned = sorted(self.pinned)
+            counters = dict(self.counters)
+            last_sweep = self.last_sweep
+        files = self.cache_files()
+        lru = sorted(jobs.values(), key=lambda job: job['last_access'])
+        return {
+            'max_bytes': self.max_bytes,
+            'total_bytes': sum(self.job_bytes(job) for job in jobs.values()) + sum(size for _, size, _ in files),
+            'cache_file_bytes': sum(size for _, size, _ in files),
+            'cache_files': len(files),
+            'job_bytes': sum(job['dir_bytes'] for job in jobs.values()),
+            'source_bytes': sum(job['source_bytes'] for job in jobs.values()),
+            'jobs': sum(1 for job in jobs.values() if job['dir'] is not None),
+            'committed_jobs': sum(1 for job in jobs.values() if job['committed']),
+            'sources': sum(len(job['sources']) for job in jobs.values()),
+            'pinned': pinned,
+            'last_sweep': last_sweep,
+            **counters,
+            # Следующие кандидаты на вытеснение
+            'lru': [{'videoId': job['videoId'], 'bytes': self.job_bytes(job), 'lastAccess': job['last_access'],
+                     'committed': job['committed']} for job in lru[:candidates]],
+        }
+
+    def start(self, interval=CACHE_SWEEP_INTERVAL):
+        if self.thread is not None or interval <= 0:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sweep_loop, args=(interval,), name='cache-sweeper', daemon=True)
+        self.thread.start()
+
+    def _sweep_loop(self, interval):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Ошибка при очистке кэша")
+            if self.stop_event.wait(interval):
+                break
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
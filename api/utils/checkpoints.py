@@ -0,0 +1,116 @@
+# utils/checkpoints.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import file_size
+from utils.transcript_cache import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Переиспользовать результаты этапов прошлых запусков (0 — всегда считать заново)
+CHECKPOINTS = os.getenv('CHECKPOINTS', '1') == '1'
+CHECKPOINT_NAME = 'stages.json'
+
+
+def checkpoint_key(*parts):
+    """Ключ входов этапа: sha256 от JSON всех частей (float округляйте до нужной точности сами)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+class StageCheckpoints:
+    """
+    Манифест готовых этапов задачи (<job_dir>/stages.json): для каждого этапа — ключ его входов,
+    результат (JSON) и записанные файлы по ролям с размерами. Запуск с теми же входами берёт
+    результат отсюда, поэтому падение посередине не выбрасывает уже сделанную работу.
+    Манифест перезаписывается атомарно после каждого этапа.
+    """
+
+    def __init__(self, job_dir, enabled=CHECKPOINTS):
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, CHECKPOINT_NAME)
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stages = {}
+        if enabled:
+            try:
+                with open(self.path) as f:
+                    self.stages = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _valid(self, entry):
+        return all(file_size(os.path.join(self.job_dir, info['name'])) == info['size'] and info['size'] > 0
+                   for info in entry.get('files', {}).values())
+
+    def _save(self):
+        atomic_write_json(self.path, self.stages)
+
+    def get(self, stage, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None or entry['key'] != key or not self._valid(entry):
+                return None
+            return entry
+
+    def put(self, stage, key, result=None, files=None):
+        """Отмечает этап готовым; files — {роль: путь} внутри папки задачи."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.stages[stage] = {
+                'key': key,
+                'result': result,
+                'files': {role: {'name': os.path.basename(path), 'size': file_size(path)} for role, path in (files or {}).items()},
+                'finishedAt': time.time(),
+            }
+            self._save()
+
+    def reuse(self, targets):
+        """
+        targets — {этап: (ключ, {роль: путь})}. Для каждого этапа ищет готовый результат с тем же
+        ключом, в том числе под другим именем (клип сменил номер после изменения параметров),
+        и переносит его файлы на новые пути. Возвращает этапы, которые пересчитывать не нужно;
+        записи остальных этапов из targets удаляются, так как их файлы будут перезаписаны.
+        """
+        if not self.enabled:
+            return set()
+        with self.lock:
+            by_key = {}
+            for stage, entry in self.stages.items():
+                if self._valid(entry):
+                    by_key.setdefault(entry['key'], stage)
+            claimed = {}
+            for stage, (key, paths) in targets.items():
+                old = by_key.get(key)
+                if old is not None and set(self.stages[old]['files']) == set(paths):
+                    claimed[stage] = self.stages[old]
+                    del by_key[key]
+
+            # Сначала все файлы уходят во временные имена, чтобы перестановка клипов ничего не затёрла
+            moves = []
+            for stage, entry in claimed.items():
+                for role, info in entry['files'].items():
+                    source = os.path.join(self.job_dir, info['name'])
+                    temp = f'{source}.{stage}.reuse'
+                    os.replace(source, temp)
+                    moves.append((temp, targets[stage][1][role]))
+            for temp, path in moves:
+                os.replace(temp, path)
+
+            for stage in list(self.stages):
+                if stage in targets or any(entry is self.stages[stage] for entry in claimed.values()):
+                    del self.stages[stage]
+            for stage, entry in claimed.items():
+                self.stages[stage] = {**entry, 'files': {role: {'name': os.path.basename(path), 'size': entry['files'][role]['size']}
+                                                         for role, path in targets[stage][1].items()}}
+            self._save()
+        if claimed:
+            logger.info(f"Переиспользовано этапов из прошлого запуска: {len(claimed)} ({', '.join(sorted(claimed))})")
+        return set(claimed)
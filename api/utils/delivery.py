@@ -0,0 +1,113 @@
+# utils/delivery.py
+
+import json
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+DELIVERY_CHUNK_SIZE = 256 * 1024
+# Сколько секунд браузер может не перепроверять файл; 0 — перепроверять всегда (дёшево, через 304)
+DELIVERY_MAX_AGE = int(os.getenv('DELIVERY_MAX_AGE', '0'))
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def validators(path):
+    """Сильный ETag (inode, размер, mtime в нс) и Last-Modified файла."""
+    stat = os.stat(path)
+    etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return stat, etag, formatdate(stat.st_mtime, usegmt=True)
+
+
+def cache_headers(etag, last_modified):
+    cache_control = f'private, max-age={DELIVERY_MAX_AGE}, must-revalidate' if DELIVERY_MAX_AGE else 'no-cache'
+    return {'ETag': etag, 'Last-Modified': last_modified, 'Cache-Control': cache_control}
+
+
+def not_modified(request: Request, etag, mtime):
+    """Проверка If-None-Match / If-Modified-Since; If-None-Match важнее, как в RFC 9110."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header, size):
+    """Один диапазон bytes=a-b, bytes=a- или bytes=-n. None — отдать файл целиком, ValueError — 416."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(DELIVERY_CHUNK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def file_response(request: Request, path, media_type):
+    """
+    Отдаёт файл с поддержкой Range (206/416), If-Range и условных запросов (304),
+    так что видео начинает играть сразу, а повторный просмотр не качает файл заново.
+    """
+    stat, etag, last_modified = validators(path)
+    headers = {**cache_headers(etag, last_modified), 'Accept-Ranges': 'bytes'}
+    if not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    start, end, status_code = 0, stat.st_size - 1, 200
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    # If-Range: диапазон действителен, только если файл не изменился с прошлой загрузки
+    if range_header and (if_range is None or if_range in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{stat.st_size}'})
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    length = end - start + 1 if stat.st_size else 0
+    headers['Content-Length'] = str(length)
+    if request.method == 'HEAD':
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(iter_file(path, start, length), status_code=status_code, headers=headers, media_type=media_type)
+
+
+def json_file_response(request: Request, path):
+    """JSON-файл с ETag/Last-Modified и ответом 304, если у клиента актуальная версия."""
+    stat, etag, last_modified = validators(path)
+    headers = cache_headers(etag, last_modified)
+    if not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    with open(path) as f:
+        content = json.load(f)
+    return Response(content=json.dumps(content, ensure_ascii=False), headers=headers, media_type='application/json')
@@ -0,0 +1,178 @@
+# utils/embedding_backend.py
+
+import json
+import logging
+import os
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModel
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'DeepPavlov/rubert-base-cased')
+# torch — исходная модель в fp32, onnx-int8 — динамически квантованная модель в ONNX Runtime
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+ONNX_CACHE_DIR = os.getenv('ONNX_CACHE_DIR', '/app/cache_dir/onnx')
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))  # 0 — на усмотрение ONNX Runtime
+# Проверять ли совпадение скоров ONNX и PyTorch при экспорте (результат сохраняется рядом с моделью)
+EMBEDDING_PARITY_CHECK = os.getenv('EMBEDDING_PARITY_CHECK', '1') == '1'
+PARITY_TOLERANCE = float(os.getenv('EMBEDDING_PARITY_TOLERANCE', '0.05'))
+
+PARITY_TEXTS = [
+    'Сегодня наша команда забила решающий гол на последней минуте матча.',
+    'Смотрите, какая машина проехала по затопленной улице!',
+    'Тренер объяснил игрокам новую тактику.',
+    'Курортный город накрыл тропический ливень.',
+    'Этот человек пробежал марафон за два часа.',
+    'Ну что, начнём наш сегодняшний выпуск.',
+]
+
+
+class OnnxPoolerModel:
+    """
+    Обёртка над сессией ONNX Runtime с тем же интерфейсом, что использует ранжирование:
+    model(**inputs).pooler_output и model.config.hidden_size.
+    """
+
+    def __init__(self, onnx_path, config):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.config = config
+
+    def __call__(self, input_ids, attention_mask=None, token_type_ids=None, **kwargs):
+        input_ids = input_ids.numpy()
+        feed = {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask.numpy() if attention_mask is not None else np.ones_like(input_ids),
+            'token_type_ids': token_type_ids.numpy() if token_type_ids is not None else np.zeros_like(input_ids),
+        }
+        feed = {name: feed[name].astype(np.int64) for name in self.input_names}
+        pooler_output = self.session.run(['pooler_output'], feed)[0]
+        return SimpleNamespace(pooler_output=torch.from_numpy(pooler_output))
+
+    def eval(self):
+        return self
+
+
+def onnx_paths(model_name):
+    model_dir = os.path.join(ONNX_CACHE_DIR, re.sub(r'[^\w.-]', '_', model_name))
+    return os.path.join(model_dir, 'model.onnx'), os.path.join(model_dir, 'model.int8.onnx')
+
+
+def parity_report_path(int8_path):
+    return os.path.splitext(int8_path)[0] + '.parity.json'
+
+
+def read_parity_report(int8_path):
+    try:
+        with open(parity_report_path(int8_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_parity_report(int8_path, report):
+    with open(parity_report_path(int8_path), 'w') as f:
+        json.dump(report, f)
+
+
+def export_onnx_int8(model, tokenizer, model_name):
+    """Экспортирует модель в ONNX и квантует веса в int8. Результат кэшируется на диске."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    fp32_path, int8_path = onnx_paths(model_name)
+    if os.path.exists(int8_path):
+        return int8_path
+    os.makedirs(os.path.dirname(fp32_path), exist_ok=True)
+    logger.info(f"Экспорт {model_name} в ONNX: {fp32_path}")
+    inputs = tokenizer(['пример текста для экспорта'], return_tensors='pt')
+    # Порядок совпадает с позиционными аргументами BertModel.forward
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['pooler_output'] = {0: 'batch'}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(inputs[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state', 'pooler_output'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tmp_path = int8_path + '.tmp'
+    quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    os.remove(fp32_path)
+    logger.info(f"Квантованная модель сохранена: {int8_path}")
+    return int8_path
+
+
+def check_parity(reference_model, candidate_model, tokenizer, labels, texts=PARITY_TEXTS, tolerance=PARITY_TOLERANCE):
+    """
+    Сравнивает скоры ранжирования (сумма косинусов с метками) двух бэкендов.
+    Возвращает максимальное расхождение и совпадает ли порядок предложений.
+    """
+    from utils.key_moment_extraction import embed_texts
+
+    def scores(model):
+        labels_features = embed_texts(labels, model, tokenizer)
+        text_features = embed_texts(texts, model, tokenizer)
+        labels_features = labels_features / labels_features.norm(dim=1, keepdim=True)
+        text_features = text_features / text_features.norm(dim=1, keepdim=True)
+        return (text_features @ labels_features.t()).sum(dim=-1).numpy()
+
+    reference, candidate = scores(reference_model), scores(candidate_model)
+    max_diff = float(np.abs(reference - candidate).max())
+    same_order = bool((np.argsort(-reference) == np.argsort(-candidate)).all())
+    report = {'max_score_diff': max_diff, 'same_order': same_order, 'ok': max_diff <= tolerance}
+    if report['ok']:
+        logger.info(f"Проверка ONNX int8 пройдена: {report}")
+    else:
+        logger.warning(f"Скоры ONNX int8 расходятся с PyTorch: {report}")
+    return report
+
+
+def load_embedding_model(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL, labels=None):
+    """
+    Возвращает (model, tokenizer) для выбранного бэкенда. Если квантованная модель уже
+    в кэше, fp32-модель PyTorch не загружается вовсе: нужны только конфиг и токенизатор.
+    Проверка совпадения скоров идёт один раз, при экспорте; если она не пройдена,
+    используется PyTorch.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if backend == 'torch':
+        return AutoModel.from_pretrained(model_name).eval(), tokenizer
+    if backend != 'onnx-int8':
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    _, int8_path = onnx_paths(model_name)
+    # Без отчёта (экспорт прервался до проверки) модель проверяется заново ниже
+    report = read_parity_report(int8_path) if os.path.exists(int8_path) else None
+    if report is not None:
+        if report['ok']:
+            return OnnxPoolerModel(int8_path, AutoConfig.from_pretrained(model_name)), tokenizer
+        logger.warning(f"Квантованная модель {int8_path} не прошла проверку при экспорте ({report}), используем PyTorch")
+        return AutoModel.from_pretrained(model_name).eval(), tokenizer
+
+    torch_model = AutoModel.from_pretrained(model_name).eval()
+    int8_path = export_onnx_int8(torch_model, tokenizer, model_name)
+    onnx_model = OnnxPoolerModel(int8_path, torch_model.config)
+    if EMBEDDING_PARITY_CHECK and labels is not None:
+        report = check_parity(torch_model, onnx_model, tokenizer, labels)
+    else:
+        report = {'ok': True, 'checked': False}
+    write_parity_report(int8_path, report)
+    if not report['ok']:
+        logger.warning("Скоры ONNX int8 расходятся с PyTorch сверх допуска, используем PyTorch")
+        return torch_model, tokenizer
+    # PyTorch-модель больше не нужна: освобождаем память
+    del torch_model
+    return onnx_model, tokenizer
@@ -0,0 +1,153 @@
+# utils/job_queue.py
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Сколько задач генерации выполняется одновременно и сколько может ждать в очереди
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '2'))
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', '32'))
+# Сколько секунд хранить завершённые задачи
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATUSES = {DONE, FAILED, CANCELLED}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, key=None, params=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        # Параметры, с которыми задача действительно выполняется
+        self.params = params or {}
+        self.status = QUEUED
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def set_stage(self, stage):
+        """Отмечает текущий этап и прерывает задачу, если её отменили."""
+        self.check_cancelled()
+        self.stage = stage
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def to_dict(self):
+        return {
+            'jobId': self.id,
+            'videoId': self.key,
+            'params': self.params,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, max_pending=MAX_PENDING_JOBS, ttl=JOB_TTL):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None, params=None, **kwargs):
+        """
+        Ставит fn(job, *args, **params, **kwargs) в очередь. Для одного key активна только одна задача:
+        если она уже есть, возвращается она, и её params могут отличаться от запрошенных.
+        """
+        with self.lock:
+            self._purge()
+            if key is not None:
+                for job in self.jobs.values():
+                    if job.key == key and job.status not in FINISHED_STATUSES:
+                        return job
+            active = sum(1 for job in self.jobs.values() if job.status not in FINISHED_STATUSES)
+            if active >= self.max_workers + self.max_pending:
+                raise QueueFull(f"Too many jobs in progress: {active}")
+            job = Job(key=key, params=params)
+            self.jobs[job.id] = job
+            job.future = self.executor.submit(self._run, job, fn, args, {**job.params, **kwargs})
+        logger.info(f"Задача {job.id} поставлена в очередь (key={key})")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Отменяет задачу: ожидающую снимает с очереди, выполняющуюся прерывает на следующем этапе."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return job
+            job.cancel_event.set()
+            if job.future is not None and job.future.cancel():
+                job.status = CANCELLED
+                job.finished_at = time.time()
+        return job
+
+    def stats(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {'max_workers': self.max_workers, 'max_pending': self.max_pending, 'jobs': counts}
+
+    def _run(self, job, fn, args, kwargs):
+        with self.lock:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = fn(job, *args, **kwargs)
+            status, error = DONE, None
+        except JobCancelled:
+            result, status, error = None, CANCELLED, None
+            logger.info(f"Задача {job.id} отменена на этапе {job.stage}")
+        except Exception as e:
+            result, status, error = None, FAILED, str(e)
+            logger.exception(f"Ошибка в задаче {job.id}")
+        with self.lock:
+            job.result = result
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
@@ -6,69 +6,173 @@ from sklearn.cluster import DBSCAN
 from transformers import AutoTokenizer, AutoModel
 import torch
 from scipy.signal import find_peaks
-from copy import deepcopy
-
-def extract_key_moments_advanced(transcription, num_clips=4, clip_len=15, labels= ['человек', 'спорт', 'машины'], model=None, tokenizer=None, words=None):
-    labels_features = []
-    for segment in labels:
-        inputs = tokenizer(segment, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = model(**inputs).pooler_output
-        labels_features.append(outputs)
-    labels_features = torch.cat(labels_features, dim=0)
-
-    text_features = []
-
-    for segment in transcription:
-        inputs = tokenizer(segment['text'], return_tensors="pt", padding=True, truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = model(**inputs).pooler_output
-        text_features.append(outputs)
-    text_features = torch.cat(text_features, dim=0)
+from utils.word_store import WordStore
+from utils.metrics import span
+from utils.visual_activity import VISUAL_WEIGHT, segment_scores, fuse_scores
+import os
+import threading
+import bisect
+
+logger = logging.getLogger(__name__)
+
+# Сколько токенов (batch_size * длина с паддингом) обрабатывается за один проход модели
+EMBED_TOKEN_BUDGET = int(os.getenv('EMBED_TOKEN_BUDGET', '8192'))
+# Сколько распознанных предложений копить перед очередным батчем при потоковой обработке
+EMBED_STREAM_BATCH = int(os.getenv('EMBED_STREAM_BATCH', '32'))
+DEFAULT_LABELS = ['человек', 'спорт', 'машины']
+
+def embed_text(text, model, tokenizer):
+    inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
+    with torch.no_grad():
+        return model(**inputs).pooler_output
+
+def embed_texts(texts, model, tokenizer, token_budget=EMBED_TOKEN_BUDGET):
+    """
+    Эмбеддинги для списка текстов. Тексты сортируются по длине и режутся на батчи так,
+    чтобы batch_size * max_len не превышал token_budget: паддинга мало, а результат
+    (с attention_mask) совпадает с поштучным embed_text.
+    """
+    if not texts:
+        return torch.empty(0, model.config.hidden_size)
+    with span('embedding', input_bytes=sum(len(text.encode('utf-8')) for text in texts), items=len(texts)):
+        encoded = tokenizer(list(texts), truncation=True, max_length=512)['input_ids']
+        order = sorted(range(len(texts)), key=lambda i: len(encoded[i]))
+        features = [None] * len(texts)
+        batch = []
+        for i in order:
+            # order отсортирован, поэтому последний добавленный текст — самый длинный в батче
+            if batch and (len(batch) + 1) * len(encoded[i]) > token_budget:
+                _embed_batch(batch, encoded, features, model, tokenizer)
+                batch = []
+            batch.append(i)
+        _embed_batch(batch, encoded, features, model, tokenizer)
+        return torch.cat(features, dim=0)
+
+def _embed_batch(batch, encoded, features, model, tokenizer):
+    inputs = tokenizer.pad({'input_ids': [encoded[i] for i in batch]}, return_tensors="pt")
+    with torch.no_grad():
+        outputs = model(**inputs).pooler_output
+    for row, i in enumerate(batch):
+        features[i] = outputs[row:row + 1]
+
+_label_features = {}
+_label_features_lock = threading.Lock()
+
+def get_label_features(labels, model, tokenizer):
+    """Эмбеддинги меток не меняются между запросами, поэтому считаются один раз на модель."""
+    key = (id(model), tuple(labels))
+    with _label_features_lock:
+        features = _label_features.get(key)
+        if features is None:
+            features = embed_texts(labels, model, tokenizer)
+            _label_features[key] = features
+        return features
+
+class SentenceEmbedder:
+    """Копит предложения по мере распознавания и эмбеддит их батчами."""
+
+    def __init__(self, model, tokenizer, batch_size=EMBED_STREAM_BATCH):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.pending = []
+        self.features = []
+
+    def add(self, text):
+        self.pending.append(text)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.features.append(embed_texts(self.pending, self.model, self.tokenizer))
+            self.pending = []
+
+    def result(self):
+        self.flush()
+        if not self.features:
+            return torch.empty(0, self.model.config.hidden_size)
+        return torch.cat(self.features, dim=0)
+
+def window_bounds(i, steps, n):
+    """
+    Границы окна вокруг предложения i после steps шагов расширения: шаги чередуются
+    влево/вправо (первый — влево), а когда одна сторона кончилась, окно растёт в другую.
+    """
+    left_capacity, right_capacity = i, n - 1 - i
+    left, right = (steps + 1) // 2, steps // 2
+    if left > left_capacity:
+        left, right = left_capacity, steps - left_capacity
+    elif right > right_capacity:
+        left, right = steps - right_capacity, right_capacity
+    return i - left, i + right
+
+def build_window(starts, ends, i, clip_len):
+    """
+    Минимальное окно вокруг i длительностью не меньше clip_len (или вся транскрипция).
+    Длительность монотонно растёт с числом шагов, поэтому ищем его бинпоиском за O(log n).
+    """
+    n = len(starts)
+    lo, hi = 0, n - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        left, right = window_bounds(i, mid, n)
+        if ends[right] - starts[left] >= clip_len:
+            hi = mid
+        else:
+            lo = mid + 1
+    return window_bounds(i, lo, n)
+
+def select_clips(transcription, scores, num_clips, clip_len, max_extra=7):
+    """
+    Строит окна вокруг лучших по score предложений и оставляет только те, что не
+    пересекаются по времени с уже выбранными (non-maximum suppression), пока не наберётся
+    num_clips клипов. Итого O(n log n): сортировка + бинпоиск окна и соседей на кандидата.
+    """
+    n = len(transcription)
+    starts = [segment['start'] for segment in transcription]
+    ends = [segment['end'] for segment in transcription]
+    order = sorted(range(n), key=lambda i: (scores[i], i), reverse=True)
+
+    clips = []
+    taken_starts, taken_ends = [], []  # выбранные интервалы, отсортированные по началу
+    for i in order:
+        if len(clips) == num_clips:
+            break
+        left, right = build_window(starts, ends, i, clip_len)
+        start = starts[left]
+        end = min(ends[right], start + clip_len + max_extra)
+        pos = bisect.bisect_left(taken_starts, start)
+        if pos > 0 and taken_ends[pos - 1] > start:
+            continue
+        if pos < len(taken_starts) and taken_starts[pos] < end:
+            continue
+        taken_starts.insert(pos, start)
+        taken_ends.insert(pos, end)
+        text = ' '.join(segment['text'] for segment in transcription[left:right + 1])
+        clips.append({'start': start, 'end': end, 'text': text})
+    return clips
+
+def extract_key_moments_advanced(transcription, num_clips=4, clip_len=15, labels=DEFAULT_LABELS, model=None, tokenizer=None, words=None, text_features=None, visual_scores=None, visual_weight=VISUAL_WEIGHT):
+    labels_features = get_label_features(labels, model, tokenizer)
+
+    # Эмбеддинги предложений могут быть посчитаны заранее, параллельно с распознаванием речи
+    if text_features is None:
+        text_features = embed_texts([segment['text'] for segment in transcription], model, tokenizer)
     labels_features = labels_features / labels_features.norm(dim=1, keepdim=True)
     text_features = text_features / text_features.norm(dim=1, keepdim=True)
     logits = text_features @ labels_features.t()
-    logits_list = list(logits.sum(dim=-1).numpy())
-    logits_idx = sorted([[logits_list[i], i] for i in range(len(logits_list))])[::-1][:num_clips]
-    clips = []
-    for clip in logits_idx:
-        i_clip = clip[1]
-        start = transcription[i_clip]['start']
-        end = transcription[i_clip]['end']
-        text = transcription[i_clip]['text']
-        left = True
-        left_ind = i_clip
-        right_ind = i_clip
-        while True:
-            if end - start >= clip_len or (right_ind + 1 == len(transcription) and left_ind == 0):
-                clips.append({'start': start, 'end': end, 'text': text})
-                break
-            if left and left_ind != 0:
-                left = False
-                left_ind -= 1
-                start = transcription[left_ind]['start']
-                text = transcription[left_ind]['text'] + ' ' + text
-            elif right_ind + 1 != len(transcription):
-                left = True
-                right_ind += 1
-                end = transcription[right_ind]['end']
-                text = text + ' ' + transcription[right_ind]['text']
-                pass
+    scores = logits.sum(dim=-1).numpy()
+    # Посекундный визуальный скор усредняется по каждому предложению и смешивается с текстовым
+    if visual_scores is not None and len(visual_scores) and visual_weight > 0:
+        sentence_visual = segment_scores(visual_scores, [segment['start'] for segment in transcription], [segment['end'] for segment in transcription])
+        scores = fuse_scores(scores, sentence_visual, visual_weight)
+    with span('window_building', items=len(transcription), num_clips=num_clips):
+        clips = select_clips(transcription, scores, num_clips, clip_len)
     words_for_clips = []
-    for i in range(len(clips)):
-        if clips[i]['end'] + clips[i]['start'] >= clip_len + 7:
-            clips[i]['end'] = clips[i]['start'] + clip_len + 7
 
     if words is not None:
+        word_store = WordStore.from_records(words)
         for clip in clips:
-            words_for_clip = []
-            for word in words:
-                if  word['start'] >= clip['start']:
-                    word_new = deepcopy(word)
-                    word_new['start'] -= clip['start']
-                    word_new['end'] -= clip['start']
-                    words_for_clip.append(word_new)
-                if word['end'] >= clip['end']:
-                    break
-            words_for_clips.append(words_for_clip)
+            words_for_clips.append(word_store.slice(clip['start'], clip['end']))
     return clips, words_for_clips
\ No newline at end of file
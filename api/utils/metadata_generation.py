@@ -1,19 +1,32 @@
 # utils/metadata_generation.py
 
+import asyncio
+import hashlib
 import logging
 import json
-from openai import OpenAI
+import os
+import threading
+from collections import OrderedDict
+from openai import AsyncOpenAI
 import re
+from utils.transcript_cache import atomic_write_json
 
 logger = logging.getLogger(__name__)
 
-# Инициализация клиента OpenAI
-base_url = "http://195.242.25.2:8002/v1"
-openai_api_key = "EMPTY"
-client = OpenAI(
-    base_url=base_url,
-    api_key=openai_api_key,
-)
+# OpenAI-совместимый сервер (vLLM); для офлайн-тестов — benchmarks/stub_llm_server.py
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', "http://195.242.25.2:8002/v1")
+LLM_API_KEY = os.getenv('LLM_API_KEY', "EMPTY")
+LLM_MODEL = os.getenv('LLM_MODEL', "Qwen/Qwen2.5-7B-Instruct")
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', '2'))
+# Сколько запросов к LLM одновременно во всём сервисе
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '8'))
+# Файлы на диске учитываются в общем бюджете CacheManager (CACHE_MAX_BYTES) и вытесняются по mtime
+METADATA_CACHE_DIR = os.getenv('METADATA_CACHE_DIR', '/app/cache_dir/metadata')
+# Сколько ответов держать в памяти (LRU)
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv('METADATA_CACHE_MAX_ENTRIES', '1024'))
+
+SYSTEM_PROMPT = "Вы - эксперт по анализу видео и генерации метаданных. Создайте метаданные на основе предоставленного описания видео."
 
 meta = {
   "title": "Крутой виральный клип",
@@ -28,35 +41,140 @@ meta = {
 }
 
 
-def generate_metadata_json(transcription):
-    try:
-        prompt = create_prompt_with_examples(transcription)
-        
-        completion = client.chat.completions.create(
-            model="Qwen/Qwen2.5-7B-Instruct",
-            messages=[
-                {"role": "system", "content": "Вы - эксперт по анализу видео и генерации метаданных. Создайте метаданные на основе предоставленного описания видео."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        metadata_json = completion.choices[0].message.content.strip()
-        logger.info(f"Полученный ответ от GPT: {metadata_json}")
-        
-        # Удаление обрамления Markdown, если оно присутствует
-        metadata_json = re.sub(r'^```json\s*|\s*```$', '', metadata_json, flags=re.MULTILINE)
-        
+class MetadataCache:
+    """
+    Ответы LLM по sha256(модель + промпт): последние max_entries в памяти и все на диске,
+    чтобы пережить рестарт. Время доступа — mtime файла, по нему CacheManager вытесняет записи.
+    """
+
+    def __init__(self, cache_dir=METADATA_CACHE_DIR, max_entries=METADATA_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model, prompt):
+        return hashlib.sha256(f'{model}\n{SYSTEM_PROMPT}\n{prompt}'.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _remember(self, key, metadata):
+        with self.lock:
+            self.memory[key] = metadata
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            metadata = self.memory.get(key)
+            if metadata is not None:
+                self.memory.move_to_end(key)
+        if metadata is None:
+            try:
+                with open(self.path(key)) as f:
+                    metadata = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return None
+            self._remember(key, metadata)
         try:
-            metadata = json.loads(metadata_json)
-            logger.info("Метаданные успешно сгенерированы в формате JSON")
-            return metadata
-        except json.JSONDecodeError as json_error:
-            logger.error(f"Ошибка парсинга JSON: {str(json_error)}")
-            logger.error(f"Проблемный JSON: {metadata_json}")
-            return meta
+            # Отметка доступа для вытеснения по mtime
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return metadata
+
+    def put(self, key, metadata):
+        self._remember(key, metadata)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            atomic_write_json(self.path(key), metadata)
+        except OSError:
+            logger.exception("Не удалось сохранить метаданные в кэш")
+
+
+cache = MetadataCache()
+
+# Один event loop в фоновом потоке на весь процесс: на нём живут пул соединений клиента
+# и общий семафор, так что лимит параллельных запросов действует для всех задач сразу
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+_semaphore = None
+
+
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='llm-loop', daemon=True).start()
+        return _loop
+
+
+def get_client():
+    """Клиент и семафор создаются внутри фонового loop-а и переиспользуются."""
+    global _client, _semaphore
+    if _client is None:
+        _client = AsyncOpenAI(base_url=LLM_BASE_URL, api_key=LLM_API_KEY, timeout=LLM_TIMEOUT, max_retries=LLM_RETRIES)
+        _semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    return _client, _semaphore
+
+
+def parse_metadata(content):
+    # Удаление обрамления Markdown, если оно присутствует
+    metadata_json = re.sub(r'^```json\s*|\s*```$', '', content.strip(), flags=re.MULTILINE)
+    try:
+        metadata = json.loads(metadata_json)
+    except json.JSONDecodeError as json_error:
+        logger.error(f"Ошибка парсинга JSON: {str(json_error)}")
+        logger.error(f"Проблемный JSON: {metadata_json}")
+        return None
+    if not isinstance(metadata, dict):
+        logger.error(f"Ответ LLM не является JSON-объектом: {metadata_json}")
+        return None
+    return metadata
+
+
+async def generate_metadata_async(transcription, model=LLM_MODEL):
+    """Метаданные одного клипа; при таймауте, ошибке сервера или битом JSON возвращается meta."""
+    prompt = create_prompt_with_examples(transcription)
+    key = cache.key(model, prompt)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    client, semaphore = get_client()
+    try:
+        async with semaphore:
+            # Повторы с экспоненциальной паузой при сетевых ошибках, 429 и 5xx делает сам клиент
+            completion = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+        content = completion.choices[0].message.content
+        logger.info(f"Полученный ответ от GPT: {content}")
     except Exception as e:
-        logger.exception(f"Ошибка в generate_metadata_json: {str(e)}")
+        logger.exception(f"Ошибка в generate_metadata_async: {str(e)}")
         return meta
+    metadata = parse_metadata(content or '')
+    if metadata is None:
+        return meta
+    logger.info("Метаданные успешно сгенерированы в формате JSON")
+    cache.put(key, metadata)
+    return metadata
+
+
+def generate_metadata_json(transcription, model=LLM_MODEL):
+    """
+    Синхронная обёртка для потоков задач генерации. Этапы клипов вызывают её параллельно,
+    а запросы всех задач идут через общий loop и семафор LLM_CONCURRENCY.
+    """
+    return asyncio.run_coroutine_threadsafe(generate_metadata_async(transcription, model), get_loop()).result()
 
 def create_prompt_with_examples(transcription):
     examples = [
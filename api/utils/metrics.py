@@ -0,0 +1,80 @@
+# utils/metrics.py
+
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+logger = logging.getLogger('spans')
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+SIZE_BUCKETS = tuple(2 ** power for power in range(10, 34, 2))  # 1 КБ … 8 ГБ
+
+STAGE_SECONDS = Histogram('clipper_stage_duration_seconds', 'Длительность этапа пайплайна', ['stage'], buckets=DURATION_BUCKETS)
+STAGE_INPUT_BYTES = Histogram('clipper_stage_input_bytes', 'Размер входных данных этапа', ['stage'], buckets=SIZE_BUCKETS)
+STAGE_BYTES_WRITTEN = Counter('clipper_stage_bytes_written_total', 'Сколько байт записал этап', ['stage'])
+STAGE_ERRORS = Counter('clipper_stage_errors_total', 'Сколько раз этап завершился ошибкой', ['stage'])
+JOB_SECONDS = Histogram('clipper_job_duration_seconds', 'Длительность задачи генерации целиком', ['status'], buckets=DURATION_BUCKETS)
+CACHE_BYTES = Gauge('clipper_cache_bytes', 'Сколько занимают кэш задач и исходные видео (на момент последней очистки)')
+CACHE_FREED_BYTES = Counter('clipper_cache_freed_bytes_total', 'Сколько байт освободила очистка кэша', ['reason'])
+
+
+def stage_label(stage):
+    """render[3] -> render: номер клипа в метку не идёт, иначе метрик станет по одной на клип."""
+    return re.sub(r'\[\d+\]$', '', stage)
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def observe(record):
+    """Экспортирует завершённый span в метрики и пишет его в лог одной JSON-строкой."""
+    label = stage_label(record['stage'])
+    STAGE_SECONDS.labels(label).observe(record['seconds'])
+    if record.get('input_bytes') is not None:
+        STAGE_INPUT_BYTES.labels(label).observe(record['input_bytes'])
+    if record.get('bytes_written'):
+        STAGE_BYTES_WRITTEN.labels(label).inc(record['bytes_written'])
+    if record.get('error'):
+        STAGE_ERRORS.labels(label).inc()
+    logger.info(json.dumps({'span': record['stage'], **{k: v for k, v in record.items() if k != 'stage'}}, ensure_ascii=False))
+
+
+@contextmanager
+def measure(stage, **fields):
+    """
+    Замеряет этап, ничего не экспортируя: нужно там, где метрики живут в другом процессе
+    (рендер в пуле процессов возвращает record родителю). Внутри блока в record можно
+    дописать bytes_written и другие поля.
+    """
+    record = {'stage': stage, **fields}
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - start
+
+
+@contextmanager
+def span(stage, **fields):
+    """measure + observe: замер этапа в текущем процессе."""
+    try:
+        with measure(stage, **fields) as record:
+            yield record
+    finally:
+        observe(record)
+
+
+def metrics_response():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,83 @@
+# utils/model_loader.py
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Загружать ли модели в фоне сразу после старта, не дожидаясь первого запроса
+WARMUP_MODELS = os.getenv('WARMUP_MODELS', '1') == '1'
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class LazyModel:
+    """
+    Модель, которая загружается при первом обращении (или при прогреве).
+    Загрузка потокобезопасна: параллельные запросы ждут одну и ту же загрузку.
+    """
+
+    def __init__(self, name, loader, required=True):
+        self.name = name
+        self.loader = loader
+        self.required = required
+        self.value = None
+        self.loaded = False
+        self.error = None
+        self.load_time = None
+        self.lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def get(self):
+        if self.loaded:
+            return self.value
+        with self.lock:
+            if not self.loaded:
+                start = time.perf_counter()
+                try:
+                    self.value = self.loader()
+                except Exception as e:
+                    self.error = str(e)
+                    logger.exception(f"Ошибка загрузки модели {self.name}")
+                    raise
+                self.load_time = time.perf_counter() - start
+                self.error = None
+                self.loaded = True
+                logger.info(f"Модель {self.name} загружена за {self.load_time:.1f} с")
+        return self.value
+
+    def status(self):
+        return {'loaded': self.loaded, 'required': self.required, 'load_time': self.load_time, 'error': self.error}
+
+
+def warm_up(models=None):
+    """Загружает модели в фоновом потоке; ошибки остаются в status() и видны в /readyz."""
+    models = list(models) if models is not None else [m for m in _registry if m.required]
+
+    def run():
+        for model in models:
+            try:
+                model.get()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness(warmup=WARMUP_MODELS):
+    """
+    С прогревом сервис готов, когда загружены все обязательные модели. Без прогрева модели грузит
+    только первая задача, а задачи не придут на неготовую реплику — поэтому ленивые модели
+    считаются готовыми, а их ошибки видны в status.
+    """
+    with _registry_lock:
+        models = list(_registry)
+    status = {model.name: model.status() for model in models}
+    ready = not warmup or all(model.loaded for model in models if model.required)
+    return ready, status
@@ -1,5 +1,8 @@
 import subprocess
 import json
+import logging
+import math
+import os
 import imageio
 from PIL import Image
 import numpy as np
@@ -8,6 +11,8 @@ from moviepy.editor import *
 import cv2
 from moviepy.video.fx.all import crop
 
+logger = logging.getLogger(__name__)
+
 def get_video_metadata(video_path):
     # Run ffprobe command
     command = [
@@ -19,75 +24,293 @@ def get_video_metadata(video_path):
     metadata = json.loads(result.stdout)
     return metadata
 
+# Сколько клипов резать одним вызовом ffmpeg (у каждого клипа свой вход с быстрым seek)
+CUT_MAX_OUTPUTS = int(os.getenv('CUT_MAX_OUTPUTS', '16'))
+# Потоков на одно кодирование, если их не задал планировщик рендера (0 — на усмотрение ffmpeg)
+ENCODE_THREADS = int(os.getenv('ENCODE_THREADS', '0'))
+
+_geometry_cache = {}
+
+def get_crop_geometry(video_path, target_aspect_ratio=9/16):
+    """
+    Один ffprobe на исходник: размеры с учётом SAR и область кропа под target_aspect_ratio.
+    Результат кэшируется по (путь, размер, mtime), так что повторные нарезки не пробят файл заново.
+    """
+    stat = os.stat(video_path)
+    key = (os.path.realpath(video_path), stat.st_size, stat.st_mtime_ns, target_aspect_ratio)
+    if key in _geometry_cache:
+        return _geometry_cache[key]
+    metadata = get_video_metadata(video_path=video_path)
+    stream = next(s for s in metadata['streams'] if s.get('codec_type') == 'video')
+    original_width, original_height = int(stream['width']), int(stream['height'])
+    use_convert = False
+    try:
+        # Квадратный кадр с неквадратным пикселем: сначала растягиваем до реальных пропорций
+        if original_width == original_height:
+            aspect_ratio = stream['sample_aspect_ratio']
+            aspect_ratio_w, aspect_ratio_h = int(aspect_ratio.split(':')[0]), int(aspect_ratio.split(':')[1])
+            if aspect_ratio_w > aspect_ratio_h:
+                original_width = int((original_width / aspect_ratio_h) * aspect_ratio_w)
+            else:
+                original_height = int((original_height / aspect_ratio_w) * aspect_ratio_h)
+            use_convert = True
+    except Exception as e:
+        print(e)
+        use_convert = False
+    if original_width / original_height > target_aspect_ratio:
+        new_width = int(original_height * target_aspect_ratio) // 16 * 16
+        x1 = (original_width - new_width) // 2
+        x2 = x1 + new_width
+        y1, y2 = 0, original_height
+    else:
+        new_height = int(original_width / target_aspect_ratio)
+        y1 = (original_height - new_height) // 2
+        y2 = y1 + new_height
+        x1, x2 = 0, original_width
+    crop_size = f"crop={x2 - x1}:{y2 - y1}:{x1}:{y1}"
+    # На SAR-пути масштаб и кроп идут одним фильтром, без промежуточного перекодирования
+    video_filter = f"scale={original_width}:{original_height},setsar=1,{crop_size}" if use_convert else crop_size
+    geometry = {
+        'width': original_width, 'height': original_height,
+        'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
+        'use_convert': use_convert, 'crop_size': crop_size, 'video_filter': video_filter,
+    }
+    logger.info(f"Кроп {video_path}: {geometry['crop_size']}, use_convert={use_convert}")
+    _geometry_cache[key] = geometry
+    return geometry
+
+def cut_input_args(video_path, start, end):
+    # -ss перед -i: ffmpeg прыгает к ближайшему ключевому кадру и декодирует только отрезок клипа
+    return ['-ss', f'{start:.3f}', '-t', f'{max(end - start, 0.001):.3f}', '-i', video_path]
+
+def cut_output_args(input_index, video_filter, output_file, threads=ENCODE_THREADS):
+    return [
+        '-map', f'{input_index}:v:0', '-map', f'{input_index}:a:0?',
+        '-vf', video_filter, '-c:v', 'libx264', '-threads', str(threads), '-c:a', 'aac',
+        # moov-атом в начале файла: браузер начинает играть клип, не скачивая его целиком
+        '-movflags', '+faststart', output_file,
+    ]
 
+def cut_clips(video_path, spans, output_files, video_filter, threads=ENCODE_THREADS):
+    """
+    Нарезает несколько клипов одним процессом ffmpeg: по входу с быстрым seek на клип
+    и по выходу на клип, так что декодируются только нужные отрезки исходника.
+    """
+    command = ['ffmpeg', '-y', '-nostdin', '-v', 'error']
+    for start, end in spans:
+        command += cut_input_args(video_path, start, end)
+    for i, output_file in enumerate(output_files):
+        command += cut_output_args(i, video_filter, output_file, threads)
+    return subprocess.call(command)
 
-def save_video(clips, video_path, cache_dir):
+def cut_clip(video_path, clip, output_file, geometry=None, threads=ENCODE_THREADS):
+    """Нарезка одного клипа (этап cut[i]); возвращает путь к нему."""
+    geometry = geometry or get_crop_geometry(video_path)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    if cut_clips(video_path, [(clip['start'], clip['end'])], [output_file], geometry['video_filter'], threads) != 0:
+        raise RuntimeError(f"ffmpeg failed to cut {output_file}")
+    return output_file
+
+def save_video(clips, video_path, cache_dir, batch_size=CUT_MAX_OUTPUTS, threads=ENCODE_THREADS):
+    geometry = get_crop_geometry(video_path)
     paths = []
-    target_aspect_ratio=9/16
     for i, clip in enumerate(clips):
-        start = clip['start']
-        end = clip['end']
         output_file = os.path.join(cache_dir, 'video' + str(i) + '.mp4')
-        
-        if os.path.exists(output_file):
-            os.remove(output_file)
-        output_file2 = os.path.join(cache_dir, 'video_' + str(i) + '.mp4')
-        
-        if os.path.exists(output_file2):
-            os.remove(output_file2)
-        reader = imageio.get_reader(video_path)
-        original_width, original_height = reader.get_meta_data()['size']
-        try:
-            if original_width == original_height:
-                aspect_ratio = get_video_metadata(video_path=video_path)['streams'][0]['sample_aspect_ratio']
-                aspect_ratio_w, aspect_ratio_h = int(aspect_ratio.split(':')[0]), int(aspect_ratio.split(':')[1])
-                if aspect_ratio_w > aspect_ratio_h:
-                    original_width = int((original_width / aspect_ratio_h) * aspect_ratio_w)
-                else:
-                    original_height = int((original_height / aspect_ratio_w) * aspect_ratio_h)
-                use_convert=True
-            else:
-                use_convert=False
-        except Exception as e:
-            print(e)
-            use_convert = False
-        if original_width / original_height > target_aspect_ratio:
-            new_width = int(original_height * target_aspect_ratio) // 16 * 16
-            x1 = (original_width - new_width) // 2
-            x2 = x1 + new_width
-            y1, y2 = 0, original_height
-        else:
-            new_height = int(original_width / target_aspect_ratio)
-            y1 = (original_height - new_height) // 2
-            y2 = y1 + new_height
-            x1, x2 = 0, original_width
-        #"crop=640:480:0:0"
-        height = y2 - y1
-        width = x2 - x1
-        crop_size = f"crop={width}:{height}:{x1}:{y1}"
-        print('[y1:y2, x1:x2]', y1,y2, x1, x2, crop_size)
-        print('use_convert', use_convert)
-        if use_convert:
-            command = f'''ffmpeg -i {video_path}  -ss {start} -to {end} -c:v libx264 -threads 128 -vf "scale={original_width}:{original_height}" -c:a  copy {output_file}'''
-            subprocess.call(command, shell=True)
-            command = f'''ffmpeg -i {output_file} -threads 128 -vf "{crop_size}" {output_file2}'''
-            subprocess.call(command, shell=True)
-            paths.append(output_file2)
-        else:
-            command = f'''ffmpeg -i "{video_path}" -ss {start} -to {end} -threads 128 -vf "{crop_size}" {output_file}'''
-            subprocess.call(command, shell=True)
-            paths.append(output_file)  
+        # Промежуточный файл старого двухпроходного SAR-пути больше не нужен
+        for stale in (output_file, os.path.join(cache_dir, 'video_' + str(i) + '.mp4')):
+            if os.path.exists(stale):
+                os.remove(stale)
+        paths.append(output_file)
+
+    spans = [(clip['start'], clip['end']) for clip in clips]
+    for offset in range(0, len(clips), max(batch_size, 1)):
+        batch = slice(offset, offset + max(batch_size, 1))
+        if cut_clips(video_path, spans[batch], paths[batch], geometry['video_filter'], threads) == 0:
+            continue
+        # Если общий вызов упал, режем клипы по одному, чтобы одна ошибка не ломала остальные
+        logger.warning("Групповая нарезка не удалась, режем клипы по одному")
+        for span, output_file in zip(spans[batch], paths[batch]):
+            cut_clips(video_path, [span], [output_file], geometry['video_filter'], threads)
     return paths
 
-def get_color(word):
+def get_color(word, rng=np.random):
     if len(word) >= 4:
-        if np.random.binomial(1, 0.15):
+        if rng.binomial(1, 0.15):
             return 'red'
-        if np.random.binomial(1, 0.2):
+        if rng.binomial(1, 0.2):
             return 'yellow'
     return 'white'
 
-def crop_video_to_9_16(input_video_path, output_video_path, background_audio_path=None, target_aspect_ratio=9/16, words=None):
+# Чем рендерить финальный клип: ffmpeg — кроп и субтитры одним проходом, moviepy — прежний путь
+RENDER_BACKEND = os.getenv('RENDER_BACKEND', 'ffmpeg')
+CAPTION_FONT = os.getenv('CAPTION_FONT', 'Lane')
+CAPTION_FONT_SIZE = int(os.getenv('CAPTION_FONT_SIZE', '40'))
+CAPTION_POSITION = 0.8  # верхний край текста, доля высоты кадра (как set_pos(('center', 0.8)) в moviepy)
+# Цвета get_color в формате ASS (BBGGRR)
+ASS_COLORS = {'white': 'FFFFFF', 'red': '0000FF', 'yellow': '00FFFF'}
+
+def ass_time(seconds):
+    centiseconds = int(round(max(seconds, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    return f"{hours}:{minutes:02d}:{centiseconds // 100:02d}.{centiseconds % 100:02d}"
+
+def ass_text(text):
+    # Фигурные скобки и обратный слэш в ASS — управляющие символы
+    return text.strip().replace('\\', '/').replace('{', '(').replace('}', ')')
+
+def write_ass_captions(words, path, width, height, font=CAPTION_FONT, font_size=CAPTION_FONT_SIZE, seed=None):
+    """
+    Пословные субтитры в формате ASS: каждое слово показывается в своём интервале,
+    по центру на CAPTION_POSITION высоты, цветом из get_color. Размер шрифта в пикселях
+    кадра, так как PlayRes совпадает с размером выходного видео. С seed цвета
+    воспроизводимы от запуска к запуску.
+    """
+    rng = np.random.default_rng(seed) if seed is not None else np.random
+    lines = [
+        '[Script Info]',
+        'ScriptType: v4.00+',
+        f'PlayResX: {width}',
+        f'PlayResY: {height}',
+        'WrapStyle: 2',
+        'ScaledBorderAndShadow: yes',
+        '',
+        '[V4+ Styles]',
+        'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, '
+        'Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, '
+        'MarginL, MarginR, MarginV, Encoding',
+        f'Style: Word,{font},{font_size},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,0,0,8,0,0,0,1',
+        '',
+        '[Events]',
+        'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text',
+    ]
+    position = f"\\an8\\pos({width // 2},{int(height * CAPTION_POSITION)})"
+    for word in words or []:
+        text = ass_text(word['text'])
+        if not text or word['end'] <= word['start']:
+            continue
+        color = ASS_COLORS.get(get_color(word['text'], rng), ASS_COLORS['white'])
+        lines.append(f"Dialogue: 0,{ass_time(word['start'])},{ass_time(word['end'])},Word,,0,0,0,,"
+                     f"{{{position}\\c&H{color}&}}{text}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+def escape_filter_path(path):
+    return path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+# Превью для сетки клипов: низкобитрейтная копия, постер и спрайт таймлайна
+PREVIEW_ASSETS = os.getenv('PREVIEW_ASSETS', '1') == '1'
+PREVIEW_HEIGHT = int(os.getenv('PREVIEW_HEIGHT', '480'))
+PREVIEW_BITRATE = os.getenv('PREVIEW_BITRATE', '400k')
+POSTER_TIME = float(os.getenv('POSTER_TIME', '1.0'))
+SPRITE_INTERVAL = float(os.getenv('SPRITE_INTERVAL', '2'))
+SPRITE_TILE_WIDTH = 90
+SPRITE_COLUMNS = 5
+
+def render_style():
+    """Настройки, от которых зависит результат рендера клипа (входят в ключ мемоизации)."""
+    style = {'backend': RENDER_BACKEND, 'font': CAPTION_FONT, 'font_size': CAPTION_FONT_SIZE, 'assets': PREVIEW_ASSETS}
+    if PREVIEW_ASSETS:
+        style.update(preview_height=PREVIEW_HEIGHT, preview_bitrate=PREVIEW_BITRATE, poster_time=POSTER_TIME,
+                     sprite_interval=SPRITE_INTERVAL, sprite_tile_width=SPRITE_TILE_WIDTH, sprite_columns=SPRITE_COLUMNS)
+    return style
+
+def asset_paths(output_video_path):
+    base = os.path.splitext(output_video_path)[0]
+    return {
+        'preview': base + '_preview.mp4',
+        'poster': base + '_poster.jpg',
+        'sprite': base + '_sprite.jpg',
+        'sprite_layout': base + '_sprite.json',
+    }
+
+def sprite_layout(duration, width, height):
+    frames = max(1, math.ceil(duration / SPRITE_INTERVAL))
+    columns = min(frames, SPRITE_COLUMNS)
+    return {
+        'interval': SPRITE_INTERVAL,
+        'frames': frames,
+        'columns': columns,
+        'rows': math.ceil(frames / columns),
+        'tile_width': SPRITE_TILE_WIDTH,
+        'tile_height': max(2, int(round(SPRITE_TILE_WIDTH * height / width / 2)) * 2),
+    }
+
+def asset_outputs(source, audio, output_video_path, duration, width, height, threads=ENCODE_THREADS):
+    """
+    Кусок filter_complex и выходы ffmpeg, которые из одного видеопотока source делают превью,
+    постер и спрайт. Подключается к графу финального рендера, так что декодирование общее.
+    """
+    paths = asset_paths(output_video_path)
+    layout = sprite_layout(duration, width, height)
+    graph = (
+        f"[{source}]split=3[preview_in][poster_in][sprite_in];"
+        f"[preview_in]scale=-2:{PREVIEW_HEIGHT}[preview];"
+        f"[poster_in]trim=start={min(POSTER_TIME, duration / 2):.3f},scale=-2:{PREVIEW_HEIGHT}[poster];"
+        f"[sprite_in]fps=1/{SPRITE_INTERVAL},scale={layout['tile_width']}:{layout['tile_height']},"
+        f"tile={layout['columns']}x{layout['rows']}[sprite]"
+    )
+    outputs = [
+        '-map', '[preview]', '-map', audio,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', PREVIEW_BITRATE, '-maxrate', PREVIEW_BITRATE,
+        '-bufsize', '2M', '-threads', str(threads), '-c:a', 'aac', '-b:a', '64k', '-ac', '1',
+        '-movflags', '+faststart', paths['preview'],
+        '-map', '[poster]', '-frames:v', '1', '-q:v', '3', '-update', '1', paths['poster'],
+        '-map', '[sprite]', '-frames:v', '1', '-q:v', '5', '-update', '1', paths['sprite'],
+    ]
+    return graph, outputs, layout
+
+def write_sprite_layout(output_video_path, layout):
+    with open(asset_paths(output_video_path)['sprite_layout'], 'w') as f:
+        json.dump(layout, f)
+
+def render_clip_assets(output_video_path, threads=ENCODE_THREADS):
+    """Превью, постер и спрайт из уже готового клипа (для moviepy-рендера, где общего графа нет)."""
+    metadata = get_video_metadata(output_video_path)
+    stream = next(s for s in metadata['streams'] if s.get('codec_type') == 'video')
+    duration = float(metadata['format']['duration'])
+    graph, outputs, layout = asset_outputs('0:v', '0:a:0?', output_video_path, duration, int(stream['width']), int(stream['height']), threads)
+    command = ['ffmpeg', '-y', '-nostdin', '-v', 'error', '-i', output_video_path, '-filter_complex', graph] + outputs
+    subprocess.run(command, check=True)
+    write_sprite_layout(output_video_path, layout)
+    return asset_paths(output_video_path)['preview']
+
+def render_clip_ffmpeg(video_path, clip, output_video_path, words=None, geometry=None, threads=ENCODE_THREADS, assets=PREVIEW_ASSETS, caption_seed=None):
+    """
+    Финальный клип одним проходом ffmpeg прямо из исходника: быстрый seek на отрезок,
+    (растяжение SAR,) кроп 9:16 и вшитые пословные субтитры в одном графе фильтров.
+    С assets тот же граф через split выдаёт ещё превью, постер и спрайт.
+    """
+    geometry = geometry or get_crop_geometry(video_path)
+    width, height = geometry['x2'] - geometry['x1'], geometry['y2'] - geometry['y1']
+    video_filter = geometry['video_filter']
+    ass_path = None
+    if words is not None and len(words):
+        ass_path = os.path.splitext(output_video_path)[0] + '.ass'
+        write_ass_captions(words, ass_path, width, height, seed=caption_seed)
+        video_filter += f",ass='{escape_filter_path(ass_path)}'"
+    command = ['ffmpeg', '-y', '-nostdin', '-v', 'error']
+    command += cut_input_args(video_path, clip['start'], clip['end'])
+    if assets:
+        graph, outputs, layout = asset_outputs('assets', '0:a:0?', output_video_path, clip['end'] - clip['start'], width, height, threads)
+        command += ['-filter_complex', f"[0:v]{video_filter},split=2[final][assets];{graph}",
+                    '-map', '[final]', '-map', '0:a:0?', '-c:v', 'libx264', '-threads', str(threads), '-c:a', 'aac',
+                    '-movflags', '+faststart', output_video_path] + outputs
+    else:
+        command += cut_output_args(0, video_filter, output_video_path, threads)
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        if ass_path and os.path.exists(ass_path):
+            os.remove(ass_path)
+    if assets:
+        write_sprite_layout(output_video_path, layout)
+    logger.info(f"Video successfully cropped and saved to {output_video_path}")
+    return output_video_path
+
+def crop_video_to_9_16(input_video_path, output_video_path, background_audio_path=None, target_aspect_ratio=9/16, words=None, threads=None, caption_seed=None):
     if 1:
         reader = imageio.get_reader(input_video_path)
         mp_clip = mpe.VideoFileClip(input_video_path)
@@ -96,9 +319,10 @@ def crop_video_to_9_16(input_video_path, output_video_path, background_audio_pat
         print('original_width, original_height111', original_width, original_height)
         cropped_clip = mp_clip#crop(mp_clip, x1=x1, y1=y1, x2=x2, y2=y2)#mpe.VideoFileClip(temp_video_path)
         if words is not None:
+            rng = np.random.default_rng(caption_seed) if caption_seed is not None else np.random
             texts = []
             for i in range(len(words)):
-                text = TextClip(words[i]['text'], fontsize=40, color=get_color(words[i]['text']), font="Lane",)
+                text = TextClip(words[i]['text'], fontsize=40, color=get_color(words[i]['text'], rng), font="Lane",)
 
                 # Set the duration for which the text will be visible
                 text = text.set_duration(words[i]['end'] - words[i]['start'])  # Visible for 5 seconds
@@ -120,8 +344,10 @@ def crop_video_to_9_16(input_video_path, output_video_path, background_audio_pat
             final_clip = cropped_clip.set_audio(mp_clip.audio)
 
         # Write the final output video with audio preserved or combined
-        final_clip.write_videofile(output_video_path, codec='libx264', audio_codec='aac')
+        final_clip.write_videofile(output_video_path, codec='libx264', audio_codec='aac', threads=threads or None,
+                                   ffmpeg_params=['-movflags', '+faststart'])
         print(f"Video successfully cropped and saved to {output_video_path}")
+        return output_video_path
 
     else:
         print(f"Error: {str(e)}")
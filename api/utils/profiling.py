@@ -0,0 +1,48 @@
+# utils/profiling.py
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Профилировать каждую задачу генерации (иначе — только по ?profile=true)
+PROFILE_JOBS = os.getenv('PROFILE_JOBS', '0') == '1'
+
+
+class JobProfiler:
+    """
+    cProfile для одной задачи. cProfile видит только свой поток, поэтому каждый этап,
+    выполняемый в потоке, профилируется отдельно, а при dump() профили сливаются в один .pstats.
+    Этапы в пуле процессов рендера (в основном ожидание ffmpeg) не профилируются.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def wrap(self, fn):
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+            return profile.runcall(fn, *args, **kwargs)
+        return profiled
+
+    def dump(self, top=25):
+        with self.lock:
+            profiles = [profile for profile in self.profiles if profile.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.path)
+        summary = io.StringIO()
+        pstats.Stats(self.path, stream=summary).sort_stats('cumulative').print_stats(top)
+        logger.info(f"Профиль задачи сохранён в {self.path}\n{summary.getvalue()}")
+        return self.path
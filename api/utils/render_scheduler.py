@@ -0,0 +1,70 @@
+# utils/render_scheduler.py
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Сколько ядер отдаём под кодирование клипов (на все задачи сразу)
+RENDER_CPU_BUDGET = int(os.getenv('RENDER_CPU_BUDGET', str(os.cpu_count() or 1)))
+# Сколько клипов кодируется одновременно во всём сервисе; бюджет ядер делится между ними
+RENDER_MAX_PARALLEL = int(os.getenv('RENDER_MAX_PARALLEL', str(max(1, RENDER_CPU_BUDGET // 4))))
+
+
+class RenderScheduler:
+    """
+    Общий для всех запросов пул процессов рендера. Одновременно идёт не больше max_parallel
+    кодирований, каждое получает threads_per_encode потоков, так что вместе они укладываются
+    в cpu_budget; остальные клипы ждут в очереди пула.
+    """
+
+    def __init__(self, cpu_budget=RENDER_CPU_BUDGET, max_parallel=RENDER_MAX_PARALLEL):
+        self.cpu_budget = max(1, cpu_budget)
+        self.max_parallel = max(1, min(max_parallel, self.cpu_budget))
+        self.threads_per_encode = max(1, self.cpu_budget // self.max_parallel)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: форк процесса с загруженными моделями и потоками небезопасен
+                self.executor = ProcessPoolExecutor(max_workers=self.max_parallel,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+                logger.info(f"Пул рендера: {self.max_parallel} процессов по {self.threads_per_encode} потоков")
+            return self.executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Запускает fn(*args, threads=..., **kwargs) в пуле рендера, возвращает Future."""
+        kwargs.setdefault('threads', self.threads_per_encode)
+        future = self.get_executor().submit(fn, *args, **kwargs)
+        with self.lock:
+            self.pending += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'cpu_budget': self.cpu_budget,
+                'max_parallel': self.max_parallel,
+                'threads_per_encode': self.threads_per_encode,
+                'pending': self.pending,
+            }
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+render_scheduler = RenderScheduler()
@@ -1,31 +1,177 @@
-import moviepy.editor as mp
-import requests
+import json
+import logging
 import os
+import subprocess
+import time
+import uuid
+
+import requests
+from fastapi import HTTPException
+from requests.adapters import HTTPAdapter
+from utils.transcript_cache import get_transcript_cache
+from utils.metrics import span, file_size
+
+logger = logging.getLogger(__name__)
+
+# url = "http://localhost:8000/subtitles/"
+WHISPER_URL = os.getenv('WHISPER_URL', "http://195.242.25.2:8008/subtitles/")
+WHISPER_STREAM_URL = os.getenv('WHISPER_STREAM_URL', WHISPER_URL.rstrip('/') + '/stream/')
+# Формат аудио для ASR: wav (PCM s16le), flac (без потерь, ~2x меньше) или opus (~10x меньше)
+ASR_AUDIO_FORMAT = os.getenv('ASR_AUDIO_FORMAT', 'flac')
+ASR_SAMPLE_RATE = 16000
+ASR_CONNECT_TIMEOUT = float(os.getenv('ASR_CONNECT_TIMEOUT', '10'))
+ASR_READ_TIMEOUT = float(os.getenv('ASR_READ_TIMEOUT', '1800'))
+ASR_RETRIES = int(os.getenv('ASR_RETRIES', '3'))
+
+UPLOAD_BUFFER_SIZE = 256 * 1024
+
+AUDIO_FORMATS = {
+    'wav': {'ext': 'wav', 'content_type': 'audio/wav', 'args': ['-c:a', 'pcm_s16le', '-f', 'wav']},
+    'flac': {'ext': 'flac', 'content_type': 'audio/flac', 'args': ['-c:a', 'flac', '-f', 'flac']},
+    'opus': {'ext': 'ogg', 'content_type': 'audio/ogg', 'args': ['-c:a', 'libopus', '-b:a', '24k', '-application', 'voip', '-f', 'ogg']},
+}
+
+
+def _make_session():
+    session = requests.Session()
+    # Без повторов на уровне urllib3: тело запроса — поток, все повторы (с паузой) делает post_audio
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = _make_session()
 
 
-def extract_audio(video_path: str, audio_path: str):
-    """Extract audio from video."""
+def extract_audio(video_path: str, audio_path: str, audio_format: str = ASR_AUDIO_FORMAT):
+    """Extract audio from video as 16 kHz mono, the input format Whisper works with."""
+    command = [
+        'ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', video_path,
+        '-vn', '-ac', '1', '-ar', str(ASR_SAMPLE_RATE),
+    ] + AUDIO_FORMATS[audio_format]['args'] + ['pipe:1']
     try:
-        video = mp.VideoFileClip(video_path)
-        video.audio.write_audiofile(audio_path)
+        with span('audio_extract', input_bytes=file_size(video_path), format=audio_format) as record:
+            with open(audio_path, 'wb') as f:
+                result = subprocess.run(command, stdout=f, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode(errors='replace').strip())
+            record['bytes_written'] = file_size(audio_path)
         return audio_path
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting audio: {str(e)}")
 
-def transcribe_audio(video_path, cache_dir):
-    
-    # url = "http://localhost:8000/subtitles/"
-    url = "http://195.242.25.2:8008/subtitles/"
-    model = "base"  # Specify your model here
-    audio_file_path = os.path.join(cache_dir, 'audio.wav')
+
+def iter_multipart(fields, file_field, file_path, content_type, boundary):
+    """Кодирует multipart/form-data по кусочкам, чтобы не держать весь файл в памяти."""
+    for name, value in fields.items():
+        yield (f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+               f'{value}\r\n').encode()
+    yield (f'--{boundary}\r\n'
+           f'Content-Disposition: form-data; name="{file_field}"; filename="{os.path.basename(file_path)}"\r\n'
+           f'Content-Type: {content_type}\r\n\r\n').encode()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_BUFFER_SIZE), b''):
+            yield block
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def post_audio(url, audio_file_path, content_type, model, stream=False):
+    boundary = uuid.uuid4().hex
+    last_error = None
+    for attempt in range(ASR_RETRIES + 1):
+        try:
+            response = session.post(
+                url,
+                data=iter_multipart({'request': json.dumps({'model': model})}, 'audio', audio_file_path, content_type, boundary),
+                headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+                timeout=(ASR_CONNECT_TIMEOUT, ASR_READ_TIMEOUT),
+                stream=stream,
+            )
+            if response.status_code < 400:
+                return response
+            if response.status_code < 500:
+                # 4xx не повторяем; соединение возвращаем в пул до того, как ошибка уйдёт наверх
+                response.close()
+                response.raise_for_status()
+            last_error = requests.HTTPError(f"{response.status_code} from ASR service", response=response)
+            # Ответ потоковый: без close соединение не вернётся в пул до сборки мусора
+            response.close()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = e
+        logger.warning(f"Запрос к ASR не удался (попытка {attempt + 1}): {last_error}")
+        # После последней попытки ждать нечего
+        if attempt < ASR_RETRIES:
+            time.sleep(min(2 ** attempt, 30))
+    raise last_error
+
+
+def transcribe_audio(video_path, cache_dir, model="base"):
+    transcript_cache = get_transcript_cache()
+    cache_key = transcript_cache.key(video_path, model)
+    cached = transcript_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    audio_format = AUDIO_FORMATS[ASR_AUDIO_FORMAT]
+    audio_file_path = os.path.join(cache_dir, f"audio.{audio_format['ext']}")
+    extract_audio(video_path, audio_file_path)
+    with span('asr', input_bytes=file_size(audio_file_path), model=model):
+        response = post_audio(WHISPER_URL, audio_file_path, audio_format['content_type'], model)
+        transcription = response.json()
+    transcript_cache.put(cache_key, transcription)
+    return transcription
+
+
+def iter_transcription(video_path, cache_dir, model="base"):
+    """
+    Yields transcription records from the streaming ASR endpoint as they arrive:
+    {'type': 'word', ...} and {'type': 'sentence', ...}. The complete result is
+    stored in the transcript cache; on a cache hit the cached records are replayed.
+    """
+    transcript_cache = get_transcript_cache()
+    cache_key = transcript_cache.key(video_path, model)
+    cached = transcript_cache.get(cache_key)
+    if cached is not None:
+        for word in cached['words']:
+            yield {'type': 'word', **word}
+        for sentence in cached['sentences']:
+            yield {'type': 'sentence', **sentence}
+        return
+
+    audio_format = AUDIO_FORMATS[ASR_AUDIO_FORMAT]
+    audio_file_path = os.path.join(cache_dir, f"audio.{audio_format['ext']}")
     extract_audio(video_path, audio_file_path)
-    # Open the audio file
-    with open(audio_file_path, 'rb') as audio_file:
-        files = {
-            'audio': audio_file,  # Send the audio file
-            'request': '{"model": "' + model + '"}'  # Send the model info as a JSON string
-        }
-        response = requests.post(url, files=files)
+    transcription = {'sentences': [], 'words': []}
+    # Время потока целиком, включая обработку предложений потребителем по ходу
+    with span('asr', input_bytes=file_size(audio_file_path), model=model, streaming=True), \
+            post_audio(WHISPER_STREAM_URL, audio_file_path, audio_format['content_type'], model, stream=True) as response:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            record_type = record.pop('type')
+            if record_type == 'error':
+                raise RuntimeError(f"ASR service error: {record.get('detail')}")
+            if record_type == 'done':
+                break
+            transcription[record_type + 's'].append(record)
+            yield {'type': record_type, **record}
+        else:
+            raise RuntimeError("ASR stream ended before the transcription was complete")
+    transcript_cache.put(cache_key, transcription)
 
-    return  response.json()
 
+def transcribe_audio_streaming(video_path, cache_dir, model="base", on_sentence=None):
+    """
+    Same result as transcribe_audio, but on_sentence is called for every sentence
+    as soon as the ASR service finishes it, so work on early sentences overlaps with ASR.
+    """
+    transcription = {'sentences': [], 'words': []}
+    for record in iter_transcription(video_path, cache_dir, model):
+        record_type = record.pop('type')
+        transcription[record_type + 's'].append(record)
+        if record_type == 'sentence' and on_sentence is not None:
+            on_sentence(record)
+    return transcription
@@ -0,0 +1,133 @@
+# utils/stage_graph.py
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import measure, observe, file_size
+
+logger = logging.getLogger(__name__)
+
+# Сколько этапов одной задачи (ASR, LLM-запросы, ожидание рендера) может идти одновременно
+STAGE_THREADS = int(os.getenv('STAGE_THREADS', '8'))
+
+
+class TimedStage:
+    """
+    Выполняет этап под measure() и возвращает (результат, span). Объект сериализуемый,
+    поэтому работает и в пуле процессов: span экспортируется в метрики уже в родителе.
+    """
+
+    def __init__(self, name, fn, fields):
+        self.name = name
+        self.fn = fn
+        self.fields = fields
+
+    def __call__(self, *args, **kwargs):
+        with measure(self.name, **self.fields) as record:
+            result = self.fn(*args, **kwargs)
+            # Этапы, которые пишут файл, возвращают путь к нему
+            if isinstance(result, str):
+                record['bytes_written'] = file_size(result)
+        return result, record
+
+
+class Stage:
+    def __init__(self, name, fn, deps, submit):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.submit = submit
+        self.future = None
+        self.started_at = None
+        self.finished_at = None
+
+
+class StageGraph:
+    """
+    Этапы задачи в виде DAG: каждый этап запускается, как только готовы все его зависимости,
+    и получает их результаты позиционными аргументами. Этапы можно добавлять прямо во время
+    выполнения (например, этап ранжирования добавляет cut/render/metadata для каждого клипа).
+    По умолчанию этап выполняется в пуле потоков графа; через submit его можно отправить
+    в другой пул (например, CPU-тяжёлый рендер — в пул процессов).
+    """
+
+    def __init__(self, job=None, max_workers=STAGE_THREADS, profiler=None, fields=None):
+        self.job = job
+        self.profiler = profiler
+        # Поля, которые попадут в span каждого этапа (например, videoId)
+        self.fields = fields or {}
+        self.stages = {}
+        self.results = {}
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage')
+
+    def add(self, name, fn, deps=(), submit=None, **fields):
+        fn = TimedStage(name, fn, {**self.fields, **fields})
+        if submit is None and self.profiler is not None:
+            fn = self.profiler.wrap(fn)
+        with self.lock:
+            if name in self.stages:
+                raise ValueError(f"Stage {name} already exists")
+            self.stages[name] = Stage(name, fn, deps, submit or self.executor.submit)
+        self.events.put(None)
+
+    def _start_ready(self):
+        with self.lock:
+            ready = [stage for stage in self.stages.values()
+                     if stage.future is None and all(dep in self.results for dep in stage.deps)]
+        for stage in ready:
+            stage.started_at = time.time()
+            stage.future = stage.submit(stage.fn, *(self.results[dep] for dep in stage.deps))
+            stage.future.add_done_callback(lambda _, name=stage.name: self.events.put(name))
+
+    def running(self):
+        with self.lock:
+            return [stage.name for stage in self.stages.values()
+                    if stage.future is not None and stage.name not in self.results]
+
+    def run(self):
+        """Выполняет граф до конца и возвращает результаты этапов; первая ошибка отменяет остальное."""
+        try:
+            while True:
+                self._start_ready()
+                running = self.running()
+                if not running:
+                    break
+                if self.job is not None:
+                    self.job.set_stage(', '.join(running))
+                try:
+                    name = self.events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if name is None:
+                    continue
+                stage = self.stages[name]
+                try:
+                    result, record = stage.future.result()
+                except BaseException as e:
+                    observe({'stage': name, **self.fields, 'seconds': time.time() - stage.started_at, 'error': f'{type(e).__name__}: {e}'})
+                    raise
+                stage.finished_at = time.time()
+                observe(record)
+                with self.lock:
+                    self.results[name] = result
+            pending = [stage.name for stage in self.stages.values() if stage.future is None]
+            if pending:
+                raise RuntimeError(f"Stages with unsatisfied dependencies: {pending}")
+            return self.results
+        except BaseException:
+            for stage in self.stages.values():
+                if stage.future is not None:
+                    stage.future.cancel()
+            raise
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def timings(self):
+        return {stage.name: stage.finished_at - stage.started_at
+                for stage in self.stages.values() if stage.finished_at is not None}
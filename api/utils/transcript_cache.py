@@ -0,0 +1,130 @@
+# utils/transcript_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_CACHE_DIR = os.getenv('TRANSCRIPT_CACHE_DIR', '/app/cache_dir/transcripts')
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Хэши файлов по (путь, размер, mtime), чтобы не перечитывать одно и то же видео
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def file_sha256(path):
+    stat = os.stat(path)
+    memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        digest = _file_hashes.get(memo_key)
+    if digest is not None:
+        return digest
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b''):
+            hasher.update(block)
+    digest = hasher.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = digest
+    return digest
+
+
+def atomic_write_json(path, data):
+    """Пишет JSON во временный файл рядом и переименовывает, чтобы читатели не увидели половину."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TranscriptCache:
+    """
+    Кэш транскрипций на диске: ключ — sha256 исходного файла + имя модели ASR.
+    Время доступа хранится в mtime файла, при превышении max_bytes удаляются
+    самые давно использованные записи.
+    """
+
+    def __init__(self, cache_dir=TRANSCRIPT_CACHE_DIR, max_bytes=TRANSCRIPT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, media_path, model):
+        return hashlib.sha256(f'{file_sha256(media_path)}:{model}'.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        atomic_write_json(self._path(key), value)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+                logger.info(f"Транскрипция {name} удалена из кэша")
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_transcript_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TranscriptCache()
+        return _cache
@@ -0,0 +1,191 @@
+# utils/uploads.py
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+from utils.transcript_cache import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Размер буфера при записи на диск и рекомендуемый размер чанка для клиента
+BUFFER_SIZE = 1024 * 1024
+CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+def link_or_copy(src, dst):
+    """Делает dst ссылкой на src, чтобы одинаковые файлы хранились один раз."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class UploadStore:
+    """
+    Хранилище загрузок: чанки пишутся в uploads/<id>.part, готовые файлы
+    складываются в blobs/<sha256>.<ext>, а <videoId>.<ext> ссылается на blob.
+
+    Состояние загрузки живёт на диске: подтверждённый offset — в uploads/<id>.json,
+    данные — в .part, а запись чанка и finalize идут под fcntl-блокировкой .part,
+    поэтому загрузку может продолжать любой воркер. Состояние sha256 не сериализуется:
+    в памяти лежит только ускоряющий кэш хэшера вместе с offset, до которого он досчитан,
+    а в другом процессе или после рестарта хэш пересчитывается по .part.
+    """
+
+    def __init__(self, storage_dir):
+        self.storage_dir = storage_dir
+        self.uploads_dir = os.path.join(storage_dir, 'uploads')
+        self.blobs_dir = os.path.join(storage_dir, 'blobs')
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        # upload_id -> (offset, hasher)
+        self.hashers = {}
+        self.lock = threading.Lock()
+
+    def _session_path(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError("Invalid upload id", status_code=404)
+        return os.path.join(self.uploads_dir, f'{upload_id}.json')
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.uploads_dir, f'{upload_id}.part')
+
+    @contextmanager
+    def _locked_part(self, upload_id):
+        """Открытый .part под эксклюзивной блокировкой: одна запись в загрузку за раз во всех процессах."""
+        self._session_path(upload_id)
+        try:
+            f = open(self._part_path(upload_id), 'r+b')
+        except FileNotFoundError:
+            raise UploadError("Upload not found", status_code=404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield f
+
+    def _hasher(self, upload_id, f, offset):
+        """Хэшер первых offset байт загрузки: из кэша, если он досчитан ровно до offset, иначе по файлу."""
+        with self.lock:
+            cached = self.hashers.pop(upload_id, None)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        f.seek(0)
+        remaining = offset
+        while remaining:
+            block = f.read(min(BUFFER_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+        return hasher
+
+    def _remember(self, upload_id, offset, hasher):
+        with self.lock:
+            self.hashers[upload_id] = (offset, hasher)
+
+    def init(self, video_id, ext, size=None):
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(upload_id), 'wb').close()
+        atomic_write_json(self._session_path(upload_id), {'uploadId': upload_id, 'videoId': video_id, 'ext': ext, 'size': size, 'offset': 0})
+        self._remember(upload_id, 0, hashlib.sha256())
+        return self.status(upload_id)
+
+    def session(self, upload_id):
+        path = self._session_path(upload_id)
+        try:
+            with open(path) as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Upload not found", status_code=404)
+        if 'offset' not in session:
+            # Сессия, начатая до появления offset в JSON
+            session['offset'] = os.path.getsize(self._part_path(upload_id))
+        return session
+
+    def status(self, upload_id):
+        session = self.session(upload_id)
+        session['chunkSize'] = CHUNK_SIZE
+        return session
+
+    def append(self, upload_id, offset, blocks):
+        """
+        Дописывает блоки после подтверждённого offset. offset клиента должен с ним совпадать,
+        иначе клиент получает текущий offset и продолжает с него. Хвост прерванной записи
+        (после подтверждённого offset) отбрасывается.
+        """
+        with self._locked_part(upload_id) as f:
+            session = self.session(upload_id)
+            if offset != session['offset']:
+                raise UploadError("Offset mismatch", status_code=409, offset=session['offset'])
+            hasher = self._hasher(upload_id, f, offset)
+            f.seek(offset)
+            f.truncate()
+            written = offset
+            for block in blocks:
+                written += len(block)
+                if session['size'] is not None and written > session['size']:
+                    raise UploadError("Chunk exceeds declared size", status_code=413)
+                f.write(block)
+                hasher.update(block)
+            f.flush()
+            session['offset'] = written
+            atomic_write_json(self._session_path(upload_id), session)
+            self._remember(upload_id, written, hasher)
+            return written
+
+    def finalize(self, upload_id, sha256=None):
+        with self._locked_part(upload_id) as f:
+            session = self.session(upload_id)
+            if session['size'] is not None and session['offset'] != session['size']:
+                raise UploadError("Upload is incomplete", status_code=409, offset=session['offset'])
+            digest = self._hasher(upload_id, f, session['offset']).hexdigest()
+            if sha256 is not None and sha256.lower() != digest:
+                raise UploadError("SHA-256 mismatch", status_code=422)
+            f.truncate(session['offset'])
+            blob_path, deduplicated = self.store_blob(self._part_path(upload_id), digest, session['ext'])
+            os.remove(self._session_path(upload_id))
+        file_location = self.link_video(blob_path, session['videoId'], session['ext'])
+        return {'file_location': file_location, 'sha256': digest, 'deduplicated': deduplicated}
+
+    def save_stream(self, video_id, ext, fileobj):
+        """Потоково сохраняет файл целиком (обычный /api/upload) с тем же дедупом."""
+        hasher = hashlib.sha256()
+        part_path = self._part_path(uuid.uuid4().hex)
+        with open(part_path, 'wb') as f:
+            for block in iter(lambda: fileobj.read(BUFFER_SIZE), b''):
+                f.write(block)
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        blob_path, deduplicated = self.store_blob(part_path, digest, ext)
+        file_location = self.link_video(blob_path, video_id, ext)
+        return {'file_location': file_location, 'sha256': digest, 'deduplicated': deduplicated}
+
+    def store_blob(self, part_path, digest, ext):
+        blob_path = os.path.join(self.blobs_dir, f'{digest}.{ext}')
+        if os.path.exists(blob_path):
+            os.remove(part_path)
+            logger.info(f"Файл {digest} уже загружен, используем существующую копию")
+            return blob_path, True
+        os.replace(part_path, blob_path)
+        return blob_path, False
+
+    def link_video(self, blob_path, video_id, ext):
+        file_location = os.path.join(self.storage_dir, f'{video_id}.{ext}')
+        link_or_copy(blob_path, file_location)
+        return file_location
@@ -8,72 +8,125 @@ from torchvision.models.detection import fasterrcnn_mobilenet_v3_large_320_fpn
 from transformers import AutoFeatureExtractor
 import psutil
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+from utils.model_loader import LazyModel
 
 logger = logging.getLogger(__name__)
 
-# Загрузка моделей один раз при импорте модуля
-object_detection_model = fasterrcnn_mobilenet_v3_large_320_fpn(pretrained=True).eval()
-feature_extractor = AutoFeatureExtractor.from_pretrained("microsoft/resnet-18")
-
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-object_detection_model.to(device)
+
+# Модели загружаются при первом использовании, а не при импорте модуля
+object_detection_model = LazyModel('object_detection', lambda: fasterrcnn_mobilenet_v3_large_320_fpn(pretrained=True).eval().to(device), required=False)
+feature_extractor = LazyModel('feature_extractor', lambda: AutoFeatureExtractor.from_pretrained("microsoft/resnet-18"), required=False)
+
+# Сколько кадров детектор обрабатывает за один проход и сколько декодированных кадров ждут в очереди
+DETECTION_BATCH_SIZE = int(os.getenv('DETECTION_BATCH_SIZE', '8'))
+FRAME_QUEUE_SIZE = int(os.getenv('FRAME_QUEUE_SIZE', '32'))
+# Родное разрешение fasterrcnn_mobilenet_v3_large_320_fpn: меньшая сторона 320
+DETECTION_MIN_SIZE = 320
+SCORE_THRESHOLD = 0.5
 
 def preprocess_image(frame):
-    return cv2.resize(frame, (800, 800))
+    """BGR-кадр -> RGB-тензор [0, 1], уменьшенный до родного разрешения модели, и коэффициент масштаба."""
+    height, width = frame.shape[:2]
+    scale = DETECTION_MIN_SIZE / min(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    else:
+        scale = 1.0
+    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return torch.from_numpy(image).permute(2, 0, 1).float().div_(255), scale
 
-async def check_available_memory():
+def check_available_memory():
     return psutil.virtual_memory().percent < 90
 
-def process_frame(frame, timestamp):
-    image = preprocess_image(frame)
+def decode_frames(video_path, step, frames, stop):
+    """
+    Поток-декодер: читает видео последовательно, без seek. grab() для каждого кадра дёшев,
+    полное декодирование (retrieve) — только для каждого step-го.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    frame_count = 0
+    try:
+        while not stop.is_set():
+            if not cap.grab():
+                break
+            if frame_count % step == 0:
+                if not check_available_memory():
+                    logger.warning("Мало памяти, анализ видео остановлен")
+                    break
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                image, scale = preprocess_image(frame)
+                frames.put((frame_count / fps, image, scale))
+            frame_count += 1
+    finally:
+        cap.release()
+        frames.put(None)
+
+def detect_batch(batch):
+    images = [image.to(device) for _, image, _ in batch]
     with torch.no_grad():
-        predictions = object_detection_model([torch.from_numpy(image).permute(2, 0, 1).float().to(device)])
-    
-    objects = []
-    for box, label, score in zip(predictions[0]['boxes'], predictions[0]['labels'], predictions[0]['scores']):
-        if score > 0.5:
+        predictions = object_detection_model.get()(images)
+
+    events = []
+    for (timestamp, _, scale), prediction in zip(batch, predictions):
+        objects = []
+        keep = prediction['scores'] > SCORE_THRESHOLD
+        # Рамки возвращаем в координатах исходного кадра
+        boxes = (prediction['boxes'][keep] / scale).tolist()
+        for box, label, score in zip(boxes, prediction['labels'][keep].tolist(), prediction['scores'][keep].tolist()):
             objects.append({
                 'label': COCO_INSTANCE_CATEGORY_NAMES[label],
                 'score': float(score),
-                'box': box.tolist()
+                'box': box
             })
-    
-    return {
-        'timestamp': timestamp,
-        'objects': objects
-    }
+        events.append({
+            'timestamp': timestamp,
+            'objects': objects
+        })
+    return events
 
-async def analyze_video_advanced(video_path, step=30):
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
+def run_detection(frames, batch_size=DETECTION_BATCH_SIZE):
     video_events = []
-    with ThreadPoolExecutor() as executor:
-        for frame_count in range(0, total_frames, step):
-            if not await check_available_memory():
-                break
-            
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            timestamp = frame_count / fps
-            event = await asyncio.get_event_loop().run_in_executor(
-                executor, process_frame, frame, timestamp
-            )
-            video_events.append(event)
-            
-            logger.debug(f"Обработан кадр {frame_count}/{total_frames}, найдено объектов: {len(event['objects'])}")
-            
-            await asyncio.sleep(0)
-    
+    batch = []
+    while True:
+        item = frames.get()
+        if item is not None:
+            batch.append(item)
+        if batch and (item is None or len(batch) == batch_size):
+            video_events.extend(detect_batch(batch))
+            logger.debug(f"Обработано кадров: {len(video_events)}")
+            batch = []
+        if item is None:
+            return video_events
+
+def analyze_video_sync(video_path, step=30, batch_size=DETECTION_BATCH_SIZE):
+    frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+    stop = threading.Event()
+    decoder = threading.Thread(target=decode_frames, args=(video_path, step, frames, stop), name='frame-decoder', daemon=True)
+    decoder.start()
+    try:
+        video_events = run_detection(frames, batch_size)
+    finally:
+        stop.set()
+        # Освобождаем место в очереди, чтобы декодер мог завершиться
+        while decoder.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        decoder.join()
     logger.info(f"Всего обработано кадров: {len(video_events)}, найдено объектов: {sum(len(e['objects']) for e in video_events)}")
-    cap.release()
     return video_events
 
+async def analyze_video_advanced(video_path, step=30):
+    return await asyncio.get_event_loop().run_in_executor(None, analyze_video_sync, video_path, step)
+
 # Остальные функции остаются без изменений
 
 COCO_INSTANCE_CATEGORY_NAMES = [
@@ -0,0 +1,155 @@
+# utils/visual_activity.py
+
+import logging
+import os
+import subprocess
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Включено ли визуальное скорирование и с каким весом оно смешивается с текстовым
+VISUAL_SCORING = os.getenv('VISUAL_SCORING', '1') == '1'
+VISUAL_WEIGHT = float(os.getenv('VISUAL_WEIGHT', '0.3'))
+# Веса компонент визуального скора: смена сцены, движение, лица/люди
+VISUAL_COMPONENT_WEIGHTS = {
+    'scene': float(os.getenv('VISUAL_SCENE_WEIGHT', '0.3')),
+    'motion': float(os.getenv('VISUAL_MOTION_WEIGHT', '0.4')),
+    'face': float(os.getenv('VISUAL_FACE_WEIGHT', '0.3')),
+}
+# Сколько кадров в секунду и какой ширины декодировать для анализа
+VISUAL_FPS = int(os.getenv('VISUAL_FPS', '4'))
+VISUAL_WIDTH = 160
+HIST_BINS = 16
+
+_face_cascade = None
+
+
+def get_face_cascade():
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    return _face_cascade
+
+
+# Сколько кадров читать из пайпа ffmpeg за раз: в памяти только этот блок и предыдущий кадр
+VISUAL_CHUNK_FRAMES = 256
+
+
+def probe_frame_size(video_path, width=VISUAL_WIDTH):
+    probe = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height',
+         '-of', 'csv=p=0', video_path], stdout=subprocess.PIPE, check=True)
+    src_width, src_height = map(int, probe.stdout.decode().strip().split(',')[:2])
+    # Размер задаём явно, чтобы точно знать длину кадра в байтах
+    return width, max(2, int(round(src_height * width / src_width / 2) * 2))
+
+
+def iter_small_frames(video_path, fps=VISUAL_FPS, width=VISUAL_WIDTH, chunk_frames=VISUAL_CHUNK_FRAMES):
+    """Декодирует видео ffmpeg-ом в маленькие серые кадры и отдаёт их блоками (k, h, w) uint8."""
+    width, height = probe_frame_size(video_path, width)
+    frame_size = width * height
+    command = [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', video_path, '-an',
+        '-vf', f'fps={fps},scale={width}:{height},format=gray', '-f', 'rawvideo', 'pipe:1',
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    try:
+        while True:
+            raw = process.stdout.read(frame_size * chunk_frames)
+            n = len(raw) // frame_size
+            if n:
+                yield np.frombuffer(raw[:n * frame_size], dtype=np.uint8).reshape(n, height, width)
+            if len(raw) < frame_size * chunk_frames:
+                break
+    except BaseException:
+        # Чтение прервали (ошибка или генератор закрыли раньше): ffmpeg больше не нужен
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def frame_histograms(frames):
+    """Нормированные гистограммы яркости блока кадров: (k, HIST_BINS) float32."""
+    # Смещаем номер бина на номер кадра в блоке и считаем всё одним bincount
+    bins = (frames.reshape(len(frames), -1) // (256 // HIST_BINS)).astype(np.int32)
+    bins += np.arange(len(frames), dtype=np.int32)[:, None] * HIST_BINS
+    hists = np.bincount(bins.ravel(), minlength=len(frames) * HIST_BINS).reshape(len(frames), HIST_BINS)
+    return (hists / frames[0].size).astype(np.float32)
+
+
+def normalize(values):
+    values = np.asarray(values, dtype=np.float32)
+    span = values.max() - values.min() if len(values) else 0
+    if span <= 1e-9:
+        return np.zeros_like(values)
+    return (values - values.min()) / span
+
+
+def visual_activity(video_path, fps=VISUAL_FPS, weights=VISUAL_COMPONENT_WEIGHTS):
+    """
+    Посекундный визуальный скор видео в [0, 1] и его компоненты:
+    scene — разница гистограмм соседних кадров (максимум за секунду), motion — средняя
+    абсолютная разница кадров, face — найдено ли лицо на первом кадре секунды.
+    Кадры обрабатываются блоками по мере декодирования, поэтому память не зависит от длины видео.
+    """
+    cascade = get_face_cascade()
+    motion_sums, scene_max, face = [], [], []
+    prev_frame = prev_hist = None
+    index = 0
+    for frames in iter_small_frames(video_path, fps):
+        flat = frames.reshape(len(frames), -1).astype(np.float32)
+        hists = frame_histograms(frames)
+        # Предыдущий кадр из прошлого блока идёт первым, у самого первого кадра видео разница нулевая
+        prev_flat = flat[:1] if prev_frame is None else prev_frame
+        motion = np.abs(np.diff(np.concatenate([prev_flat, flat]), axis=0)).mean(axis=1) / 255
+        prev_hists = hists[:1] if prev_hist is None else prev_hist
+        scene = 0.5 * np.abs(np.diff(np.concatenate([prev_hists, hists]), axis=0)).sum(axis=1)
+        prev_frame, prev_hist = flat[-1:], hists[-1:]
+
+        seconds = (index + np.arange(len(frames))) // fps
+        for second in range(seconds[0], seconds[-1] + 1):
+            if second == len(motion_sums):
+                motion_sums.append(0.0)
+                scene_max.append(0.0)
+                # Лица ищем на одном кадре в секунду: каскад дорогой относительно остального
+                frame = frames[second * fps - index]
+                face.append(float(len(cascade.detectMultiScale(frame, scaleFactor=1.2, minNeighbors=4, minSize=(12, 12))) > 0))
+            mask = seconds == second
+            motion_sums[second] += float(motion[mask].sum())
+            scene_max[second] = max(scene_max[second], float(scene[mask].max()))
+        index += len(frames)
+
+    if index == 0:
+        return np.zeros(0, dtype=np.float32), {}
+    components = {
+        'scene': np.array(scene_max, dtype=np.float32),
+        # Среднее по fps кадрам секунды; в неполной последней секунде недостающие кадры считаются нулями
+        'motion': np.array(motion_sums, dtype=np.float32) / fps,
+        'face': np.array(face, dtype=np.float32),
+    }
+    total = sum(weights.values()) or 1
+    score = sum(weights[name] * normalize(values) for name, values in components.items()) / total
+    return score.astype(np.float32), components
+
+
+def segment_scores(per_second_scores, starts, ends):
+    """Средний посекундный скор на интервалах [start, end) через префиксные суммы."""
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(per_second_scores) == 0:
+        return np.zeros(len(starts), dtype=np.float32)
+    prefix = np.concatenate([[0], np.cumsum(per_second_scores, dtype=np.float64)])
+    lo = np.clip(np.floor(starts).astype(np.int64), 0, len(per_second_scores) - 1)
+    hi = np.clip(np.ceil(ends).astype(np.int64), lo + 1, len(per_second_scores))
+    return ((prefix[hi] - prefix[lo]) / (hi - lo)).astype(np.float32)
+
+
+def fuse_scores(text_scores, visual_scores, weight=VISUAL_WEIGHT):
+    """Смешивает нормированные текстовый и визуальный скоры предложений."""
+    return (1 - weight) * normalize(text_scores) + weight * normalize(visual_scores)
@@ -0,0 +1,59 @@
+# utils/word_store.py
+
+import numpy as np
+
+
+class WordStore:
+    """
+    Слова транскрипции в колоночном виде: массивы начала, конца и текста.
+    Слова для клипа берутся бинпоиском, без обхода и копирования всего списка.
+    """
+
+    def __init__(self, starts, ends, texts):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.texts = np.asarray(texts, dtype=object)
+        # Конец слова у Whisper почти всегда не убывает, но на всякий случай берём
+        # накопленный максимум: тогда "первое слово с end >= t" ищется searchsorted
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    @classmethod
+    def from_records(cls, words):
+        if isinstance(words, cls):
+            return words
+        return cls([w['start'] for w in words], [w['end'] for w in words], [w['text'] for w in words])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def slice(self, start, end):
+        """
+        Слова клипа [start, end] со временем относительно start: от первого слова,
+        начавшегося не раньше start, до первого слова, закончившегося не раньше end, включительно.
+        """
+        lo = int(np.searchsorted(self.starts, start, side='left'))
+        hi = min(int(np.searchsorted(self.max_ends, end, side='left')) + 1, len(self))
+        hi = max(hi, lo)
+        return WordSlice(self.starts[lo:hi] - start, self.ends[lo:hi] - start, self.texts[lo:hi])
+
+
+class WordSlice:
+    """Слова одного клипа; поддерживает доступ как к списку словарей {'text', 'start', 'end'}."""
+
+    def __init__(self, starts, ends, texts):
+        self.starts = starts
+        self.ends = ends
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return {'text': self.texts[i], 'start': float(self.starts[i]), 'end': float(self.ends[i])}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_list(self):
+        return list(self)
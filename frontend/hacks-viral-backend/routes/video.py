@@ -2,6 +2,7 @@ from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.encoders import jsonable_encoder
 import os
+import shutil
 from config import VIDEO_STORAGE_PATH
 from utils.video_processing import split_video_into_parts
 
@@ -13,13 +14,14 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @router.post("/api/upload")
-async def upload_video(videoId: str = Form(...), file: UploadFile = File(...)):
+def upload_video(videoId: str = Form(...), file: UploadFile = File(...)):
     if not allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="Invalid file format. Only mp4, mov, 3gp, and avi are allowed.")
     
+    # Демо-бэкенд: дедуп и дозагрузка чанками есть только в сервисе api (utils/uploads.py)
     file_location = os.path.join(VIDEO_STORAGE_PATH, f"{videoId}.{file.filename.rsplit('.', 1)[1].lower()}")
     with open(file_location, "wb") as f:
-        f.write(file.file.read())
+        shutil.copyfileobj(file.file, f, 1024 * 1024)
     return {"info": f"file '{file.filename}' saved at '{file_location}'"}
 
 @router.get("/api/generate")
@@ -6,7 +6,7 @@ import Image from "next/image";
 import WorflowImg01 from "@/public/images/workflow-01.png";
 
 export default function Clips() {
-  const [clips, setClips] = useState<{ url: string, meta: any }[]>([]);
+  const [clips, setClips] = useState<{ url: string, previewUrl: string, posterUrl?: string, meta: any }[]>([]);
   const [videoId, setVideoId] = useState<string | null>(null);
 
   useEffect(() => {
@@ -24,19 +24,29 @@ export default function Clips() {
         setVideoId(storedVideoId); // Устанавливаем videoId
 
         const clipsNum = parseInt(storedClipsNum, 10);
-        const fetchedClips: { url: string, meta: any }[] = [];
-        for (let i = 1; i <= clipsNum; i++) {
-          const videoResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/part?videoId=${storedVideoId}&clipsNum=${i}`);
-          const videoBlob = await videoResponse.blob();
-          const videoUrl = URL.createObjectURL(videoBlob);
+        // Видео отдаём плееру прямой ссылкой: браузер сам запрашивает диапазоны (Range) и кэширует
+        // по ETag, поэтому воспроизведение начинается сразу. Метаданные грузим параллельно.
+        const fetchedClips = await Promise.all(
+          Array.from({ length: clipsNum }, async (_, index) => {
+            const i = index + 1;
+            const videoUrl = `${process.env.NEXT_PUBLIC_API_URL}/api/part?videoId=${storedVideoId}&clipsNum=${i}`;
+            // В сетке — лёгкое превью 480p с постером, полный клип нужен только для скачивания.
+            // Если превью выключены на сервере (PREVIEW_ASSETS=0), показываем сам клип без постера
+            const assetUrl = (kind: string) => `${process.env.NEXT_PUBLIC_API_URL}/api/${kind}?videoId=${storedVideoId}&clipsNum=${i}`;
+            const [previewResponse, metaResponse] = await Promise.all([
+              fetch(assetUrl('preview'), { method: 'HEAD' }).catch(() => null),
+              fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/meta?videoId=${storedVideoId}&clipsNum=${i}`),
+            ]);
+            const hasPreview = previewResponse?.ok ?? false;
+            const previewUrl = hasPreview ? assetUrl('preview') : videoUrl;
+            const posterUrl = hasPreview ? assetUrl('poster') : undefined;
+            const meta = await metaResponse.json();
 
-          const metaResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/meta?videoId=${storedVideoId}&clipsNum=${i}`);
-          const meta = await metaResponse.json();
+            console.log(`Metadata for clip ${i}:`, meta); // Логируем метаданные
 
-          console.log(`Metadata for clip ${i}:`, meta); // Логируем метаданные
-
-          fetchedClips.push({ url: videoUrl, meta });
-        }
+            return { url: videoUrl, previewUrl, posterUrl, meta };
+          })
+        );
         setClips(fetchedClips);
         console.log(`Number of fetched clips: ${fetchedClips.length}`);
       } else {
@@ -47,15 +57,19 @@ export default function Clips() {
     fetchClips();
   }, []);
 
-  const handleDownload = () => {
-    clips.forEach((clip, index) => {
+  const handleDownload = async () => {
+    for (const [index, clip] of clips.entries()) {
+      // Атрибут download не работает для ссылок на другой origin, поэтому скачиваем через blob
+      const response = await fetch(clip.url);
+      const blobUrl = URL.createObjectURL(await response.blob());
       const link = document.createElement('a');
-      link.href = clip.url;
+      link.href = blobUrl;
       link.download = `${clip.meta.title || `clip_${index + 1}`}.mp4`; // Use title from metadata or fallback to default
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
-    });
+      URL.revokeObjectURL(blobUrl);
+    }
   };
 
   return (
@@ -145,7 +159,8 @@ export default function Clips() {
                   {/* Image */}
                   <div key={index} className="rounded-2xl overflow-hidden p-4">
                     <VideoPlayer
-                        videoSrc={clip.url}
+                        videoSrc={clip.previewUrl}
+                        poster={clip.posterUrl}
                         videoWidth={1920}
                         videoHeight={1080}
                     />
@@ -6,6 +6,9 @@ import { useRouter } from 'next/navigation'; // Import useRouter from next/navig
 import { FaFolderOpen } from 'react-icons/fa'; // Import folder icon from react-icons
 import ReactLoading from 'react-loading'; // Импортируем ReactLoading
 
+// How many times a failed chunk is retried before the upload gives up
+const UPLOAD_RETRIES = 5;
+
 export default function UploadForm() {
   const [videoId, setVideoId] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null); // State for error messages
@@ -21,6 +24,76 @@ export default function UploadForm() {
     sessionStorage.setItem('videoId', id);
   }, []);
 
+  // Upload the file in chunks; after a network error or a restart the upload continues from the offset the server has
+  const uploadFile = async (file: File, id: string): Promise<Response> => {
+    const apiUrl = process.env.NEXT_PUBLIC_API_URL;
+    const initData = new FormData();
+    initData.append('videoId', id);
+    initData.append('filename', file.name);
+    initData.append('size', file.size.toString());
+    const initResponse = await fetch(`${apiUrl}/api/upload/init`, { method: 'POST', body: initData });
+    if (!initResponse.ok) {
+      return initResponse;
+    }
+    const session = await initResponse.json();
+    let offset: number = session.offset;
+    let retries = 0;
+    while (offset < file.size) {
+      const chunkData = new FormData();
+      chunkData.append('offset', offset.toString());
+      chunkData.append('chunk', file.slice(offset, offset + session.chunkSize));
+      try {
+        const chunkResponse = await fetch(`${apiUrl}/api/upload/${session.uploadId}`, { method: 'PUT', body: chunkData });
+        if (chunkResponse.ok) {
+          offset = (await chunkResponse.json()).offset;
+          retries = 0;
+          setLoadingMessage(`Загружаем видео на наши сервера: ${Math.floor((offset / file.size) * 100)}%`);
+          continue;
+        }
+        if (chunkResponse.status === 409) {
+          // The server has a different offset: continue from there
+          offset = (await chunkResponse.json()).detail.offset;
+          continue;
+        }
+        if (chunkResponse.status < 500 || retries >= UPLOAD_RETRIES) {
+          return chunkResponse;
+        }
+      } catch (error) {
+        if (retries >= UPLOAD_RETRIES) {
+          throw error;
+        }
+      }
+      retries += 1;
+      console.warn(`Chunk upload failed, retry ${retries} of ${UPLOAD_RETRIES}`);
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** retries));
+      const statusResponse = await fetch(`${apiUrl}/api/upload/${session.uploadId}`).catch(() => null);
+      if (statusResponse?.ok) {
+        offset = (await statusResponse.json()).offset;
+      }
+    }
+    return fetch(`${apiUrl}/api/upload/${session.uploadId}/finalize`, { method: 'POST' });
+  };
+
+  // Poll the generation job until it finishes and return the number of clips
+  const waitForJob = async (jobId: string): Promise<number | null> => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, 3000));
+      const statusResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/jobs/${jobId}`);
+      if (!statusResponse.ok) {
+        return null;
+      }
+      const status = await statusResponse.json();
+      console.log(`Job ${jobId}: ${status.status} (${status.stage})`);
+      if (status.status === 'done') {
+        const resultResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/jobs/${jobId}/result`);
+        return resultResponse.ok ? await resultResponse.json() : null;
+      }
+      if (status.status === 'failed' || status.status === 'cancelled') {
+        return null;
+      }
+    }
+  };
+
   const handleSubmit = async (event: React.FormEvent<HTMLFormElement>) => {
     event.preventDefault();
     const formData = new FormData(event.currentTarget);
@@ -56,10 +129,7 @@ export default function UploadForm() {
       setLoading(true); // Show loading indicator
       setLoadingMessage('Загружаем видео на наши сервера'); // Set loading message
       console.log('Starting upload request...');
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/upload`, {
-        method: 'POST',
-        body: formData,
-      });
+      const response = await uploadFile(file, videoId);
 
       if (response.ok) {
         console.log('Upload request successful.');
@@ -74,7 +144,13 @@ export default function UploadForm() {
 
         if (generateResponse.ok) {
           console.log('Generate request successful.');
-          const clipsNum = await generateResponse.json();
+          const job = await generateResponse.json();
+          const clipsNum = await waitForJob(job.jobId);
+          if (clipsNum === null) {
+            setLoading(false); // Hide loading indicator
+            setError('Failed to generate clips number.');
+            return;
+          }
           sessionStorage.setItem('clipsNum', clipsNum.toString());
           setLoading(false); // Hide loading indicator
           router.push('/clips'); // Redirect to the generate page
@@ -4,9 +4,10 @@ interface VideoPlayerProps {
   videoSrc: string;
   videoWidth: number;
   videoHeight: number;
+  poster?: string;
 }
 
-const VideoPlayer: React.FC<VideoPlayerProps> = ({ videoSrc, videoWidth, videoHeight }) => {
+const VideoPlayer: React.FC<VideoPlayerProps> = ({ videoSrc, videoWidth, videoHeight, poster }) => {
   const videoRef = useRef<HTMLVideoElement>(null);
 
   useEffect(() => {
@@ -21,6 +22,9 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ videoSrc, videoWidth, videoHe
       className="w-full h-auto rounded-2xl z-50 relative"
       width={videoWidth}
       height={videoHeight}
+      poster={poster}
+      // С постером файл не нужен до нажатия Play; без него грузим только метаданные
+      preload={poster ? 'none' : 'metadata'}
       controls
     >
       <source src={videoSrc} type="video/mp4" />